@@ -6,6 +6,9 @@ SQLite database management for all platform data.
 
 import sqlite3
 import os
+import queue
+import threading
+import time
 from pathlib import Path
 from contextlib import contextmanager
 from datetime import datetime
@@ -14,18 +17,112 @@ import json
 # Database path
 DB_PATH = Path(__file__).parent / "data" / "dgb_audio.db"
 
+# Connection pool size (connections are reused across requests and threads)
+POOL_SIZE = int(os.getenv("DGB_DB_POOL_SIZE", "8"))
+
+# Per-connection prepared statement cache. Pooled connections keep their
+# cache, so the constant queries below are parsed once per connection.
+STATEMENT_CACHE_SIZE = 256
+
 
 def get_db_path() -> str:
     """Get the database file path"""
     return str(DB_PATH)
 
 
+class _PooledConnection(sqlite3.Connection):
+    """Connection stamped with the database path and pool generation it was opened for"""
+    path = None
+    generation = 0
+
+
+class _ConnectionPool:
+    """Small LIFO pool of SQLite connections shared by the whole backend"""
+    
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0      # open connections, idle or checked out
+        self._generation = 0   # bumped whenever existing connections are retired
+        self._path = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._path,
+            timeout=30,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=_PooledConnection
+        )
+        conn.path = self._path
+        conn.generation = self._generation
+        conn.row_factory = sqlite3.Row  # Enable dict-like access
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + 30
+        while True:
+            with self._lock:
+                # DB_PATH can be repointed (tests, tooling); retire stale connections
+                if self._path != str(DB_PATH):
+                    self._close_idle()
+                    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+                    self._path = str(DB_PATH)
+                try:
+                    return self._idle.get_nowait()
+                except queue.Empty:
+                    pass
+                if self._created < self._max_size:
+                    self._created += 1
+                    try:
+                        return self._connect()
+                    except Exception:
+                        self._created -= 1
+                        raise
+            # Full: wait for a release (in slices, since a retired connection
+            # is closed rather than handed back and frees a slot instead)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("No database connection available")
+            try:
+                return self._idle.get(timeout=min(remaining, 0.5))
+            except queue.Empty:
+                continue
+    
+    def release(self, conn: sqlite3.Connection):
+        with self._lock:
+            if conn.generation == self._generation and conn.path == self._path:
+                self._idle.put(conn)
+                return
+            self._created -= 1
+        conn.close()
+    
+    def _close_idle(self):
+        """Close idle connections; checked-out ones are closed when released"""
+        self._generation += 1
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            self._created -= 1
+    
+    def close_all(self):
+        with self._lock:
+            self._close_idle()
+
+
+_pool = _ConnectionPool(POOL_SIZE)
+
+
 @contextmanager
 def get_connection():
-    """Context manager for database connections"""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row  # Enable dict-like access
+    """Context manager for pooled database connections"""
+    conn = _pool.acquire()
     try:
         yield conn
         conn.commit()
@@ -33,214 +130,530 @@ def get_connection():
         conn.rollback()
         raise e
     finally:
-        conn.close()
+        _pool.release(conn)
 
 
-def init_db():
-    """Initialize the database with all required tables"""
+def close_connections():
+    """Close idle pooled connections (app shutdown)"""
+    _pool.close_all()
+
+
+# ============================================================================
+# SCHEMA MIGRATIONS
+# ============================================================================
+
+def _add_column_if_missing(cursor, table: str, column: str, definition: str):
+    """ALTER TABLE ADD COLUMN for databases created before the column existed"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _migration_001_baseline(cursor):
+    # ====================================================================
+    # USERS TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        name TEXT NOT NULL,
+        plan TEXT DEFAULT 'starter',
+        role TEXT DEFAULT 'user',
+        permissions TEXT DEFAULT '[]',
+        limits TEXT DEFAULT '{}',
+        storage_used_bytes INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    
+    # ====================================================================
+    # SESSIONS TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        token TEXT UNIQUE NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    
+    # ====================================================================
+    # API KEYS TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS api_keys (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT UNIQUE NOT NULL,
+        encrypted_key TEXT NOT NULL,
+        provider TEXT DEFAULT 'openai',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    
+    # ====================================================================
+    # API USAGE TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS api_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        tokens_used INTEGER NOT NULL,
+        cost_estimate REAL NOT NULL,
+        endpoint TEXT,
+        model TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    
+    # ====================================================================
+    # PROJECTS TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS projects (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        description TEXT,
+        genre TEXT,
+        bpm INTEGER DEFAULT 120,
+        key TEXT DEFAULT 'Am',
+        status TEXT DEFAULT 'active',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    
+    # ====================================================================
+    # SAMPLES TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS samples (
+        id TEXT PRIMARY KEY,
+        user_id TEXT,
+        project_id TEXT,
+        filename TEXT NOT NULL,
+        original_name TEXT,
+        genre TEXT,
+        instrument TEXT,
+        category TEXT,
+        duration_seconds REAL,
+        file_size_bytes INTEGER,
+        file_path TEXT NOT NULL,
+        is_public INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL,
+        FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE SET NULL
+    )
+    """)
+    
+    # ====================================================================
+    # COMPOSITIONS TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS compositions (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        project_id TEXT,
+        title TEXT,
+        genre TEXT,
+        bpm INTEGER,
+        key TEXT,
+        prompt TEXT,
+        lyrics TEXT,
+        instruments TEXT,
+        midi_path TEXT,
+        audio_path TEXT,
+        duration_seconds REAL,
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE SET NULL
+    )
+    """)
+    
+    # ====================================================================
+    # SUBSCRIPTIONS TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT UNIQUE NOT NULL,
+        stripe_customer_id TEXT,
+        stripe_subscription_id TEXT,
+        plan TEXT NOT NULL,
+        status TEXT DEFAULT 'active',
+        current_period_start TIMESTAMP,
+        current_period_end TIMESTAMP,
+        canceled_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    
+    # ====================================================================
+    # SUPPORT MESSAGES TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS support_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        department TEXT DEFAULT 'general',
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    
+    # ====================================================================
+    # RECORDINGS TABLE
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS recordings (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        project_id TEXT,
+        filename TEXT NOT NULL,
+        instrument TEXT,
+        genre TEXT,
+        duration_seconds REAL,
+        file_size_bytes INTEGER,
+        file_path TEXT NOT NULL,
+        analysis TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE SET NULL
+    )
+    """)
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(token)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_user ON api_usage(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_user ON projects(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_samples_user ON samples(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_samples_genre ON samples(genre)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_compositions_user ON compositions(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recordings_user ON recordings(user_id)")
+
+
+def _migration_002_stripe_webhooks(cursor):
+    # ====================================================================
+    # STRIPE EVENTS TABLE (webhook idempotency ledger)
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stripe_events (
+        event_id TEXT PRIMARY KEY,
+        event_type TEXT NOT NULL,
+        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    
+    # ====================================================================
+    # STRIPE WEBHOOK EVENTS TABLE (append-only ingestion log)
+    # ====================================================================
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stripe_webhook_events (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT UNIQUE NOT NULL,
+        event_type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        processed_at TIMESTAMP
+    )
+    """)
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_customer ON subscriptions(stripe_customer_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_stripe_sub ON subscriptions(stripe_subscription_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_status ON stripe_webhook_events(status, seq)")
+
+
+def _migration_003_admin_user_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_plan_created ON users(plan, created_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_role_created ON users(role, created_at, id)")
+
+
+def _migration_004_quota_counters(cursor):
+    # Maintained incrementally by services.quota_service
+    _add_column_if_missing(cursor, "users", "project_count", "INTEGER DEFAULT 0")
+    _add_column_if_missing(cursor, "users", "recording_seconds_used", "REAL DEFAULT 0")
+
+
+def _migration_005_merge_models_schema(cursor):
+    # Tables/columns previously only defined by backend/models/database.py
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS project_collaborators (
+        project_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        role TEXT DEFAULT 'viewer',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (project_id, user_id),
+        FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    _add_column_if_missing(cursor, "samples", "sample_rate", "INTEGER DEFAULT 48000")
+    _add_column_if_missing(cursor, "samples", "tags", "TEXT")
+
+
+def _migration_006_generation_jobs(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS generation_jobs (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        status TEXT DEFAULT 'queued',
+        prompt TEXT NOT NULL,
+        lyrics TEXT,
+        genre TEXT,
+        bpm INTEGER,
+        key TEXT,
+        title TEXT,
+        duration REAL NOT NULL,
+        antigravity INTEGER NOT NULL,
+        seed INTEGER DEFAULT -1,
+        infer_step INTEGER NOT NULL,
+        estimated_seconds REAL,
+        audio_path TEXT,
+        composition_id TEXT,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER DEFAULT 0,
+        cancel_requested INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs(status, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_user ON generation_jobs(user_id, created_at)")
+
+
+def _migration_007_generation_cache(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS generation_cache (
+        cache_key TEXT PRIMARY KEY,
+        file_path TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        prompt TEXT,
+        duration REAL,
+        seed INTEGER,
+        hits INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_cache_lru ON generation_cache(last_used_at)")
+
+
+def _migration_008_preset_warm_pool(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS preset_warm_pool (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        preset TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        antigravity INTEGER NOT NULL,
+        duration REAL NOT NULL,
+        seed INTEGER NOT NULL,
+        audio_path TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_preset_warm_pool_preset ON preset_warm_pool(preset, id)")
+
+
+def _migration_009_fair_scheduling(cursor):
+    _add_column_if_missing(cursor, "generation_jobs", "cost", "REAL")
+    _add_column_if_missing(cursor, "generation_jobs", "weight", "REAL DEFAULT 1")
+    _add_column_if_missing(cursor, "generation_jobs", "virtual_start", "REAL")
+    _add_column_if_missing(cursor, "generation_jobs", "virtual_finish", "REAL")
+    # Jobs queued before fair scheduling go first, in arrival order
+    cursor.execute("""
+    UPDATE generation_jobs
+    SET cost = infer_step * duration, weight = 1, virtual_start = 0, virtual_finish = 0
+    WHERE virtual_finish IS NULL
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_fair ON generation_jobs(status, virtual_finish)")
+
+
+def _migration_010_generation_batches(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS generation_batches (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        lyrics TEXT,
+        genre TEXT,
+        bpm INTEGER,
+        key TEXT,
+        title TEXT,
+        duration REAL NOT NULL,
+        variant_count INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_batches_user ON generation_batches(user_id, created_at)")
+    _add_column_if_missing(cursor, "generation_jobs", "batch_id", "TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_batch ON generation_jobs(batch_id)")
+
+
+def _migration_011_support_response_cache(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS support_response_cache (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        department TEXT NOT NULL,
+        prompt_key TEXT NOT NULL,
+        normalized TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        message TEXT NOT NULL,
+        response TEXT NOT NULL,
+        tokens_used INTEGER DEFAULT 0,
+        hits INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (department, prompt_key)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_support_response_cache_dept ON support_response_cache(department, created_at)")
+
+
+def _migration_012_support_conversations(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS support_conversations (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        department TEXT DEFAULT 'general',
+        title TEXT,
+        summary TEXT,
+        summarized_through INTEGER DEFAULT 0,
+        message_count INTEGER DEFAULT 0,
+        tokens_used INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_support_conversations_user ON support_conversations(user_id, updated_at)")
+    _add_column_if_missing(cursor, "support_messages", "conversation_id", "TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_support_messages_conversation ON support_messages(conversation_id, id)")
+
+
+def _migration_013_audio_analysis_cache(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS audio_analysis_cache (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content_hash TEXT NOT NULL,
+        instrument TEXT NOT NULL,
+        genre TEXT NOT NULL,
+        source TEXT NOT NULL,
+        analysis TEXT NOT NULL,
+        size_bytes INTEGER DEFAULT 0,
+        tokens_used INTEGER DEFAULT 0,
+        hits INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (content_hash, instrument, genre)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audio_analysis_cache_used ON audio_analysis_cache(last_used_at)")
+
+
+def _migration_014_generation_job_leases(cursor):
+    # Claimed jobs belong to one worker process until their lease expires
+    _add_column_if_missing(cursor, "generation_jobs", "worker_id", "TEXT")
+    _add_column_if_missing(cursor, "generation_jobs", "lease_expires_at", "TIMESTAMP")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_lease ON generation_jobs(status, lease_expires_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_started ON generation_jobs(started_at)")
+
+
+# Ordered list of (version, name, migration). Append new migrations; never
+# renumber or edit ones that have shipped.
+MIGRATIONS = [
+    (1, "baseline", _migration_001_baseline),
+    (2, "stripe_webhooks", _migration_002_stripe_webhooks),
+    (3, "admin_user_indexes", _migration_003_admin_user_indexes),
+    (4, "quota_counters", _migration_004_quota_counters),
+    (5, "merge_models_schema", _migration_005_merge_models_schema),
+    (6, "generation_jobs", _migration_006_generation_jobs),
+    (7, "generation_cache", _migration_007_generation_cache),
+    (8, "preset_warm_pool", _migration_008_preset_warm_pool),
+    (9, "fair_scheduling", _migration_009_fair_scheduling),
+    (10, "generation_batches", _migration_010_generation_batches),
+    (11, "support_response_cache", _migration_011_support_response_cache),
+    (12, "support_conversations", _migration_012_support_conversations),
+    (13, "audio_analysis_cache", _migration_013_audio_analysis_cache),
+    (14, "generation_job_leases", _migration_014_generation_job_leases),
+]
+
+
+def run_migrations() -> list:
+    """
+    Apply pending migrations in order. Each one runs in an explicit
+    transaction (sqlite3 does not open one for DDL on its own) that also
+    records its schema_migrations row, so a failed migration leaves no
+    partial schema behind and is retried on the next start.
+    """
     with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        # ====================================================================
-        # USERS TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
             name TEXT NOT NULL,
-            plan TEXT DEFAULT 'starter',
-            role TEXT DEFAULT 'user',
-            permissions TEXT DEFAULT '[]',
-            limits TEXT DEFAULT '{}',
-            storage_used_bytes INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """)
-        
-        # ====================================================================
-        # SESSIONS TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            token TEXT UNIQUE NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-        """)
-        
-        # ====================================================================
-        # API KEYS TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS api_keys (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT UNIQUE NOT NULL,
-            encrypted_key TEXT NOT NULL,
-            provider TEXT DEFAULT 'openai',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-        """)
-        
-        # ====================================================================
-        # API USAGE TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS api_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            tokens_used INTEGER NOT NULL,
-            cost_estimate REAL NOT NULL,
-            endpoint TEXT,
-            model TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-        """)
-        
-        # ====================================================================
-        # PROJECTS TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS projects (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            description TEXT,
-            genre TEXT,
-            bpm INTEGER DEFAULT 120,
-            key TEXT DEFAULT 'Am',
-            status TEXT DEFAULT 'active',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-        """)
-        
-        # ====================================================================
-        # SAMPLES TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS samples (
-            id TEXT PRIMARY KEY,
-            user_id TEXT,
-            project_id TEXT,
-            filename TEXT NOT NULL,
-            original_name TEXT,
-            genre TEXT,
-            instrument TEXT,
-            category TEXT,
-            duration_seconds REAL,
-            file_size_bytes INTEGER,
-            file_path TEXT NOT NULL,
-            is_public INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL,
-            FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE SET NULL
-        )
-        """)
-        
-        # ====================================================================
-        # COMPOSITIONS TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS compositions (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            project_id TEXT,
-            title TEXT,
-            genre TEXT,
-            bpm INTEGER,
-            key TEXT,
-            prompt TEXT,
-            lyrics TEXT,
-            instruments TEXT,
-            midi_path TEXT,
-            audio_path TEXT,
-            duration_seconds REAL,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE SET NULL
-        )
-        """)
-        
-        # ====================================================================
-        # SUBSCRIPTIONS TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT UNIQUE NOT NULL,
-            stripe_customer_id TEXT,
-            stripe_subscription_id TEXT,
-            plan TEXT NOT NULL,
-            status TEXT DEFAULT 'active',
-            current_period_start TIMESTAMP,
-            current_period_end TIMESTAMP,
-            canceled_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-        """)
-        
-        # ====================================================================
-        # SUPPORT MESSAGES TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS support_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            department TEXT DEFAULT 'general',
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-        """)
-        
-        # ====================================================================
-        # RECORDINGS TABLE
-        # ====================================================================
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS recordings (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            project_id TEXT,
-            filename TEXT NOT NULL,
-            instrument TEXT,
-            genre TEXT,
-            duration_seconds REAL,
-            file_size_bytes INTEGER,
-            file_path TEXT NOT NULL,
-            analysis TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE SET NULL
-        )
-        """)
-        
-        # Create indexes for better query performance
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(token)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_user ON api_usage(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_user ON projects(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_samples_user ON samples(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_samples_genre ON samples(genre)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_compositions_user ON compositions(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_recordings_user ON recordings(user_id)")
-        
-        print("✅ Database initialized successfully!")
-        return True
+        applied = {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+    
+    newly_applied = []
+    for version, name, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            # Another process may have applied it while we waited for the lock
+            if cursor.execute(
+                "SELECT 1 FROM schema_migrations WHERE version = ?", (version,)
+            ).fetchone():
+                continue
+            migration(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name)
+            )
+        newly_applied.append(f"{version:03d}_{name}")
+    
+    return newly_applied
+
+
+def get_schema_version() -> int:
+    """Highest applied migration version"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+        return row[0] or 0
+
+
+def init_db():
+    """Initialize the database by applying all pending migrations"""
+    applied = run_migrations()
+    if applied:
+        print(f"🗄️ Applied migrations: {', '.join(applied)}")
+    print("✅ Database initialized successfully!")
+    return True
 
 
 def migrate_from_json():
@@ -334,7 +747,11 @@ def get_db_stats() -> dict:
         
         stats = {}
         tables = ['users', 'sessions', 'api_keys', 'api_usage', 'projects', 
-                  'samples', 'compositions', 'subscriptions', 'recordings']
+                  'samples', 'compositions', 'subscriptions', 'recordings',
+                  'stripe_events', 'stripe_webhook_events', 'project_collaborators',
+                  'generation_jobs', 'generation_cache', 'preset_warm_pool',
+                  'generation_batches', 'support_response_cache', 'support_conversations',
+                  'audio_analysis_cache']
         
         for table in tables:
             cursor.execute(f"SELECT COUNT(*) FROM {table}")
@@ -498,6 +915,76 @@ def get_user_usage_stats(user_id: str) -> dict:
         }
 
 
+# Columns returned by the admin listing (no password hash, no JSON blobs)
+ADMIN_USER_COLUMNS = "id, email, name, plan, role, storage_used_bytes, created_at"
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _user_filters(plan: str = None, role: str = None, email_prefix: str = None,
+                  created_from: str = None, created_to: str = None) -> tuple:
+    """(where clauses, params) shared by the admin listing and its count"""
+    where = []
+    params = []
+    
+    if plan:
+        where.append("plan = ?")
+        params.append(plan)
+    if role:
+        where.append("role = ?")
+        params.append(role)
+    if email_prefix:
+        # Range scan on the email index instead of LIKE
+        where.append("email >= ? AND email < ?")
+        params.extend([email_prefix, _prefix_upper_bound(email_prefix)])
+    if created_from:
+        where.append("created_at >= ?")
+        params.append(created_from)
+    if created_to:
+        where.append("created_at < ?")
+        params.append(created_to)
+    return where, params
+
+
+def list_users_page(limit: int = 50, after: tuple = None, plan: str = None,
+                    role: str = None, email_prefix: str = None,
+                    created_from: str = None, created_to: str = None) -> list:
+    """
+    Keyset-paginated user listing, newest first.
+    `after` is the (created_at, id) of the last row of the previous page.
+    Returns up to limit + 1 rows so callers can tell if there is a next page.
+    """
+    where, params = _user_filters(plan, role, email_prefix, created_from, created_to)
+    if after:
+        where.append("(created_at, id) < (?, ?)")
+        params.extend(after)
+    
+    query = f"SELECT {ADMIN_USER_COLUMNS} FROM users"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+    
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [dict_from_row(row) for row in cursor.fetchall()]
+
+
+def count_users(plan: str = None, role: str = None, email_prefix: str = None,
+                created_from: str = None, created_to: str = None) -> int:
+    """Count users matching the same filters as list_users_page"""
+    where, params = _user_filters(plan, role, email_prefix, created_from, created_to)
+    query = "SELECT COUNT(*) FROM users"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    with get_connection() as conn:
+        return conn.execute(query, params).fetchone()[0]
+
+
 def update_user(user_id: str, **kwargs) -> bool:
     """Update user fields"""
     if not kwargs:
@@ -520,14 +1007,74 @@ def update_user(user_id: str, **kwargs) -> bool:
         return cursor.rowcount > 0
 
 
+# ============================================================================
+# SUBSCRIPTION OPERATIONS
+# ============================================================================
+
+def get_subscription_by_user(user_id: str) -> dict:
+    """Get a user's subscription row"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM subscriptions WHERE user_id = ?", (user_id,))
+        return dict_from_row(cursor.fetchone())
+
+
+def get_subscription_by_customer(customer_id: str) -> dict:
+    """Get subscription by Stripe customer ID (indexed)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM subscriptions WHERE stripe_customer_id = ?", (customer_id,)
+        )
+        return dict_from_row(cursor.fetchone())
+
+
+def get_subscription_by_stripe_id(subscription_id: str) -> dict:
+    """Get subscription by Stripe subscription ID (indexed)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM subscriptions WHERE stripe_subscription_id = ?", (subscription_id,)
+        )
+        return dict_from_row(cursor.fetchone())
+
+
+def claim_stripe_event(cursor, event_id: str, event_type: str, force: bool = False) -> bool:
+    """
+    Record a Stripe event as processed inside the caller's transaction.
+    Returns False if the event was already applied (duplicate delivery),
+    unless force is set (used when replaying events).
+    """
+    verb = "INSERT OR REPLACE" if force else "INSERT OR IGNORE"
+    cursor.execute(f"""
+    {verb} INTO stripe_events (event_id, event_type)
+    VALUES (?, ?)
+    """, (event_id, event_type))
+    return cursor.rowcount > 0
+
+
 # ============================================================================
 # PROJECT OPERATIONS
 # ============================================================================
 
-def create_project(project_id: str, user_id: str, name: str, **kwargs) -> bool:
-    """Create a new project"""
+def create_project(project_id: str, user_id: str, name: str, max_projects: int = -1, **kwargs) -> bool:
+    """
+    Create a new project. With max_projects >= 0 the user's project_count
+    is checked and incremented atomically; returns False at the limit.
+    """
     with get_connection() as conn:
         cursor = conn.cursor()
+        if max_projects >= 0:
+            cursor.execute("""
+            UPDATE users SET project_count = project_count + 1
+            WHERE id = ? AND project_count < ?
+            """, (user_id, max_projects))
+        else:
+            cursor.execute(
+                "UPDATE users SET project_count = project_count + 1 WHERE id = ?", (user_id,)
+            )
+        if cursor.rowcount == 0:
+            return False
         cursor.execute("""
         INSERT INTO projects (id, user_id, name, description, genre, bpm, key)
         VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -541,6 +1088,21 @@ def create_project(project_id: str, user_id: str, name: str, **kwargs) -> bool:
         return True
 
 
+def delete_project(project_id: str, user_id: str) -> bool:
+    """Delete a project owned by user_id"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM projects WHERE id = ? AND user_id = ?", (project_id, user_id)
+        )
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute("""
+        UPDATE users SET project_count = MAX(0, project_count - 1) WHERE id = ?
+        """, (user_id,))
+        return True
+
+
 def get_user_projects(user_id: str) -> list:
     """Get all projects for a user"""
     with get_connection() as conn:
@@ -610,8 +1172,9 @@ def create_composition(comp_id: str, user_id: str, **kwargs) -> bool:
         cursor = conn.cursor()
         cursor.execute("""
         INSERT INTO compositions (id, user_id, project_id, title, genre, bpm, key,
-                                  prompt, lyrics, instruments, midi_path, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                  prompt, lyrics, instruments, midi_path, audio_path,
+                                  duration_seconds, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             comp_id, user_id,
             kwargs.get('project_id'),
@@ -623,6 +1186,8 @@ def create_composition(comp_id: str, user_id: str, **kwargs) -> bool:
             kwargs.get('lyrics'),
             json.dumps(kwargs.get('instruments', [])),
             kwargs.get('midi_path'),
+            kwargs.get('audio_path'),
+            kwargs.get('duration_seconds'),
             kwargs.get('status', 'pending')
         ))
         return True
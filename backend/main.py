@@ -4,7 +4,7 @@ DGB AUDIO - FastAPI Backend
 Main server for admin dashboard, API management, and sample processing.
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -23,6 +23,14 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Refuse oversized uploads before the form is spooled (added first so
+# CORS headers still wrap the 413)
+from services.analysis_cache import UploadLimitMiddleware
+from services.quota_service import MAX_SAMPLE_UPLOAD_BYTES
+app.add_middleware(UploadLimitMiddleware, paths=["/api/ai/analyze-audio"])
+app.add_middleware(UploadLimitMiddleware, paths=["/api/samples/upload"],
+                   max_bytes=MAX_SAMPLE_UPLOAD_BYTES)
+
 # CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -144,19 +152,57 @@ async def get_usage(token: str):
     return {"usage": usage, "plan": user.get("plan"), "limits": user.get("limits")}
 
 
+@app.get("/api/auth/quota")
+async def get_quota(token: str):
+    """Get user's storage/project/recording usage against plan limits"""
+    from services.auth_service import get_user_by_token
+    from services.quota_service import get_quota_status
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    
+    return get_quota_status(user)
+
+
 # ============================================================================
 # SUPERADMIN ENDPOINTS
 # ============================================================================
 
 @app.get("/api/admin/users")
-async def list_all_users(token: str):
-    """List all users (SuperAdmin only)"""
+async def list_all_users(
+    token: str,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    plan: Optional[str] = None,
+    role: Optional[str] = None,
+    email: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    include_total: bool = False
+):
+    """
+    List users (SuperAdmin only).
+    Keyset-paginated: pass `next_cursor` from the previous page as `cursor`.
+    `email` filters by prefix.
+    """
     from services.auth_service import get_user_by_token, get_all_users
     user = get_user_by_token(token)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    result = get_all_users(user["email"])
+    result = get_all_users(
+        user["email"],
+        limit=limit,
+        cursor=cursor,
+        plan=plan,
+        role=role,
+        email_prefix=email,
+        created_from=created_from,
+        created_to=created_to,
+        include_total=include_total
+    )
+    if result.get("error") == "Invalid cursor":
+        raise HTTPException(status_code=400, detail=result["error"])
     if "error" in result:
         raise HTTPException(status_code=403, detail=result["error"])
     return result
@@ -215,13 +261,36 @@ async def get_chat_departments():
 class ChatMessage(BaseModel):
     message: str
     department: str = "general"
-    history: List[dict] = []
+    # Server-side history: omit both to start a new conversation
+    conversation_id: Optional[str] = None
+    history: List[dict] = []  # Legacy clients that resend the history
+
+class ConversationRequest(BaseModel):
+    department: str = "general"
+    title: Optional[str] = None
+
+def _chat_conversation(user: dict, data: ChatMessage) -> tuple:
+    """
+    (conversation_id, history) for a chat message. Clients that still send
+    `history` get the old stateless behaviour; everyone else gets a
+    server-side conversation, created on the first message.
+    """
+    from services.support_conversations import create_conversation, get_conversation, build_context
+    
+    if data.conversation_id:
+        if not get_conversation(data.conversation_id, user["id"], include_messages=False):
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return data.conversation_id, build_context(data.conversation_id)
+    if data.history:
+        return None, data.history
+    return create_conversation(user["id"], data.department)["id"], []
 
 @app.post("/api/chat/send")
-async def send_chat_message(token: str, data: ChatMessage):
+async def send_chat_message(token: str, data: ChatMessage, background_tasks: BackgroundTasks):
     """Send message to AI support chat (uses user's API key)"""
     from services.auth_service import get_user_by_token, get_user_api_key, track_api_usage
     from services.support_chat import chat_with_support
+    from services.support_conversations import save_turn, summarize_if_needed
     
     user = get_user_by_token(token)
     if not user:
@@ -232,25 +301,168 @@ async def send_chat_message(token: str, data: ChatMessage):
     if not api_key:
         raise HTTPException(status_code=400, detail="OpenAI API key not configured")
     
+    conversation_id, history = _chat_conversation(user, data)
+    
     # Send to chat
     result = await chat_with_support(
         message=data.message,
         department=data.department,
         api_key=api_key,
-        conversation_history=data.history
+        conversation_history=history
     )
     
-    # Track usage if successful
-    if result.get("success"):
+    # Track usage if successful (cached answers cost nothing)
+    if result.get("success") and not result.get("cached"):
         track_api_usage(
             user["email"],
             result.get("tokens_used", 0),
             result.get("cost_estimate", 0)
         )
     
+    if conversation_id and result.get("success"):
+        save_turn(conversation_id, user["id"], data.department, data.message,
+                  result["message"], result.get("tokens_used", 0))
+        result["conversation_id"] = conversation_id
+        background_tasks.add_task(summarize_if_needed, conversation_id, api_key)
+    
     return result
 
 
+@app.post("/api/chat/conversations")
+async def create_chat_conversation(token: str, data: ConversationRequest):
+    """Start a server-side support conversation"""
+    from services.auth_service import get_user_by_token
+    from services.support_conversations import create_conversation
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    return create_conversation(user["id"], data.department, data.title)
+
+
+@app.get("/api/chat/conversations")
+async def list_chat_conversations(token: str, limit: int = 20):
+    """The user's recent support conversations"""
+    from services.auth_service import get_user_by_token
+    from services.support_conversations import list_conversations
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    return {"conversations": list_conversations(user["id"], min(limit, 100))}
+
+
+@app.get("/api/chat/conversations/{conversation_id}")
+async def get_chat_conversation(conversation_id: str, token: str):
+    """A conversation with its summary and stored messages"""
+    from services.auth_service import get_user_by_token
+    from services.support_conversations import get_conversation
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    conversation = get_conversation(conversation_id, user["id"])
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+
+@app.delete("/api/chat/conversations/{conversation_id}")
+async def delete_chat_conversation(conversation_id: str, token: str):
+    """Delete a conversation and its messages"""
+    from services.auth_service import get_user_by_token
+    from services.support_conversations import delete_conversation
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    if not delete_conversation(conversation_id, user["id"]):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"success": True, "conversation_id": conversation_id}
+
+
+def _sse_response(request: Request, events, record_usage, on_done=None, background=None):
+    """
+    Server-Sent Events from an async generator of {"type": ...} dicts.
+    Usage is recorded once the stream ends; if the client disconnects
+    first, the generator is closed (cancelling the upstream call) and the
+    text already generated is billed at ~4 characters per token.
+    on_done(event) may annotate the final event before it is sent.
+    """
+    from fastapi.responses import StreamingResponse
+    
+    async def body():
+        final = None
+        streamed_chars = 0
+        try:
+            async for event in events:
+                if await request.is_disconnected():
+                    break
+                if event["type"] == "token":
+                    streamed_chars += len(event["content"])
+                elif event["type"] == "done":
+                    final = event
+                    if on_done:
+                        on_done(event)
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            await events.aclose()
+            if final is not None:
+                if not final.get("cached"):
+                    record_usage(final.get("tokens_used", 0))
+            elif streamed_chars:
+                record_usage(max(1, streamed_chars // 4))
+    
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background
+    )
+
+@app.post("/api/chat/stream")
+async def stream_chat_message(token: str, data: ChatMessage, request: Request):
+    """Streaming /api/chat/send: tokens arrive as SSE "token" events, then "done" """
+    from starlette.background import BackgroundTask
+    from services.auth_service import get_user_by_token, get_user_api_key, track_api_usage
+    from services.support_chat import stream_support_chat, estimate_cost
+    from services.support_conversations import save_turn, summarize_if_needed
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    api_key = get_user_api_key(user["email"])
+    if not api_key:
+        raise HTTPException(status_code=400, detail="OpenAI API key not configured")
+    
+    conversation_id, history = _chat_conversation(user, data)
+    
+    def on_done(event):
+        if conversation_id:
+            save_turn(conversation_id, user["id"], data.department, data.message,
+                      event["message"], event.get("tokens_used", 0))
+            event["conversation_id"] = conversation_id
+    
+    events = stream_support_chat(
+        message=data.message,
+        department=data.department,
+        api_key=api_key,
+        conversation_history=history
+    )
+    return _sse_response(
+        request, events,
+        lambda tokens: track_api_usage(user["email"], tokens, estimate_cost(tokens)),
+        on_done=on_done,
+        background=BackgroundTask(summarize_if_needed, conversation_id, api_key)
+                   if conversation_id else None
+    )
+
+
 # ============================================================================
 # STRIPE PAYMENT ENDPOINTS
 # ============================================================================
@@ -292,15 +504,14 @@ async def create_portal(token: str):
     """Create Stripe billing portal session"""
     from services.auth_service import get_user_by_token
     from services.stripe_service import create_billing_portal_session
-    from services.auth_service import _load_users
+    from database import get_subscription_by_user
     
     user = get_user_by_token(token)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    users = _load_users()
-    full_user = users.get(user["email"], {})
-    customer_id = full_user.get("stripe_customer_id")
+    subscription = get_subscription_by_user(user["id"]) or {}
+    customer_id = subscription.get("stripe_customer_id")
     
     if not customer_id:
         raise HTTPException(status_code=400, detail="No active subscription")
@@ -330,18 +541,135 @@ from fastapi import Request
 
 @app.post("/api/webhooks/stripe")
 async def stripe_webhook(request: Request):
-    """Handle Stripe webhook events"""
-    from services.stripe_service import handle_webhook
+    """
+    Verify and enqueue Stripe webhook events.
+    Events are acknowledged once persisted and applied by a background worker.
+    """
+    from services.stripe_service import verify_webhook
+    from services.webhook_queue import ingest_event
     
     payload = await request.body()
     signature = request.headers.get("Stripe-Signature", "")
     
-    result = await handle_webhook(payload, signature)
+    result = verify_webhook(payload, signature)
     
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
     
-    return result
+    event = result["event"]
+    return ingest_event(event["id"], event["type"], payload.decode("utf-8"))
+
+
+@app.get("/api/admin/webhooks/status")
+async def webhook_queue_status(token: str):
+    """Stripe webhook queue status (SuperAdmin only)"""
+    from services.auth_service import get_user_by_token
+    from services.webhook_queue import get_queue_status
+    
+    user = get_user_by_token(token)
+    if not user or user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Unauthorized - SuperAdmin only")
+    
+    return get_queue_status()
+
+
+class WebhookReplayRequest(BaseModel):
+    from_seq: Optional[int] = None
+    to_seq: Optional[int] = None
+    event_type: Optional[str] = None
+
+@app.get("/api/admin/generation-cache")
+async def generation_cache_stats(token: str):
+    """Generation cache hit rate and size (SuperAdmin only)"""
+    from services.auth_service import get_user_by_token
+    from services.generation_cache import get_cache_stats
+    
+    user = get_user_by_token(token)
+    if not user or user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Unauthorized - SuperAdmin only")
+    
+    return get_cache_stats()
+
+
+@app.get("/api/admin/chat-cache")
+async def chat_cache_stats(token: str):
+    """Support chat response cache hit rate and size (SuperAdmin only)"""
+    from services.auth_service import get_user_by_token
+    from services.chat_cache import get_cache_stats
+    
+    user = get_user_by_token(token)
+    if not user or user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Unauthorized - SuperAdmin only")
+    
+    return get_cache_stats()
+
+
+@app.delete("/api/admin/chat-cache")
+async def invalidate_chat_cache(token: str, department: Optional[str] = None):
+    """Drop cached support answers for a department, or all (SuperAdmin only)"""
+    from services.auth_service import get_user_by_token
+    from services.chat_cache import invalidate
+    
+    user = get_user_by_token(token)
+    if not user or user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Unauthorized - SuperAdmin only")
+    
+    return {"success": True, "department": department, "removed": invalidate(department)}
+
+
+@app.get("/api/admin/analysis-cache")
+async def analysis_cache_stats(token: str):
+    """Audio analysis cache hit rate and local/remote split (SuperAdmin only)"""
+    from services.auth_service import get_user_by_token
+    from services.analysis_cache import get_cache_stats
+
+    user = get_user_by_token(token)
+    if not user or user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Unauthorized - SuperAdmin only")
+
+    return get_cache_stats()
+
+
+@app.get("/api/admin/preset-warm-pool")
+async def preset_warm_pool_status(token: str):
+    """Pre-rendered preset variations available (SuperAdmin only)"""
+    from services.auth_service import get_user_by_token
+    from services.preset_warmer import get_warm_status
+    
+    user = get_user_by_token(token)
+    if not user or user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Unauthorized - SuperAdmin only")
+    
+    return get_warm_status()
+
+
+@app.get("/api/admin/generation/queue")
+async def generation_queue_metrics(token: str):
+    """Generation backlog and fair-share metrics (SuperAdmin only)"""
+    from services.auth_service import get_user_by_token
+    from services.generation_queue import get_queue_metrics
+    
+    user = get_user_by_token(token)
+    if not user or user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Unauthorized - SuperAdmin only")
+    
+    return get_queue_metrics()
+
+
+@app.post("/api/admin/webhooks/replay")
+async def replay_webhooks(token: str, data: WebhookReplayRequest):
+    """Re-apply a range of stored Stripe events (SuperAdmin only)"""
+    import asyncio
+    from services.auth_service import get_user_by_token
+    from services.webhook_queue import replay_events
+    
+    user = get_user_by_token(token)
+    if not user or user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Unauthorized - SuperAdmin only")
+    
+    return await asyncio.to_thread(
+        replay_events, data.from_seq, data.to_seq, data.event_type
+    )
 
 
 # ============================================================================
@@ -407,8 +735,8 @@ async def test_openai_connection():
         raise HTTPException(status_code=400, detail="OpenAI API key not configured")
     
     try:
-        from services.openai_service import test_connection
-        result = test_connection(api_key)
+        from services.openai_service import test_connection_async
+        result = await test_connection_async(api_key)
         return {"status": "success", "message": "OpenAI connection successful", "models": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OpenAI connection failed: {str(e)}")
@@ -444,6 +772,7 @@ async def list_samples(instrument: Optional[str] = None):
 
 @app.post("/api/samples/upload")
 async def upload_sample(
+    token: str,
     file: UploadFile = File(...),
     genre: str = "bolero",
     instrument: str = "full_mix",
@@ -451,10 +780,16 @@ async def upload_sample(
     project: str = "default",
     tags: str = ""
 ):
-    """Upload a new audio sample with auto-rename"""
+    """Upload a new audio sample with auto-rename (counts against the user's storage)"""
     import uuid
     import re
     from datetime import datetime
+    from services.auth_service import get_user_by_token
+    from services.quota_service import reserve_storage, release_storage
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
     
     # Validate file type
     if not file.filename.lower().endswith(('.wav', '.mp3', '.aiff', '.flac')):
@@ -483,8 +818,17 @@ async def upload_sample(
     content = await file.read()
     file_size = len(content)
     
-    with open(file_path, 'wb') as f:
-        f.write(content)
+    if not reserve_storage(user, file_size):
+        raise HTTPException(status_code=403, detail="Storage quota exceeded")
+    
+    try:
+        with open(file_path, 'wb') as f:
+            f.write(content)
+    except Exception as e:
+        # Give back the reservation for a file that was never stored
+        release_storage(user["id"], file_size)
+        file_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail=f"Failed to save sample: {e}")
     
     # Get audio info
     try:
@@ -507,7 +851,8 @@ async def upload_sample(
         "duration": audio_info.get("duration", 0),
         "sample_rate": audio_info.get("sample_rate", 48000),
         "tags": [t.strip() for t in tags.split(",") if t.strip()],
-        "uploaded_at": datetime.now().isoformat()
+        "uploaded_at": datetime.now().isoformat(),
+        "user_id": user["id"]
     }
     
     # Add to samples list
@@ -515,6 +860,14 @@ async def upload_sample(
     samples.append(metadata)
     save_samples_metadata(samples)
     
+    # Precompute the waveform pyramid for the library player
+    try:
+        import asyncio
+        from services.waveform_service import build_pyramid
+        await asyncio.to_thread(build_pyramid, str(file_path))
+    except Exception as e:
+        print(f"Waveform pyramid failed for {sample_id}: {e}")
+    
     return {"status": "success", "sample": metadata}
 
 
@@ -532,6 +885,14 @@ async def delete_sample(sample_id: str):
     if file_path.exists():
         os.remove(file_path)
     
+    from services.waveform_service import pyramid_path
+    if os.path.exists(pyramid_path(str(file_path))):
+        os.remove(pyramid_path(str(file_path)))
+    
+    if sample.get("user_id"):
+        from services.quota_service import release_storage
+        release_storage(sample["user_id"], sample.get("file_size_bytes", 0))
+    
     # Remove from metadata
     samples = [s for s in samples if s["id"] != sample_id]
     save_samples_metadata(samples)
@@ -567,6 +928,26 @@ async def update_sample(sample_id: str, update: SampleUpdate):
     return {"status": "success", "sample": samples[sample_index]}
 
 
+@app.get("/api/samples/{sample_id}/waveform")
+async def get_sample_waveform(sample_id: str, start: float = 0.0,
+                              end: Optional[float] = None, width: int = 1000):
+    """Waveform peaks of a sample between start and end seconds (~width points)"""
+    import asyncio
+    from services.waveform_service import get_waveform
+    
+    samples = get_samples_metadata()
+    sample = next((s for s in samples if s["id"] == sample_id), None)
+    if not sample:
+        raise HTTPException(status_code=404, detail="Sample not found")
+    
+    result = await asyncio.to_thread(
+        get_waveform, str(SAMPLES_DIR / sample["path"]), start, end, width
+    )
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
 # ============================================================================
 # AUDIO CONVERSION ENDPOINTS
 # ============================================================================
@@ -691,6 +1072,60 @@ async def list_projects():
     return {"projects": list(projects.values())}
 
 
+class ProjectCreate(BaseModel):
+    name: str
+    description: Optional[str] = None
+    genre: Optional[str] = None
+    bpm: int = 120
+    key: str = "Am"
+
+@app.post("/api/projects")
+async def create_user_project(token: str, data: ProjectCreate):
+    """Create a project (counts against the plan's max_projects)"""
+    import uuid
+    from database import create_project
+    from services.auth_service import get_user_by_token
+    from services.quota_service import check_project_slot, get_limits
+
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    quota_error = check_project_slot(user)
+    if quota_error:
+        raise HTTPException(status_code=403, detail=quota_error["error"])
+
+    project_id = str(uuid.uuid4())[:8]
+    created = create_project(
+        project_id, user["id"], data.name,
+        max_projects=get_limits(user).get("max_projects", -1),
+        description=data.description,
+        genre=data.genre,
+        bpm=data.bpm,
+        key=data.key
+    )
+    # Another request may have taken the last slot since the check above
+    if not created:
+        raise HTTPException(status_code=403, detail="Project limit reached")
+
+    return {"success": True, "project_id": project_id, "name": data.name}
+
+
+@app.delete("/api/projects/{project_id}")
+async def delete_user_project(project_id: str, token: str):
+    """Delete one of the user's projects, freeing its quota slot"""
+    from database import delete_project
+    from services.auth_service import get_user_by_token
+
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    if not delete_project(project_id, user["id"]):
+        raise HTTPException(status_code=404, detail="Project not found")
+    return {"success": True, "project_id": project_id}
+
+
 # ============================================================================
 # AI GENERATION ENDPOINTS
 # ============================================================================
@@ -777,6 +1212,33 @@ async def generate_lyrics(token: str, data: GenerateLyricsRequest):
     return result
 
 
+@app.post("/api/ai/generate-lyrics/stream")
+async def stream_lyrics_endpoint(token: str, data: GenerateLyricsRequest, request: Request):
+    """Streaming /api/ai/generate-lyrics over SSE; "done" carries the parsed lyrics"""
+    from services.auth_service import get_user_by_token, get_user_api_key, track_api_usage
+    from services.ai_generation import stream_lyrics
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    api_key = get_user_api_key(user["email"])
+    if not api_key:
+        raise HTTPException(status_code=400, detail="OpenAI API key not configured")
+    
+    events = stream_lyrics(
+        theme=data.theme,
+        api_key=api_key,
+        genre=data.genre,
+        mood=data.mood,
+        language=data.language
+    )
+    return _sse_response(
+        request, events,
+        lambda tokens: track_api_usage(user["email"], tokens, tokens * 0.00003)
+    )
+
+
 @app.post("/api/ai/analyze-audio")
 async def analyze_audio_endpoint(
     token: str,
@@ -784,28 +1246,55 @@ async def analyze_audio_endpoint(
     genre: str = "bachata",
     audio: UploadFile = File(...)
 ):
-    """Analyze recorded audio using AI"""
+    """Analyze recorded audio (locally when confident, otherwise with AI)"""
     from services.auth_service import get_user_by_token, get_user_api_key, track_api_usage
     from services.ai_generation import analyze_audio
+    from services.analysis_cache import read_upload, MAX_UPLOAD_BYTES
+    from services.audio_processor import UNSUPPORTED_FORMAT
+    from services.quota_service import (
+        check_recording_length, wav_duration_from_header, add_recording_seconds
+    )
     
     user = get_user_by_token(token)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
+    # Checked only if the local analysis is not confident enough
     api_key = get_user_api_key(user["email"])
-    if not api_key:
-        raise HTTPException(status_code=400, detail="OpenAI API key not configured")
     
-    audio_data = await audio.read()
+    audio_data, content_hash = await read_upload(audio)
+    if audio_data is None:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Audio too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"
+        )
+    
+    # Enforce the plan's recording length before paying for analysis
+    recorded_seconds = wav_duration_from_header(audio_data)
+    if recorded_seconds is not None:
+        quota_error = check_recording_length(user, recorded_seconds)
+        if quota_error:
+            raise HTTPException(status_code=403, detail=quota_error["error"])
     
     result = await analyze_audio(
         audio_data=audio_data,
         api_key=api_key,
         instrument=instrument,
-        genre=genre
+        genre=genre,
+        content_hash=content_hash
     )
     
-    if result.get("success"):
+    if result.get("error") == "OpenAI API key not configured":
+        raise HTTPException(status_code=400, detail="OpenAI API key not configured")
+    if result.get("error") == UNSUPPORTED_FORMAT:
+        raise HTTPException(status_code=400, detail=UNSUPPORTED_FORMAT)
+    
+    # Re-analyzing the same take (cached or coalesced) is not a new recording
+    fresh = result.get("success") and not result.get("cached") and not result.get("coalesced")
+    if fresh and recorded_seconds is not None:
+        add_recording_seconds(user["id"], recorded_seconds)
+    
+    if result.get("success") and result.get("tokens_used"):
         track_api_usage(
             user["email"],
             result.get("tokens_used", 0),
@@ -854,17 +1343,38 @@ class GenerateMusicRequest(BaseModel):
     key: str = "Am"
     duration: int = 120
     antigravity: int = 50  # 0-100 creativity level
+    seed: int = -1  # Fixed seeds are reproducible and served from cache
 
 class PresetRequest(BaseModel):
     preset: str
+    prompt: Optional[str] = ""
+    lyrics: Optional[str] = ""
+    seed: int = -1
+
+class BatchVariant(BaseModel):
+    seed: int = -1
+    antigravity: int = 50
+
+class BatchGenerateRequest(BaseModel):
     prompt: str
     lyrics: Optional[str] = ""
+    genre: str = "bachata"
+    bpm: int = 120
+    key: str = "Am"
+    duration: int = 120
+    antigravity: int = 50
+    # Either list the variants, or give count/seeds × antigravity_levels
+    variants: Optional[List[BatchVariant]] = None
+    count: int = 4
+    seeds: Optional[List[int]] = None
+    antigravity_levels: Optional[List[int]] = None
 
 @app.get("/api/acestep/health")
 async def acestep_health():
     """Check ACE-Step server status"""
+    import asyncio
     from services.acestep_service import check_acestep_health
-    return check_acestep_health()
+    return await asyncio.to_thread(check_acestep_health)
 
 @app.get("/api/acestep/presets")
 async def get_presets():
@@ -878,10 +1388,24 @@ async def get_antigravity_params(level: int):
     from services.acestep_service import calculate_antigravity_params
     return calculate_antigravity_params(level)
 
+def _ensure_acestep_available():
+    """Fail fast with 503 while every ACE-Step circuit is open"""
+    from services.acestep_pool import get_pool
+    pool = get_pool()
+    if pool.all_open():
+        retry_after = pool.retry_after()
+        raise HTTPException(
+            status_code=503,
+            detail=f"ACE-Step is unavailable, retry in {retry_after:.0f}s",
+            headers={"Retry-After": str(max(1, int(retry_after)))}
+        )
+
+
 @app.post("/api/generate/music")
 async def generate_music_endpoint(token: str, data: GenerateMusicRequest):
     """
-    Generate music using ACE-Step with Antigravity Engine.
+    Queue a music generation using ACE-Step with Antigravity Engine.
+    Returns immediately with a job_id; poll /api/generate/status/{job_id}.
     
     The antigravity parameter (0-100) controls creativity:
     - 0-20: Traditional - Stays close to genre conventions
@@ -890,93 +1414,333 @@ async def generate_music_endpoint(token: str, data: GenerateMusicRequest):
     - 80-100: Wild - Maximum creative chaos
     """
     from services.auth_service import get_user_by_token
-    from services.acestep_service import generate_music_async, calculate_antigravity_params
-    from database import create_composition
-    import secrets
+    from services.generation_queue import enqueue_generation
+    from services.quota_service import check_storage, estimate_generation_bytes
     
     user = get_user_by_token(token)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    # Generate music
-    result = await generate_music_async(
+    quota_error = check_storage(user, estimate_generation_bytes(data.duration))
+    if quota_error:
+        raise HTTPException(status_code=403, detail=quota_error["error"])
+    
+    _ensure_acestep_available()
+    
+    result = enqueue_generation(
+        user_id=user["id"],
         prompt=f"{data.genre}, {data.prompt}",
         lyrics=data.lyrics,
         duration=float(data.duration),
-        antigravity=data.antigravity
+        antigravity=data.antigravity,
+        seed=data.seed,
+        genre=data.genre,
+        bpm=data.bpm,
+        key=data.key,
+        title=f"{data.genre.title()} - {data.prompt[:30]}"
     )
-    
-    # Save to database if successful
-    if result.get("success"):
-        comp_id = f"comp_{secrets.token_hex(8)}"
-        create_composition(
-            comp_id=comp_id,
-            user_id=user["id"],
-            title=f"{data.genre.title()} - {data.prompt[:30]}",
-            genre=data.genre,
-            bpm=data.bpm,
-            key=data.key,
-            prompt=data.prompt,
-            lyrics=data.lyrics,
-            midi_path=None,
-            audio_path=result.get("audio_path"),
-            status="completed"
-        )
-        result["composition_id"] = comp_id
-    
+    if "error" in result:
+        raise HTTPException(status_code=429, detail=result["error"])
     return result
 
 @app.post("/api/generate/preset")
 async def generate_from_preset_endpoint(token: str, data: PresetRequest):
-    """Generate music using a DGB preset"""
+    """Queue a generation using a DGB preset"""
     from services.auth_service import get_user_by_token
-    from services.acestep_service import generate_from_preset
+    from services.acestep_service import get_preset
+    from services.generation_queue import enqueue_generation
+    from services.quota_service import check_storage, estimate_generation_bytes
     
     user = get_user_by_token(token)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    # Generate using preset
-    result = generate_from_preset(
-        preset_name=data.preset,
+    quota_error = check_storage(user, estimate_generation_bytes(60.0))
+    if quota_error:
+        raise HTTPException(status_code=403, detail=quota_error["error"])
+    
+    preset = get_preset(data.preset)
+    
+    # Uncustomised requests are served from the pre-rendered warm pool
+    if not data.prompt and not data.lyrics and data.seed <= 0:
+        from services.preset_warmer import take_warm
+        from services.generation_queue import complete_with_render
+        warm = take_warm(data.preset)
+        if warm:
+            result = complete_with_render(
+                user_id=user["id"],
+                render_path=warm["audio_path"],
+                prompt=warm["prompt"],
+                duration=warm["duration"],
+                antigravity=warm["antigravity"],
+                seed=warm["seed"],
+                bpm=preset["bpm"],
+                key=preset["key"],
+                title=preset["description"]
+            )
+            result["preset_used"] = data.preset
+            result["warm"] = True
+            return result
+    
+    _ensure_acestep_available()
+    
+    full_prompt = preset["prompt"]
+    if data.prompt:
+        full_prompt = f"{data.prompt}, {full_prompt}"
+    
+    result = enqueue_generation(
+        user_id=user["id"],
+        prompt=full_prompt,
         lyrics=data.lyrics,
         duration=60.0,
-        custom_prompt=data.prompt
+        antigravity=preset["antigravity"],
+        seed=data.seed,
+        bpm=preset["bpm"],
+        key=preset["key"],
+        title=preset["description"]
     )
+    if "error" in result:
+        raise HTTPException(status_code=429, detail=result["error"])
     
     result["preset_used"] = data.preset
     return result
 
+@app.post("/api/generate/batch")
+async def generate_batch_endpoint(token: str, data: BatchGenerateRequest):
+    """
+    Queue many variations of one prompt as a single batch.
+    Variants are `variants` if given, otherwise every seed (or `count`
+    random seeds) crossed with every antigravity level. Poll
+    /api/generate/batch/{batch_id} for the manifest.
+    """
+    from services.auth_service import get_user_by_token
+    from services.generation_queue import enqueue_batch
+    from services.quota_service import check_storage, estimate_generation_bytes
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    if data.variants:
+        variants = [{"seed": v.seed, "antigravity": v.antigravity} for v in data.variants]
+    else:
+        seeds = data.seeds or [-1] * max(0, data.count)
+        levels = data.antigravity_levels or [data.antigravity]
+        variants = [{"seed": seed, "antigravity": level} for level in levels for seed in seeds]
+    
+    quota_error = check_storage(user, estimate_generation_bytes(data.duration) * len(variants))
+    if quota_error:
+        raise HTTPException(status_code=403, detail=quota_error["error"])
+    
+    _ensure_acestep_available()
+    
+    result = enqueue_batch(
+        user_id=user["id"],
+        prompt=f"{data.genre}, {data.prompt}",
+        variants=variants,
+        lyrics=data.lyrics,
+        duration=float(data.duration),
+        genre=data.genre,
+        bpm=data.bpm,
+        key=data.key,
+        title=f"{data.genre.title()} - {data.prompt[:30]}"
+    )
+    if "error" in result:
+        status = 429 if result.get("quota") == "generation_queue" else 400
+        raise HTTPException(status_code=status, detail=result["error"])
+    return result
+
+@app.get("/api/generate/batch/{batch_id}")
+async def get_batch_endpoint(batch_id: str, token: str):
+    """Manifest of a batch: status and result of every variant"""
+    from services.auth_service import get_user_by_token
+    from services.generation_queue import get_batch
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    batch = get_batch(batch_id, user_id=user["id"])
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+@app.post("/api/generate/batch/{batch_id}/cancel")
+async def cancel_batch_endpoint(batch_id: str, token: str):
+    """Cancel every unfinished variant of a batch"""
+    from services.auth_service import get_user_by_token
+    from services.generation_queue import cancel_batch
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    result = cancel_batch(batch_id, user["id"])
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
 @app.get("/api/generate/status/{job_id}")
 async def get_generation_status_endpoint(job_id: str, token: str):
-    """Get status of an ongoing music generation"""
+    """Get status, queue position and ETA of a generation job"""
     from services.auth_service import get_user_by_token
-    from services.acestep_service import get_generated_audio
+    from services.generation_queue import get_job
     
     user = get_user_by_token(token)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    audio_path = get_generated_audio(job_id)
-    if audio_path:
-        return {"job_id": job_id, "status": "completed", "audio_path": audio_path}
-    return {"job_id": job_id, "status": "processing"}
+    job = get_job(job_id, user_id=user["id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/generate/cancel/{job_id}")
+async def cancel_generation_endpoint(job_id: str, token: str):
+    """Cancel a queued or running generation"""
+    from services.auth_service import get_user_by_token
+    from services.generation_queue import cancel_job
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    result = cancel_job(job_id, user["id"])
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.get("/api/generate/jobs")
+async def list_generation_jobs(token: str, limit: int = 20):
+    """List the user's recent generation jobs"""
+    from services.auth_service import get_user_by_token
+    from services.generation_queue import list_user_jobs
+    
+    user = get_user_by_token(token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    return {"jobs": list_user_jobs(user["id"], min(limit, 100))}
 
 
 @app.get("/api/audio/{job_id}")
-async def serve_generated_audio(job_id: str):
-    """Serve generated audio file"""
-    from fastapi.responses import FileResponse
-    from services.acestep_service import get_generated_audio
+async def serve_generated_audio(job_id: str, request: Request, stream: bool = False):
+    """
+    Serve generated audio. Supports Range requests; with ?stream=true a job
+    that is still rendering is streamed as its segments become available.
+    """
+    from fastapi.responses import StreamingResponse
+    from services.acestep_service import get_generated_audio, OUTPUT_DIR
+    from services.audio_delivery import (
+        parse_range, iter_file, stream_generation, RangeNotSatisfiable
+    )
     
     # Remove .wav extension if present
     clean_id = job_id.replace(".wav", "")
     audio_path = get_generated_audio(clean_id)
     
     if not audio_path:
+        if not stream:
+            raise HTTPException(status_code=404, detail="Audio not found")
+        from services.generation_queue import get_job
+        job = get_job(clean_id)
+        if not job or job["status"] not in ("queued", "running"):
+            raise HTTPException(status_code=404, detail="Audio not found")
+        
+        def job_status():
+            current = get_job(clean_id)
+            return current["status"] if current else None
+        
+        return StreamingResponse(
+            stream_generation(clean_id, OUTPUT_DIR, job_status),
+            media_type="audio/wav",
+            headers={"Cache-Control": "no-store"}
+        )
+    
+    size = os.path.getsize(audio_path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'inline; filename="{clean_id}.wav"'
+    }
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except RangeNotSatisfiable:
+        raise HTTPException(
+            status_code=416, detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file(audio_path), media_type="audio/wav", headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file(audio_path, start, end),
+        status_code=206, media_type="audio/wav", headers=headers
+    )
+
+
+def _cached_file_response(request: Request, path: str, media_type: str):
+    """FileResponse with long-lived caching and If-None-Match support"""
+    from fastapi.responses import FileResponse, Response
+    from services.preview_service import etag_for, CACHE_CONTROL
+    
+    etag = etag_for(path)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+@app.get("/api/audio/{job_id}/preview")
+async def serve_audio_preview(job_id: str, request: Request, format: str = "mp3"):
+    """Low-bitrate preview of a generated track (mp3 or opus, WAV if no encoder)"""
+    import asyncio
+    from services.preview_service import get_preview, PREVIEW_FORMATS
+    
+    if format not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    
+    path = await asyncio.to_thread(get_preview, job_id, format)
+    if path:
+        return _cached_file_response(request, path, PREVIEW_FORMATS[format]["media_type"])
+    
+    # No encoder available: fall back to the original WAV
+    from services.acestep_service import get_generated_audio
+    audio_path = get_generated_audio(job_id)
+    if not audio_path:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return _cached_file_response(request, audio_path, "audio/wav")
+
+
+@app.get("/api/audio/{job_id}/waveform")
+async def get_generated_waveform(job_id: str, start: float = 0.0,
+                                 end: Optional[float] = None, width: int = 1000):
+    """Waveform peaks of a generated track between start and end seconds"""
+    import asyncio
+    from services.acestep_service import get_generated_audio
+    from services.waveform_service import get_waveform
+    
+    result = await asyncio.to_thread(get_waveform, get_generated_audio(job_id), start, end, width)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
+@app.get("/api/audio/{job_id}/peaks")
+async def serve_audio_peaks(job_id: str, request: Request):
+    """Precomputed waveform peaks of a generated track"""
+    import asyncio
+    from services.preview_service import get_peaks
+    
+    path = await asyncio.to_thread(get_peaks, job_id)
+    if not path:
         raise HTTPException(status_code=404, detail="Audio not found")
     
-    return FileResponse(audio_path, media_type="audio/wav", filename=f"{clean_id}.wav")
+    return _cached_file_response(request, path, "application/json")
 
 
 # ============================================================================
@@ -1101,11 +1865,36 @@ async def get_export_history(token: str, limit: int = 20):
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
+    from services.webhook_queue import start_worker
+    from services.generation_queue import start_workers
+    from services.acestep_pool import start_health_monitor
+    from services.preset_warmer import start_warmer
     init_db()
     migrate_from_json()  # Migrate any existing JSON data
+    start_worker()  # Apply queued Stripe webhooks
+    start_health_monitor()  # Re-admit recovered ACE-Step backends
+    start_workers()  # Run queued ACE-Step generations
+    start_warmer()  # Pre-render presets in idle GPU time
     print("🚀 DGB AUDIO API started successfully!")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers"""
+    from services.webhook_queue import stop_worker
+    from services.generation_queue import stop_workers
+    from services.acestep_pool import stop_health_monitor
+    from services.preset_warmer import stop_warmer
+    from services.http_client import close_clients
+    from database import close_connections
+    await stop_worker()
+    await stop_warmer()
+    await stop_workers()
+    await stop_health_monitor()
+    await close_clients()
+    close_connections()
+
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
@@ -1129,6 +1918,27 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    """
+    Generation latency/throughput metrics in the Prometheus text format.
+    When METRICS_TOKEN is set, scrapers must send it as a Bearer token.
+    """
+    import asyncio
+    import hmac
+    from fastapi.responses import Response
+    from services.metrics import registry, CONTENT_TYPE
+    
+    expected = os.getenv("METRICS_TOKEN")
+    if expected:
+        supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied, expected):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    
+    body = await asyncio.to_thread(registry.render)
+    return Response(content=body, media_type=CONTENT_TYPE)
+
+
 @app.get("/api/db/status")
 async def database_status():
     """Get database status and statistics"""
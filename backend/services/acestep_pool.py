@@ -0,0 +1,379 @@
+"""
+DGB AUDIO - ACE-Step Backend Pool
+==================================
+Routes generations across several ACE-Step GPU servers (each one set up
+with scripts/setup_gpu_server.sh).
+
+    ACESTEP_URLS=http://gpu1:7870,http://gpu2:7870*2
+
+A "*N" suffix sets that backend's concurrency (default
+ACESTEP_BACKEND_CONCURRENCY, 1). Requests go to the available backend with
+the fewest outstanding jobs relative to its capacity.
+
+Each backend sits behind a circuit breaker:
+    closed     normal routing
+    open       after EJECT_AFTER_FAILURES consecutive failures; no traffic
+               until the backoff (doubling per trip, capped) has elapsed
+    half_open  a successful HTTP probe lets one trial request through;
+               success closes the circuit, failure re-opens it
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, List, Dict
+
+DEFAULT_CONCURRENCY = int(os.getenv("ACESTEP_BACKEND_CONCURRENCY", "1"))
+EJECT_AFTER_FAILURES = 3
+BACKOFF_BASE_SECONDS = 5.0
+BACKOFF_MAX_SECONDS = 300.0
+PROBE_TIMEOUT_SECONDS = 3.0
+HEALTH_CHECK_INTERVAL = 5.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ACEStepBackend:
+    """One ACE-Step Gradio server"""
+
+    def __init__(self, url: str, max_concurrency: int = DEFAULT_CONCURRENCY):
+        self.url = url
+        self.max_concurrency = max(1, max_concurrency)
+        self.outstanding = 0
+        self.state = CLOSED
+        self.trips = 0
+        self.open_until = 0.0
+        self.consecutive_failures = 0
+        self.completed = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+        self.last_probe_ms: Optional[float] = None
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def get_client(self):
+        """Get or create this backend's Gradio client"""
+        with self._client_lock:
+            if self._client is None:
+                from gradio_client import Client
+                # Results are fetched by acestep_service._transfer_output
+                self._client = Client(self.url, download_files=False)
+            return self._client
+
+    def reset_client(self):
+        with self._client_lock:
+            self._client = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.state == CLOSED
+
+    @property
+    def load(self) -> float:
+        return self.outstanding / self.max_concurrency
+
+    def has_capacity(self) -> bool:
+        if self.state == CLOSED:
+            return self.outstanding < self.max_concurrency
+        # Half-open admits a single trial request
+        return self.state == HALF_OPEN and self.outstanding == 0
+
+    def status(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "state": self.state,
+            "retry_in_seconds": round(max(0.0, self.open_until - time.monotonic()), 1)
+                                if self.state == OPEN else 0,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "consecutive_failures": self.consecutive_failures,
+            "last_probe_ms": self.last_probe_ms,
+            "last_error": self.last_error
+        }
+
+
+# ============================================================================
+# ADAPTIVE TIMEOUTS
+# ============================================================================
+
+class LatencyTracker:
+    """
+    Recent render times per infer_step, as seconds per audio second.
+    Timeouts follow the slowest recent renders instead of a fixed limit.
+    """
+
+    MIN_SAMPLES = 5
+    DEFAULT_TIMEOUT = 900.0
+    MIN_TIMEOUT = 60.0
+    OVERHEAD_SECONDS = 30.0
+    SAFETY_FACTOR = 2.0
+
+    def __init__(self, window: int = 50):
+        self._samples: Dict[int, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def observe(self, infer_step: int, duration: float, elapsed: float):
+        if duration <= 0 or elapsed <= 0:
+            return
+        with self._lock:
+            samples = self._samples.setdefault(infer_step, deque(maxlen=self._window))
+            samples.append(elapsed / duration)
+
+    def timeout(self, infer_step: int, duration: float) -> float:
+        """Seconds to wait for a render before treating the backend as stuck"""
+        with self._lock:
+            samples = sorted(self._samples.get(infer_step, ()))
+        if len(samples) < self.MIN_SAMPLES:
+            return self.DEFAULT_TIMEOUT
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return max(self.MIN_TIMEOUT, p95 * duration * self.SAFETY_FACTOR + self.OVERHEAD_SECONDS)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                str(step): {
+                    "samples": len(values),
+                    "p50_seconds_per_audio_second": round(sorted(values)[len(values) // 2], 4)
+                }
+                for step, values in self._samples.items() if values
+            }
+
+
+latency = LatencyTracker()
+
+
+# ============================================================================
+# POOL
+# ============================================================================
+
+class ACEStepPool:
+    """Least-outstanding-jobs router with per-backend circuit breakers"""
+
+    def __init__(self, backends: List[ACEStepBackend]):
+        self.backends = backends
+        self._cond = threading.Condition()
+
+    def total_capacity(self) -> int:
+        return sum(b.max_concurrency for b in self.backends)
+
+    def has_capacity(self) -> bool:
+        with self._cond:
+            return any(b.has_capacity() for b in self.backends)
+
+    def all_open(self) -> bool:
+        """True when every backend's circuit is open (fail fast)"""
+        with self._cond:
+            return all(b.state == OPEN for b in self.backends)
+
+    def retry_after(self) -> float:
+        """Seconds until the first open circuit may be probed again"""
+        now = time.monotonic()
+        with self._cond:
+            waits = [max(0.0, b.open_until - now) for b in self.backends if b.state == OPEN]
+        return round(min(waits), 1) if waits else 0.0
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[ACEStepBackend]:
+        """
+        Reserve a slot on the least-loaded available backend. Waits while
+        backends are busy, but returns None at once if every circuit is open.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                candidates = [b for b in self.backends if b.has_capacity()]
+                if candidates:
+                    backend = min(candidates, key=lambda b: (b.state != CLOSED, b.load, b.outstanding))
+                    backend.outstanding += 1
+                    return backend
+                if all(b.state == OPEN for b in self.backends):
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def release(self, backend: ACEStepBackend, success: bool, error: Optional[str] = None):
+        """Return a slot and record the outcome"""
+        with self._cond:
+            backend.outstanding = max(0, backend.outstanding - 1)
+            if success:
+                backend.completed += 1
+                backend.consecutive_failures = 0
+                if backend.state == HALF_OPEN:
+                    self._close(backend)
+            else:
+                backend.failed += 1
+                self.record_failure(backend, error)
+            self._cond.notify_all()
+
+    def record_failure(self, backend: ACEStepBackend, error: Optional[str] = None):
+        """Count one consecutive failure; eject at EJECT_AFTER_FAILURES (or a failed trial)"""
+        with self._cond:
+            backend.consecutive_failures += 1
+            backend.last_error = error
+            if (backend.state == HALF_OPEN
+                    or backend.consecutive_failures >= EJECT_AFTER_FAILURES):
+                self._open(backend)
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        """with pool.lease() as backend: ... (failure recorded on exception)"""
+        backend = self.acquire(timeout)
+        if backend is None:
+            raise RuntimeError("No ACE-Step backend available")
+        try:
+            yield backend
+        except Exception as e:
+            self.release(backend, success=False, error=str(e))
+            raise
+        else:
+            self.release(backend, success=True)
+
+    # Breaker transitions (caller holds self._cond)
+
+    def _open(self, backend: ACEStepBackend):
+        backend.trips += 1
+        backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (backend.trips - 1))
+        backend.state = OPEN
+        backend.open_until = time.monotonic() + backoff * random.uniform(0.8, 1.2)
+        backend.reset_client()
+        print(f"⚠️ ACE-Step circuit open for {backend.url} ({backoff:.0f}s)")
+
+    def _close(self, backend: ACEStepBackend):
+        if backend.state != CLOSED:
+            print(f"✅ ACE-Step circuit closed for {backend.url}")
+        backend.state = CLOSED
+        backend.trips = 0
+        backend.consecutive_failures = 0
+
+    # Health probing
+
+    @staticmethod
+    def _probe_once(backend: ACEStepBackend) -> tuple:
+        """(reachable, latency ms, error): GET the Gradio app config, 2xx within the timeout"""
+        import httpx
+        started = time.monotonic()
+        try:
+            response = httpx.get(f"{backend.url}/config", timeout=PROBE_TIMEOUT_SECONDS)
+            response.raise_for_status()
+        except Exception as e:
+            return False, None, f"Health probe failed: {e}"
+        return True, round((time.monotonic() - started) * 1000, 1), None
+
+    def probe(self, backend: ACEStepBackend) -> bool:
+        """Probe a backend and remember the outcome on it (health monitor)"""
+        ok, latency_ms, error = self._probe_once(backend)
+        backend.last_probe_ms = latency_ms
+        if error:
+            backend.last_error = error
+        return ok
+
+    def health_check(self):
+        """Probe open circuits whose backoff has elapsed"""
+        now = time.monotonic()
+        for backend in self.backends:
+            if backend.state != OPEN or backend.open_until > now:
+                continue
+            ok = self.probe(backend)
+            with self._cond:
+                if ok:
+                    backend.state = HALF_OPEN
+                    self._cond.notify_all()
+                else:
+                    self._open(backend)
+
+    def probe_all(self) -> List[Dict]:
+        """
+        Probe every backend now, report only (used by the public health
+        endpoint). Nothing is recorded on the backends: failure accounting
+        and ejection are left to real requests and the health monitor, so
+        polling this during a brief stall cannot eject a healthy backend.
+        """
+        results = []
+        for backend in self.backends:
+            ok, latency_ms, error = self._probe_once(backend)
+            results.append({**backend.status(), "reachable": ok,
+                            "probe_ms": latency_ms, "probe_error": error})
+        return results
+
+    def status(self) -> Dict:
+        with self._cond:
+            return {
+                "backends": [b.status() for b in self.backends],
+                "healthy": sum(1 for b in self.backends if b.healthy),
+                "total": len(self.backends),
+                "capacity": self.total_capacity(),
+                "outstanding": sum(b.outstanding for b in self.backends),
+                "latency": latency.snapshot()
+            }
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+def parse_backend_urls(value: str) -> List[ACEStepBackend]:
+    """Parse "url[*concurrency],url[*concurrency]" into backends"""
+    backends = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        url, _, concurrency = entry.partition("*")
+        backends.append(ACEStepBackend(
+            url.strip().rstrip("/"),
+            int(concurrency) if concurrency else DEFAULT_CONCURRENCY
+        ))
+    return backends
+
+
+_pool: Optional[ACEStepPool] = None
+_pool_lock = threading.Lock()
+_health_task: Optional[asyncio.Task] = None
+
+
+def get_pool() -> ACEStepPool:
+    """Process-wide pool built from ACESTEP_URLS (falls back to ACESTEP_URL)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from services.acestep_service import ACESTEP_URL
+            _pool = ACEStepPool(parse_backend_urls(os.getenv("ACESTEP_URLS", ACESTEP_URL)))
+        return _pool
+
+
+async def _health_loop():
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+        try:
+            await asyncio.to_thread(get_pool().health_check)
+        except Exception as e:
+            print(f"ACE-Step health check error: {e}")
+
+
+def start_health_monitor():
+    """Start periodic probes of open circuits (app startup hook)"""
+    global _health_task
+    if _health_task is None or _health_task.done():
+        _health_task = asyncio.get_running_loop().create_task(_health_loop())
+
+
+async def stop_health_monitor():
+    global _health_task
+    if _health_task is not None:
+        _health_task.cancel()
+        try:
+            await _health_task
+        except asyncio.CancelledError:
+            pass
+        _health_task = None
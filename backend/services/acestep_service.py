@@ -12,11 +12,13 @@ import os
 import asyncio
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 import json
 import secrets
 import random
 import shutil
+import threading
+import time
 
 # Gradio Client for API calls
 from gradio_client import Client, handle_file
@@ -30,16 +32,16 @@ ACESTEP_URL = os.getenv("ACESTEP_URL", "http://localhost:7870")
 OUTPUT_DIR = Path(__file__).parent.parent.parent / "generated_audio"
 OUTPUT_DIR.mkdir(exist_ok=True)
 
-# Gradio client singleton
-_client = None
+# Seconds to wait for a free backend slot before failing the attempt
+BACKEND_ACQUIRE_TIMEOUT = float(os.getenv("ACESTEP_ACQUIRE_TIMEOUT", "120"))
 
 
 def get_gradio_client() -> Client:
-    """Get or create Gradio client connection"""
-    global _client
-    if _client is None:
-        _client = Client(ACESTEP_URL)
-    return _client
+    """Client for the least-loaded healthy backend (kept for compatibility)"""
+    from services.acestep_pool import get_pool
+    pool = get_pool()
+    healthy = [b for b in pool.backends if b.healthy] or pool.backends
+    return min(healthy, key=lambda b: b.load).get_client()
 
 
 # ============================================================================
@@ -102,36 +104,80 @@ def get_antigravity_mode_name(level: int) -> str:
 # ============================================================================
 
 def check_acestep_health() -> Dict:
-    """Check if ACE-Step Gradio server is running"""
-    try:
-        client = get_gradio_client()
-        # Try to get API info
-        return {
-            "connected": True,
-            "status": "healthy",
-            "url": ACESTEP_URL,
-            "message": "ACE-Step Gradio server connected"
-        }
-    except Exception as e:
+    """Probe every ACE-Step Gradio server over HTTP"""
+    from services.acestep_pool import get_pool
+    pool = get_pool()
+    backends = pool.probe_all()
+    reachable = sum(1 for b in backends if b["reachable"])
+    
+    if reachable == 0:
         return {
             "connected": False,
             "status": "offline",
             "url": ACESTEP_URL,
-            "error": str(e),
+            "backends": backends,
+            "error": backends[0]["probe_error"] if backends else "No backends configured",
+            "retry_in_seconds": pool.retry_after(),
             "message": "Run: acestep --bf16 false --port 7870"
         }
+    return {
+        "connected": True,
+        "status": "healthy" if reachable == len(backends) else "degraded",
+        "url": ACESTEP_URL,
+        "backends": backends,
+        "capacity": pool.total_capacity(),
+        "message": f"{reachable}/{len(backends)} ACE-Step backend(s) available"
+    }
 
 
 # ============================================================================
 # MUSIC GENERATION
 # ============================================================================
 
+def build_predict_args(
+    prompt: str,
+    lyrics: str,
+    duration: float,
+    params: Dict[str, Any],
+    seed: int
+) -> tuple:
+    """Positional arguments for ACE-Step's api_name='/__call__' endpoint"""
+    return (
+        "wav",                           # format
+        float(duration),                 # audio_duration
+        prompt,                          # prompt (tags)
+        lyrics,                          # lyrics
+        params["infer_step"],            # infer_step
+        params["guidance_scale"],        # guidance_scale
+        params["scheduler_type"],        # scheduler_type
+        params["cfg_type"],              # cfg_type
+        params["omega_scale"],           # omega_scale
+        str(seed),                       # manual_seeds
+        0.5,                             # guidance_interval
+        0.0,                             # guidance_interval_decay
+        3.0,                             # min_guidance_scale
+        True,                            # use_erg_tag
+        False,                           # use_erg_lyric
+        True,                            # use_erg_diffusion
+        None,                            # oss_steps
+        0.0,                             # guidance_scale_text
+        0.0,                             # guidance_scale_lyric
+        False,                           # audio2audio_enable
+        0.5,                             # ref_audio_strength
+        None,                            # ref_audio_input
+        "none",                          # lora_name_or_path
+        1.0,                             # lora_weight
+    )
+
+
 def generate_music(
     prompt: str,
     lyrics: str = "",
     duration: float = 60.0,
     antigravity: int = 50,
-    seed: int = -1
+    seed: int = -1,
+    job_id: Optional[str] = None,
+    should_cancel: Optional[Callable[[], bool]] = None
 ) -> Dict:
     """
     Generate music using ACE-Step via Gradio Client.
@@ -142,15 +188,50 @@ def generate_music(
         duration: Duration in seconds (max 240)
         antigravity: Creativity level (0-100)
         seed: Random seed (-1 for random)
+        job_id: Job ID to use for the output file (generated if omitted)
+        should_cancel: Polled while the backend works; return True to abort
     
     Returns:
         Dict with audio path and generation details
     """
+    from services import metrics
+    labels = metrics.generation_labels(antigravity, duration)
+    started = time.monotonic()
+    
+    result = _generate_music(prompt, lyrics, duration, antigravity, seed, job_id,
+                             should_cancel, labels)
+    
+    if result.get("status") == "cancelled":
+        outcome = "cancelled"
+    elif not result.get("success"):
+        outcome = "error"
+    elif result.get("coalesced_with"):
+        outcome = "coalesced"
+    elif result.get("cached"):
+        outcome = "cached"
+    else:
+        outcome = "rendered"
+        metrics.generated_audio_seconds.inc(duration, **labels)
+    metrics.generations_total.inc(outcome=outcome, **labels)
+    metrics.generation_seconds.observe(time.monotonic() - started, outcome=outcome, **labels)
+    return result
+
+
+def _generate_music(
+    prompt: str,
+    lyrics: str,
+    duration: float,
+    antigravity: int,
+    seed: int,
+    job_id: Optional[str],
+    should_cancel: Optional[Callable[[], bool]],
+    labels: Dict[str, str]
+) -> Dict:
     # Calculate Antigravity parameters
     params = calculate_antigravity_params(antigravity)
     
     # Create job ID
-    job_id = f"dgb_{secrets.token_hex(8)}"
+    job_id = job_id or f"dgb_{secrets.token_hex(8)}"
     
     # Generate seed if random
     actual_seed = seed if seed > 0 else random.randint(1, 999999)
@@ -158,47 +239,10 @@ def generate_music(
     # Format lyrics
     formatted_lyrics = lyrics if lyrics.strip() else "[instrumental]"
     
-    try:
-        client = get_gradio_client()
-        
-        # Call ACE-Step using api_name='/__call__' with correct parameter order
-        result = client.predict(
-            "wav",                           # format
-            float(duration),                 # audio_duration
-            prompt,                          # prompt (tags)
-            formatted_lyrics,                # lyrics
-            params["infer_step"],            # infer_step
-            params["guidance_scale"],        # guidance_scale
-            params["scheduler_type"],        # scheduler_type
-            params["cfg_type"],              # cfg_type
-            params["omega_scale"],           # omega_scale
-            str(actual_seed),                # manual_seeds
-            0.5,                             # guidance_interval
-            0.0,                             # guidance_interval_decay
-            3.0,                             # min_guidance_scale
-            True,                            # use_erg_tag
-            False,                           # use_erg_lyric
-            True,                            # use_erg_diffusion
-            None,                            # oss_steps
-            0.0,                             # guidance_scale_text
-            0.0,                             # guidance_scale_lyric
-            False,                           # audio2audio_enable
-            0.5,                             # ref_audio_strength
-            None,                            # ref_audio_input
-            "none",                          # lora_name_or_path
-            1.0,                             # lora_weight
-            api_name="/__call__"
-        )
-        
-        # Result is (audio_path, parameters_json)
-        audio_path = result[0] if isinstance(result, tuple) else result
-        
-        # Copy to our output directory
-        if audio_path and os.path.exists(audio_path):
-            output_path = OUTPUT_DIR / f"{job_id}.wav"
-            shutil.copy(audio_path, output_path)
-            audio_path = str(output_path)
-        
+    predict_args = build_predict_args(prompt, formatted_lyrics, duration, params, actual_seed)
+    output_path = OUTPUT_DIR / f"{job_id}.wav"
+    
+    def completed(audio_path: str, **extra) -> Dict:
         return {
             "success": True,
             "job_id": job_id,
@@ -208,20 +252,245 @@ def generate_music(
             "antigravity_params": params,
             "prompt_used": prompt,
             "duration": duration,
-            "seed": actual_seed
+            "seed": actual_seed,
+            **extra
         }
+    
+    if seed <= 0:
+        return _render_on_backend(job_id, predict_args, output_path, completed, should_cancel, labels)
+    
+    # A fixed seed makes the render deterministic: reuse an earlier one, or
+    # share the backend call with an identical request already in flight
+    from services import generation_cache
+    key = generation_cache.cache_key(predict_args)
+    while True:
+        cached_path = generation_cache.lookup(key)
+        if cached_path:
+            generation_cache.link_or_copy(cached_path, str(output_path))
+            return completed(str(output_path), cached=True)
+        
+        flight, leader = _join_flight(key)
+        if leader:
+            result = None
+            try:
+                result = _render_on_backend(job_id, predict_args, output_path, completed,
+                                            should_cancel, labels)
+                if result.get("success"):
+                    generation_cache.store(key, result["audio_path"], prompt=prompt,
+                                           duration=duration, seed=actual_seed)
+            finally:
+                _finish_flight(key, flight, result)
+            return result
+        
+        while not flight.done.wait(0.5):
+            if should_cancel and should_cancel():
+                return {
+                    "success": False,
+                    "job_id": job_id,
+                    "status": "cancelled",
+                    "error": "Generation cancelled"
+                }
+        shared = flight.result or {}
+        if shared.get("status") == "cancelled":
+            continue  # The leader gave up; try again ourselves
+        if not shared.get("success"):
+            return {**shared, "job_id": job_id}
+        if not os.path.exists(shared.get("audio_path") or ""):
+            continue
+        generation_cache.link_or_copy(shared["audio_path"], str(output_path))
+        return completed(str(output_path), cached=True, coalesced_with=shared["job_id"])
+
+
+class _Flight:
+    """An in-progress backend call that identical requests can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict] = None
+
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _join_flight(key: str) -> tuple:
+    """(flight, is_leader) for a cache key"""
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+
+def _finish_flight(key: str, flight: _Flight, result: Optional[Dict]):
+    with _flights_lock:
+        _flights.pop(key, None)
+    flight.result = result
+    flight.done.set()
+
+
+def _move_into_place(src: str, dest: Path):
+    """Rename src to dest; copy + delete only when crossing filesystems"""
+    try:
+        os.replace(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+        try:
+            os.remove(src)
+        except OSError:
+            pass
+    # Gradio keeps each file in its own hashed temp directory
+    try:
+        os.rmdir(Path(src).parent)
+    except OSError:
+        pass
+
+
+def _stream_download(url: str, dest: Path):
+    """Stream a remote file to dest without buffering it in memory"""
+    import httpx
+    part = dest.with_suffix(".part")
+    with httpx.stream("GET", url, timeout=60.0, follow_redirects=True) as response:
+        response.raise_for_status()
+        with open(part, "wb") as f:
+            for chunk in response.iter_bytes(1024 * 1024):
+                f.write(chunk)
+    os.replace(part, dest)
+
+
+def _transfer_output(output, output_path: Path, backend_url: str) -> Optional[str]:
+    """
+    Put the backend's render at output_path with as little I/O as possible.
+    
+    Pool clients use download_files=False, so output is Gradio FileData
+    ({"path", "url", ...}). When the backend runs on this host the file is
+    already on our disk and is moved into place; otherwise it is streamed
+    straight to output_path. Plain paths (clients that download to a temp
+    dir themselves) are moved as well, so nothing is left behind.
+    """
+    if isinstance(output, dict):
+        src = output.get("path")
+        if src and os.path.exists(src):
+            _move_into_place(src, output_path)
+        else:
+            url = output.get("url") or f"{backend_url}/file={src}"
+            _stream_download(url, output_path)
+        return str(output_path)
+    
+    if output and os.path.exists(output):
+        _move_into_place(output, output_path)
+        return str(output_path)
+    return output
+
+
+def _publish_segments(job, job_id: str, consumed: int, backend_url: str) -> int:
+    """
+    Publish partial outputs of a chunked backend as live-stream segments.
+
+    Generator endpoints yield (segment_file, '{"segment": N, ...}') for each
+    chunk before the final (file, params); every segment is transferred
+    under a temporary name and renamed to {job_id}.segments/NNNNN.wav.
+    Returns how many outputs have been handled so far.
+    """
+    from services.audio_delivery import segments_dir
+    outputs = job.outputs()
+    for output in outputs[consumed:]:
+        try:
+            info = json.loads(output[1]) if isinstance(output, (tuple, list)) else None
+        except (TypeError, ValueError):
+            info = None
+        if not isinstance(info, dict) or info.get("segment") is None:
+            continue
+        seg_dir = segments_dir(OUTPUT_DIR, job_id)
+        try:
+            seg_dir.mkdir(exist_ok=True)
+            part = seg_dir / f"{int(info['segment']):05d}.part"
+            _transfer_output(output[0], part, backend_url)
+            os.replace(part, part.with_suffix(".wav"))
+        except Exception as e:
+            print(f"Could not publish segment {info['segment']} of {job_id}: {e}")
+    return len(outputs)
+
+
+def _render_on_backend(
+    job_id: str,
+    predict_args: tuple,
+    output_path: Path,
+    completed: Callable[..., Dict],
+    should_cancel: Optional[Callable[[], bool]] = None,
+    labels: Optional[Dict[str, str]] = None
+) -> Dict:
+    """Run one render on a pooled ACE-Step backend"""
+    from services.acestep_pool import get_pool, latency
+    from services.metrics import span
+    pool = get_pool()
+    with span("acquire", labels):
+        backend = pool.acquire(timeout=BACKEND_ACQUIRE_TIMEOUT)
+    if backend is None:
+        down = pool.all_open()
+        return {
+            "success": False,
+            "job_id": job_id,
+            "status": "error",
+            "error": "ACE-Step is unavailable" if down else "No ACE-Step backend available",
+            "retryable": True,
+            "retry_after": pool.retry_after() if down else None,
+            "message": "All ACE-Step backends are offline" if down
+                       else "All ACE-Step backends are busy"
+        }
+    
+    duration, infer_step = predict_args[1], predict_args[4]
+    timeout = latency.timeout(infer_step, duration)
+    
+    try:
+        with span("connect", labels):
+            client = backend.get_client()
+        
+        # Submit instead of predict so the job can be cancelled mid-diffusion
+        with span("predict", labels):
+            started = time.monotonic()
+            job = client.submit(*predict_args, api_name="/__call__")
+            published = 0
+            while not job.done():
+                published = _publish_segments(job, job_id, published, backend.url)
+                if should_cancel and should_cancel():
+                    job.cancel()
+                    pool.release(backend, success=True)
+                    return {
+                        "success": False,
+                        "job_id": job_id,
+                        "status": "cancelled",
+                        "error": "Generation cancelled"
+                    }
+                if time.monotonic() - started > timeout:
+                    job.cancel()
+                    raise TimeoutError(f"Render exceeded {timeout:.0f}s")
+                time.sleep(0.5)
+            result = job.result()
+            latency.observe(infer_step, duration, time.monotonic() - started)
+        
+        # Result is (audio_file, parameters_json)
+        output = result[0] if isinstance(result, (tuple, list)) else result
+        with span("transfer", labels):
+            audio_path = _transfer_output(output, output_path, backend.url)
+        
+        pool.release(backend, success=True)
+        return completed(audio_path, backend=backend.url)
         
     except Exception as e:
+        pool.release(backend, success=False, error=str(e))
         return {
             "success": False,
             "job_id": job_id,
             "status": "error",
             "error": str(e),
-            "message": "Check if ACE-Step is running on port 7870"
+            "retryable": True,
+            "backend": backend.url,
+            "message": f"Check if ACE-Step is running at {backend.url}"
         }
 
 
-
 async def generate_music_async(
     prompt: str,
     lyrics: str = "",
@@ -321,9 +590,10 @@ def generate_from_preset(
     preset_name: str,
     lyrics: str = "",
     duration: float = 60.0,
-    custom_prompt: str = ""
+    custom_prompt: str = "",
+    seed: int = -1
 ) -> Dict:
-    """Generate music using a DGB preset"""
+    """Generate music using a DGB preset (a fixed seed makes it cacheable)"""
     preset = get_preset(preset_name)
     
     # Combine preset prompt with custom
@@ -335,7 +605,8 @@ def generate_from_preset(
         prompt=full_prompt,
         lyrics=lyrics,
         duration=duration,
-        antigravity=preset["antigravity"]
+        antigravity=preset["antigravity"],
+        seed=seed
     )
 
 
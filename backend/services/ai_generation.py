@@ -4,37 +4,104 @@ Handles audio analysis, prompt-to-MIDI, and music generation
 """
 import os
 import json
-import base64
+import asyncio
+import hashlib
 from datetime import datetime
-from typing import Optional, List, Dict
-import httpx
+from typing import Optional, List, Dict, AsyncIterator
+
+from services.http_client import openai_client, auth_headers
+
+
+# Local analysis answers on its own at or above this overall confidence
+LOCAL_ANALYSIS_CONFIDENCE = float(os.getenv("ANALYSIS_LOCAL_CONFIDENCE", "0.7"))
+# Always taken from the local analyzer, even when the model is asked
+MEASURED_FIELDS = ("detected_key", "detected_bpm", "timbre_profile", "quality_score")
 
 
 async def analyze_audio(
     audio_data: bytes,
     api_key: str,
     instrument: str = "guitar",
-    genre: str = "bachata"
+    genre: str = "bachata",
+    content_hash: Optional[str] = None
 ) -> dict:
     """
-    Analyze recorded audio using OpenAI's audio understanding
-    Returns detected key, BPM, timbre profile, and patterns
+    Analyze recorded audio.
+    Returns detected key, BPM, timbre profile, and patterns.
+    
+    Results are cached by content hash + (instrument, genre). Key, BPM,
+    timbre and quality are always measured locally; OpenAI is only asked
+    (for patterns and recommendations) when that measurement is not
+    confident.
     """
+    from services import analysis_cache
+    
+    content_hash = content_hash or hashlib.sha256(audio_data).hexdigest()
+    cached = analysis_cache.lookup(content_hash, instrument, genre)
+    if cached:
+        return {
+            "success": True,
+            "analysis": cached["analysis"],
+            "detected_instrument": instrument,
+            "genre": genre,
+            "source": cached["source"],
+            "cached": True,
+            "tokens_used": 0,
+            "analyzed_at": cached["analyzed_at"]
+        }
+    
+    async def analyze():
+        result = await _analyze_uncached(audio_data, api_key, instrument, genre)
+        if result.get("success"):
+            analysis_cache.store(content_hash, instrument, genre, result["analysis"],
+                                 source=result["source"], size_bytes=len(audio_data),
+                                 tokens_used=result["tokens_used"])
+        return result
+    
+    return await analysis_cache.single_flight((content_hash, instrument, genre), analyze)
+
+
+async def _analyze_uncached(audio_data: bytes, api_key: str, instrument: str, genre: str) -> dict:
+    from services.audio_processor import estimate_musical_features, UNSUPPORTED_FORMAT
+    
+    # CPU-bound; keep it off the event loop
+    local = await asyncio.to_thread(estimate_musical_features, audio_data, genre)
+    if local.get("error") == UNSUPPORTED_FORMAT:
+        return local
+    if "error" not in local and local["confidence"]["overall"] >= LOCAL_ANALYSIS_CONFIDENCE:
+        return {
+            "success": True,
+            "analysis": local,
+            "detected_instrument": instrument,
+            "genre": genre,
+            "source": "local",
+            "tokens_used": 0,
+            "analyzed_at": datetime.now().isoformat()
+        }
+    
+    result = await _remote_analysis(api_key, instrument, genre)
+    if result.get("success") and "error" not in local:
+        # The model only writes the prose; key/BPM/timbre/quality are measured
+        result["analysis"] = {
+            **result["analysis"],
+            **{field: local[field] for field in MEASURED_FIELDS},
+            "confidence": local["confidence"]
+        }
+        result["source"] = "local+remote"
+    return result
+
+
+async def _remote_analysis(api_key: str, instrument: str, genre: str) -> dict:
+    """Ask OpenAI for the analysis (the recording itself is not sent)"""
     if not api_key:
         return {"error": "OpenAI API key not configured"}
     
     try:
-        # Encode audio to base64
-        audio_b64 = base64.b64encode(audio_data).decode('utf-8')
-        
         # Use GPT-4 with audio understanding
-        async with httpx.AsyncClient() as client:
+        async with openai_client() as client:
             response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
+                "/chat/completions",
+                headers=auth_headers(api_key),
                 json={
                     "model": "gpt-4-turbo-preview",
                     "messages": [
@@ -80,6 +147,7 @@ async def analyze_audio(
                     "analysis": analysis,
                     "detected_instrument": instrument,
                     "genre": genre,
+                    "source": "remote",
                     "tokens_used": result.get("usage", {}).get("total_tokens", 0),
                     "analyzed_at": datetime.now().isoformat()
                 }
@@ -144,13 +212,10 @@ async def generate_midi_from_prompt(
     style = genre_styles.get(genre, genre_styles["bachata"])
     
     try:
-        async with httpx.AsyncClient() as client:
+        async with openai_client() as client:
             response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
+                "/chat/completions",
+                headers=auth_headers(api_key),
                 json={
                     "model": "gpt-4-turbo-preview",
                     "messages": [
@@ -226,19 +291,8 @@ Responde en JSON con esta estructura:
         return {"error": str(e)}
 
 
-async def generate_lyrics(
-    theme: str,
-    api_key: str,
-    genre: str = "bachata",
-    mood: str = "romantic",
-    language: str = "spanish"
-) -> dict:
-    """
-    Generate lyrics for tropical music based on theme and genre
-    """
-    if not api_key:
-        return {"error": "OpenAI API key not configured"}
-    
+def _lyrics_request(theme: str, genre: str, mood: str, language: str) -> dict:
+    """Chat completion body shared by generate_lyrics and stream_lyrics"""
     genre_themes = {
         "bachata": "amor, desamor, nostalgia, pasión",
         "bolero": "romance profundo, despedidas, recuerdos",
@@ -248,20 +302,12 @@ async def generate_lyrics(
         "cumbia": "fiesta, tradición, alegría popular"
     }
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4-turbo-preview",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": f"""Eres un letrista profesional de {genre} latino.
+    return {
+        "model": "gpt-4-turbo-preview",
+        "messages": [
+            {
+                "role": "system",
+                "content": f"""Eres un letrista profesional de {genre} latino.
                             
 Temas típicos del género: {genre_themes.get(genre, 'amor y vida')}
 
@@ -270,10 +316,10 @@ Escribe letras auténticas con:
 - Rimas naturales
 - Vocabulario apropiado al género
 - Emociones genuinas"""
-                        },
-                        {
-                            "role": "user",
-                            "content": f"""Escribe una letra de {genre} sobre: {theme}
+            },
+            {
+                "role": "user",
+                "content": f"""Escribe una letra de {genre} sobre: {theme}
                             
 Estado de ánimo: {mood}
 Idioma: {language}
@@ -288,11 +334,32 @@ Responde en JSON:
     "suggested_rhyme_scheme": "ABAB o AABB",
     "emotional_arc": "descripción del arco emocional"
 }}"""
-                        }
-                    ],
-                    "max_tokens": 1000,
-                    "response_format": {"type": "json_object"}
-                },
+            }
+        ],
+        "max_tokens": 1000,
+        "response_format": {"type": "json_object"}
+    }
+
+
+async def generate_lyrics(
+    theme: str,
+    api_key: str,
+    genre: str = "bachata",
+    mood: str = "romantic",
+    language: str = "spanish"
+) -> dict:
+    """
+    Generate lyrics for tropical music based on theme and genre
+    """
+    if not api_key:
+        return {"error": "OpenAI API key not configured"}
+    
+    try:
+        async with openai_client() as client:
+            response = await client.post(
+                "/chat/completions",
+                headers=auth_headers(api_key),
+                json=_lyrics_request(theme, genre, mood, language),
                 timeout=30.0
             )
             
@@ -318,6 +385,74 @@ Responde en JSON:
         return {"error": str(e)}
 
 
+async def stream_lyrics(
+    theme: str,
+    api_key: str,
+    genre: str = "bachata",
+    mood: str = "romantic",
+    language: str = "spanish"
+) -> AsyncIterator[dict]:
+    """
+    Streaming generate_lyrics. Yields {"type": "token", "content": ...} as
+    text arrives, then one {"type": "done", ...} with the parsed lyrics and
+    token usage, or {"type": "error", ...}. Closing the generator closes
+    the upstream request.
+    """
+    if not api_key:
+        yield {"type": "error", "error": "OpenAI API key not configured"}
+        return
+    
+    body = {
+        **_lyrics_request(theme, genre, mood, language),
+        "stream": True,
+        "stream_options": {"include_usage": True}
+    }
+    parts = []
+    usage = {}
+    try:
+        async with openai_client() as client:
+            async with client.stream(
+                "POST", "/chat/completions",
+                headers=auth_headers(api_key), json=body, timeout=60.0
+            ) as response:
+                if response.status_code != 200:
+                    details = (await response.aread()).decode(errors="replace")
+                    yield {"type": "error", "error": f"API error: {response.status_code}",
+                           "details": details}
+                    return
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices", []):
+                        content = choice.get("delta", {}).get("content")
+                        if content:
+                            parts.append(content)
+                            yield {"type": "token", "content": content}
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+        return
+    
+    text = "".join(parts)
+    try:
+        lyrics = json.loads(text)
+    except ValueError:
+        lyrics = {"raw": text}
+    yield {
+        "type": "done",
+        "success": True,
+        "lyrics": lyrics,
+        "genre": genre,
+        "mood": mood,
+        "tokens_used": usage.get("total_tokens", 0),
+        "generated_at": datetime.now().isoformat()
+    }
+
+
 def convert_to_midi_file(composition: dict, output_path: str) -> dict:
     """
     Convert AI-generated composition to actual MIDI file
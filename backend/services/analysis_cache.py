@@ -0,0 +1,222 @@
+"""
+DGB AUDIO - Audio Analysis Cache
+=================================
+Analysis results keyed by the sha256 of the uploaded audio plus the
+(instrument, genre) it was analyzed as, so re-analyzing the same take is
+free.
+
+Request bodies over ANALYZE_AUDIO_MAX_MB are turned away by
+UploadLimitMiddleware before the multipart form is parsed: up front from
+Content-Length, or as soon as a body sent without one crosses the limit.
+read_upload then hashes the (already spooled) upload chunk by chunk into
+a single buffer. Identical analyses already in flight are shared rather
+than run twice.
+
+Entries expire after ANALYSIS_CACHE_TTL_DAYS and the least recently used
+are dropped beyond ANALYSIS_CACHE_MAX_ENTRIES.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Callable, Awaitable
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from database import get_connection
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("ANALYZE_AUDIO_MAX_MB", "25")) * 1024 * 1024)
+CACHE_TTL_DAYS = float(os.getenv("ANALYSIS_CACHE_TTL_DAYS", "30"))
+MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "5000"))
+READ_CHUNK_BYTES = 1024 * 1024
+# Room for multipart boundaries and the other form fields
+MULTIPART_SLACK_BYTES = 64 * 1024
+
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "local": 0, "remote": 0}
+_stats_lock = threading.Lock()
+
+# (content_hash, instrument, genre) -> Future of the running analysis
+_inflight: Dict[tuple, asyncio.Future] = {}
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+# ============================================================================
+# UPLOADS
+# ============================================================================
+
+def _too_large_detail(max_bytes: int) -> str:
+    return f"Audio too large (max {max_bytes // (1024 * 1024)} MB)"
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware capping request bodies on the given paths, so an
+    oversized upload is refused before Starlette spools it to disk.
+    """
+
+    def __init__(self, app, paths, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+        self.limit = max_bytes + MULTIPART_SLACK_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        from fastapi import HTTPException
+        from fastapi.responses import JSONResponse
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.limit:
+            response = JSONResponse({"detail": _too_large_detail(self.max_bytes)}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # Raised while the form is parsed; FastAPI re-raises HTTPException as is
+                    raise HTTPException(status_code=413, detail=_too_large_detail(self.max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_upload(upload, max_bytes: int = MAX_UPLOAD_BYTES) -> tuple:
+    """
+    (data, content_hash) for an UploadFile, read and hashed chunk by chunk
+    into a single buffer. Returns (None, None) if the file part alone
+    exceeds max_bytes (the request as a whole is capped by
+    UploadLimitMiddleware).
+    """
+    declared = getattr(upload, "size", None)
+    if declared is not None and declared > max_bytes:
+        return None, None
+
+    digest = hashlib.sha256()
+    data = bytearray()
+    while True:
+        chunk = await upload.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if len(data) + len(chunk) > max_bytes:
+            return None, None
+        digest.update(chunk)
+        data += chunk
+    return data, digest.hexdigest()
+
+
+# ============================================================================
+# LOOKUP / STORE
+# ============================================================================
+
+def lookup(content_hash: str, instrument: str, genre: str) -> Optional[Dict]:
+    """Cached {"analysis", "source", "tokens_used", "analyzed_at"} or None"""
+    with get_connection() as conn:
+        row = conn.execute(f"""
+        SELECT id, source, analysis, tokens_used, created_at FROM audio_analysis_cache
+        WHERE content_hash = ? AND instrument = ? AND genre = ?
+          AND created_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', '-{CACHE_TTL_DAYS} days')
+        """, (content_hash, instrument, genre)).fetchone()
+        if not row:
+            _count("misses")
+            return None
+        conn.execute(f"""
+        UPDATE audio_analysis_cache SET hits = hits + 1, last_used_at = {NOW_SQL} WHERE id = ?
+        """, (row["id"],))
+    _count("hits")
+    return {
+        "analysis": json.loads(row["analysis"]),
+        "source": row["source"],
+        "tokens_used": row["tokens_used"],
+        "analyzed_at": row["created_at"]
+    }
+
+
+def store(content_hash: str, instrument: str, genre: str, analysis: Dict,
+          source: str, size_bytes: int = 0, tokens_used: int = 0):
+    with get_connection() as conn:
+        conn.execute(f"""
+        INSERT INTO audio_analysis_cache (content_hash, instrument, genre, source, analysis,
+                                          size_bytes, tokens_used, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, {NOW_SQL}, {NOW_SQL})
+        ON CONFLICT(content_hash, instrument, genre) DO UPDATE SET
+            source = excluded.source,
+            analysis = excluded.analysis,
+            tokens_used = excluded.tokens_used,
+            created_at = excluded.created_at,
+            last_used_at = excluded.last_used_at
+        """, (content_hash, instrument, genre, source, json.dumps(analysis, ensure_ascii=False),
+              size_bytes, tokens_used))
+        _prune(conn)
+    _count("stores")
+    _count("local" if source == "local" else "remote")
+
+
+def _prune(conn):
+    """Drop expired entries and the least recently used beyond the cap"""
+    conn.execute(f"""
+    DELETE FROM audio_analysis_cache
+    WHERE created_at < strftime('%Y-%m-%d %H:%M:%f', 'now', '-{CACHE_TTL_DAYS} days')
+    """)
+    conn.execute("""
+    DELETE FROM audio_analysis_cache WHERE id NOT IN (
+        SELECT id FROM audio_analysis_cache ORDER BY last_used_at DESC LIMIT ?
+    )
+    """, (MAX_ENTRIES,))
+
+
+async def single_flight(key: tuple, analyze: Callable[[], Awaitable[Dict]]) -> Dict:
+    """
+    Run analyze() once per key at a time; concurrent callers for the same
+    key get a copy of the leader's result, marked coalesced and unbilled.
+    """
+    flight = _inflight.get(key)
+    if flight is not None:
+        _count("coalesced")
+        result = await asyncio.shield(flight)
+        if result.get("success"):
+            return {**result, "tokens_used": 0, "coalesced": True}
+        return result
+
+    flight = _inflight[key] = asyncio.get_running_loop().create_future()
+    result = {"error": "Analysis failed"}
+    try:
+        result = await analyze()
+        return result
+    finally:
+        _inflight.pop(key, None)
+        flight.set_result(result)
+
+
+def get_cache_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    with get_connection() as conn:
+        row = conn.execute("""
+        SELECT COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(hits * tokens_used), 0),
+               COALESCE(SUM(source = 'local'), 0)
+        FROM audio_analysis_cache
+        """).fetchone()
+    stats.update({"entries": row[0], "entry_hits": row[1], "tokens_saved": row[2],
+                  "local_entries": row[3], "max_upload_bytes": MAX_UPLOAD_BYTES,
+                  "ttl_days": CACHE_TTL_DAYS})
+    return stats
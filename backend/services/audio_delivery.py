@@ -0,0 +1,199 @@
+"""
+DGB AUDIO - Audio Delivery
+===========================
+Progressive delivery of generated audio.
+
+- Range requests on finished WAVs, so players can seek and start early.
+- Live streaming of a generation in progress: backends that render in
+  chunks (a Gradio generator endpoint, e.g. scripts/stub_acestep_server.py)
+  yield each one as it is ready, and acestep_service publishes them as
+  OUTPUT_DIR/{job_id}.segments/00000.wav, 00001.wav, ... (each written
+  under another name and renamed into place). Backends that only return
+  the finished file simply stream once the job completes. The stream
+  sends a WAV header with unknown length followed by the PCM of each
+  segment as it appears. Once the job finishes, it continues from the
+  final file at the same offset, so removing the segments is safe.
+"""
+
+import asyncio
+import os
+import struct
+from pathlib import Path
+from typing import Optional, Tuple, Iterator, AsyncIterator
+
+CHUNK_SIZE = 64 * 1024
+POLL_SECONDS = 0.5
+STREAM_IDLE_TIMEOUT = 600.0
+
+# Data size placeholder for streams whose length is not known up front
+UNKNOWN_LENGTH = 0xFFFFFFFF
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+# ============================================================================
+# RANGE REQUESTS
+# ============================================================================
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=start-end" header into inclusive offsets.
+    Returns None for a missing or multi-range header (serve the whole file).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(end_s))
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def iter_file(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """Yield bytes start..end (inclusive) of a file in CHUNK_SIZE pieces"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+async def aiter_file(path: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """iter_file for async generators: each read runs in a worker thread"""
+    chunks = iter_file(path, start, end)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        chunks.close()
+
+
+# ============================================================================
+# WAV HELPERS
+# ============================================================================
+
+def wav_layout(path: str) -> Optional[Tuple[bytes, int, int]]:
+    """(fmt chunk bytes, data offset, data size) of a RIFF/WAVE file"""
+    try:
+        with open(path, "rb") as f:
+            riff = f.read(12)
+            if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+                return None
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return None
+                chunk_id, chunk_size = header[:4], struct.unpack("<I", header[4:])[0]
+                if chunk_id == b"fmt ":
+                    fmt = header + f.read(chunk_size + (chunk_size & 1))
+                elif chunk_id == b"data":
+                    if fmt is None:
+                        return None
+                    data_size = min(chunk_size, os.path.getsize(path) - f.tell())
+                    return fmt, f.tell(), data_size
+                else:
+                    f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    except OSError:
+        return None
+
+
+def streaming_wav_header(fmt_chunk: bytes) -> bytes:
+    """RIFF header with unknown length, as used by live WAV streams"""
+    return (
+        b"RIFF" + struct.pack("<I", UNKNOWN_LENGTH) + b"WAVE"
+        + fmt_chunk
+        + b"data" + struct.pack("<I", UNKNOWN_LENGTH)
+    )
+
+
+# ============================================================================
+# LIVE STREAMING
+# ============================================================================
+
+def segments_dir(output_dir: Path, job_id: str) -> Path:
+    return output_dir / f"{job_id}.segments"
+
+
+def _segment_files(directory: Path) -> list:
+    try:
+        return sorted(p for p in directory.iterdir() if p.suffix == ".wav")
+    except OSError:
+        return []
+
+
+async def stream_generation(job_id: str, output_dir: Path, job_status) -> AsyncIterator[bytes]:
+    """
+    Yield a WAV stream for a job while it renders.
+
+    job_status() returns the job's current status; the stream ends once
+    the job is completed and all of its audio has been sent, or when it
+    fails, is cancelled, or stays idle for STREAM_IDLE_TIMEOUT.
+    """
+    final_path = output_dir / f"{job_id}.wav"
+    seg_dir = segments_dir(output_dir, job_id)
+    header_sent = False
+    sent_pcm = 0          # PCM bytes delivered so far
+    next_segment = 0
+    idle = 0.0
+
+    while True:
+        status = await asyncio.to_thread(job_status)
+
+        if status == "completed" and final_path.exists():
+            layout = await asyncio.to_thread(wav_layout, str(final_path))
+            if layout is None:
+                return
+            fmt, data_offset, data_size = layout
+            if not header_sent:
+                yield streaming_wav_header(fmt)
+            if sent_pcm < data_size:
+                async for chunk in aiter_file(str(final_path), data_offset + sent_pcm,
+                                              data_offset + data_size - 1):
+                    yield chunk
+            return
+
+        if status not in ("queued", "running"):
+            return
+
+        segments = await asyncio.to_thread(_segment_files, seg_dir)
+        progressed = False
+        while next_segment < len(segments):
+            segment = str(segments[next_segment])
+            layout = await asyncio.to_thread(wav_layout, segment)
+            if layout is None:
+                break
+            fmt, data_offset, data_size = layout
+            if not header_sent:
+                yield streaming_wav_header(fmt)
+                header_sent = True
+            async for chunk in aiter_file(segment, data_offset, data_offset + data_size - 1):
+                yield chunk
+            sent_pcm += data_size
+            next_segment += 1
+            progressed = True
+
+        idle = 0.0 if progressed else idle + POLL_SECONDS
+        if idle >= STREAM_IDLE_TIMEOUT:
+            return
+        await asyncio.sleep(POLL_SECONDS)
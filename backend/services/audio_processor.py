@@ -122,6 +122,394 @@ def analyze_audio(file_path: str) -> Dict:
         }
 
 
+# ============================================================================
+# LOCAL KEY / TEMPO / TIMBRE ANALYSIS
+# ============================================================================
+# Deterministic, numpy-only; input must be PCM WAV (anything else is
+# rejected with UNSUPPORTED_FORMAT rather than pulling in a decoder). The
+# recording is decoded once, box-filtered down to ~22 kHz, and every
+# feature comes from a single STFT pass processed in blocks of frames.
+
+ANALYSIS_SAMPLE_RATE = 22050
+N_FFT = 2048
+HOP_LENGTH = 512
+STFT_BLOCK_FRAMES = 512  # bounds memory for long recordings
+TEMPO_RANGE = (40, 240)
+
+# Krumhansl-Schmuckler key profiles, starting at C
+MAJOR_PROFILE = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+MINOR_PROFILE = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+PITCH_CLASSES = ["C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B"]
+
+# Usual tempo per genre, used to correct half/double-time beat tracking
+GENRE_BPM_RANGES = {
+    "bachata": (110, 150),
+    "bolero": (60, 100),
+    "merengue": (120, 180),
+    "salsa": (150, 220),
+    "cumbia": (80, 120),
+    "vallenato": (90, 140),
+    "reggaeton": (85, 105),
+}
+DEFAULT_BPM_RANGE = (70, 180)
+
+UNSUPPORTED_FORMAT = "Unsupported audio format: upload the recording as PCM WAV"
+
+# Peak frame RMS below which a recording is treated as silent (-80 dBFS)
+SILENCE_RMS = 1e-4
+NEUTRAL_TIMBRE = {"brightness": 0.5, "warmth": 0.5, "attack": 0.0, "sustain": 0.0}
+
+
+def _load_mono(audio):
+    """
+    (samples, sample_rate) as mono float32 in [-1, 1]. `audio` is a path
+    or the file's bytes. Only PCM WAV (8/16/24/32-bit) is accepted; other
+    formats raise ValueError(UNSUPPORTED_FORMAT).
+    """
+    import io
+    import wave
+    import numpy as np
+
+    source = io.BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio
+    try:
+        with wave.open(source, "rb") as wav:
+            channels, width, sr = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            raw = wav.readframes(wav.getnframes())
+        if width == 1:
+            y = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+        elif width == 3:
+            b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            y = ((b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8).astype(np.float32) / 2 ** 23
+        else:
+            y = np.frombuffer(raw, dtype=f"<i{width}").astype(np.float32) / 2 ** (8 * width - 1)
+        y = y.reshape(-1, channels).mean(axis=1) if channels > 1 else y
+    except (wave.Error, EOFError):
+        # Float WAV, FLAC, OGG, WebM, ...
+        raise ValueError(UNSUPPORTED_FORMAT)
+    return y, sr
+
+
+def _downsample(y, sr: int):
+    """Integer-factor box-filter decimation towards ANALYSIS_SAMPLE_RATE"""
+    factor = max(1, int(sr // ANALYSIS_SAMPLE_RATE))
+    if factor == 1:
+        return y, sr
+    usable = len(y) - len(y) % factor
+    return y[:usable].reshape(-1, factor).mean(axis=1), sr / factor
+
+
+def _autocorrelate(x):
+    """Autocorrelation via FFT, normalized to 1 at lag 0"""
+    import numpy as np
+
+    n = len(x)
+    spectrum = np.fft.rfft(x, 2 * n)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    return ac / ac[0] if ac[0] > 0 else ac
+
+
+def _frame_features(y, sr: float) -> Dict:
+    """
+    One STFT pass (Hann window, N_FFT/HOP_LENGTH, centered) giving, per
+    frame: RMS, onset strength (positive log-spectral flux) and spectral
+    flatness; and over the whole take: summed power spectrum and mean
+    frame-normalized chroma.
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    padded = np.pad(y.astype(np.float32), N_FFT // 2, mode="reflect" if len(y) > N_FFT // 2 else "constant")
+    frames = sliding_window_view(padded, N_FFT)[::HOP_LENGTH]
+    window = np.hanning(N_FFT + 1)[:-1].astype(np.float32)
+    freqs = np.fft.rfftfreq(N_FFT, 1 / sr)
+
+    # Chroma: each bin from 80 Hz to 5 kHz votes for its nearest pitch class
+    tonal = np.flatnonzero((freqs >= 80) & (freqs <= 5000))
+    pitch_class = np.round(12 * np.log2(freqs[tonal] / 440) + 69).astype(int) % 12
+    chroma_map = np.zeros((12, len(tonal)), dtype=np.float32)
+    chroma_map[pitch_class, np.arange(len(tonal))] = 1
+
+    n = len(frames)
+    rms = np.empty(n, dtype=np.float32)
+    flux = np.empty(n, dtype=np.float32)
+    flatness = np.empty(n, dtype=np.float32)
+    spectrum = np.zeros(len(freqs))
+    chroma = np.zeros(12)
+    previous = None
+    for start in range(0, n, STFT_BLOCK_FRAMES):
+        block = frames[start:start + STFT_BLOCK_FRAMES]
+        rms[start:start + len(block)] = np.sqrt((block ** 2).mean(axis=1))
+        magnitude = np.abs(np.fft.rfft(block * window, axis=1)).astype(np.float32)
+        power = magnitude ** 2
+        spectrum += power.sum(axis=0)
+
+        frame_chroma = magnitude[:, tonal] @ chroma_map.T
+        chroma += (frame_chroma / (frame_chroma.max(axis=1, keepdims=True) + 1e-9)).sum(axis=0)
+
+        log_magnitude = np.log1p(100 * magnitude)
+        stacked = log_magnitude if previous is None else np.vstack([previous, log_magnitude])
+        diff = np.maximum(0, np.diff(stacked, axis=0)).mean(axis=1)
+        flux[start:start + len(block)] = diff if previous is not None else np.concatenate([[0], diff])
+        previous = log_magnitude[-1:]
+
+        flatness[start:start + len(block)] = (
+            np.exp(np.log(power + 1e-12).mean(axis=1)) / (power.mean(axis=1) + 1e-12)
+        )
+
+    return {
+        "freqs": freqs,
+        "spectrum": spectrum,
+        "chroma": chroma / max(n, 1),
+        "onset_env": flux,
+        "rms": rms,
+        "flatness": flatness,
+        "frame_rate": sr / HOP_LENGTH
+    }
+
+
+def _estimate_key(chroma) -> Tuple[str, float]:
+    """
+    Best-correlated major/minor key for a 12-bin chroma vector, and a 0-1
+    confidence from how clearly it beats the next key (ignoring its
+    relative major/minor, which shares the same notes).
+    """
+    import numpy as np
+
+    profiles = np.array([np.roll(MAJOR_PROFILE, i) for i in range(12)] +
+                        [np.roll(MINOR_PROFILE, i) for i in range(12)])
+    chroma = np.asarray(chroma, dtype=float)
+    if not chroma.any():
+        return "Unknown", 0.0
+
+    # Pearson correlation against all 24 keys at once
+    p = (profiles - profiles.mean(axis=1, keepdims=True)) / profiles.std(axis=1, keepdims=True)
+    c = (chroma - chroma.mean()) / (chroma.std() or 1.0)
+    scores = p @ c / 12
+
+    best = int(np.argmax(scores))
+    relative = (best % 12 + 9) % 12 + 12 if best < 12 else (best % 12 + 3) % 12
+    others = np.delete(scores, [best, relative])
+    margin = scores[best] - others.max()
+    confidence = np.clip(margin / 0.1, 0, 1) * np.clip(scores[best] / 0.6, 0, 1)
+
+    name = PITCH_CLASSES[best % 12] + ("" if best < 12 else "m")
+    return name, round(float(confidence), 2)
+
+
+def _estimate_tempo(onset_env, frame_rate: float, center_bpm: float = 120) -> float:
+    """
+    BPM at the strongest periodicity of the onset envelope, weighted
+    towards center_bpm (log-normal prior) and refined between lags.
+    """
+    import numpy as np
+
+    env = onset_env - onset_env.mean()
+    if not env.any():
+        return 0.0
+    ac = _autocorrelate(env)
+    lags = np.arange(max(1, int(60 * frame_rate / TEMPO_RANGE[1])),
+                     min(len(ac) - 1, int(60 * frame_rate / TEMPO_RANGE[0]) + 1))
+    if not len(lags):
+        return 0.0
+    prior = np.exp(-0.5 * np.log2(60 * frame_rate / lags / center_bpm) ** 2)
+    lag = lags[np.argmax(ac[lags] * prior)]
+
+    # Parabolic interpolation around the peak for sub-frame precision
+    a, b, c = ac[lag - 1], ac[lag], ac[lag + 1]
+    offset = 0.5 * (a - c) / (a - 2 * b + c) if (a - 2 * b + c) < 0 else 0.0
+    return float(60 * frame_rate / (lag + offset))
+
+
+def _fold_tempo(bpm: float, genre: Optional[str] = None) -> Tuple[float, bool]:
+    """Halve/double bpm into the genre's usual range; (bpm, in_range)"""
+    low, high = GENRE_BPM_RANGES.get((genre or "").lower(), DEFAULT_BPM_RANGE)
+    if bpm <= 0:
+        return 0.0, False
+    while bpm < low and bpm * 2 <= high * 1.1:
+        bpm *= 2
+    while bpm > high and bpm / 2 >= low * 0.9:
+        bpm /= 2
+    return bpm, low * 0.9 <= bpm <= high * 1.1
+
+
+def _tempo_confidence(onset_env, bpm: float, frame_rate: float, bpm_in_range: bool) -> float:
+    """
+    How strongly the onset envelope repeats at the beat period: its
+    normalized autocorrelation at that lag (or twice it), so noise and
+    rubato score low.
+    """
+    import numpy as np
+
+    env = np.asarray(onset_env, dtype=float)
+    env = env - env.mean()
+    if bpm <= 0 or len(env) < 4 * frame_rate or not env.any():
+        return 0.0
+    ac = _autocorrelate(env)
+    lags = np.round(np.array([1, 2]) * 60 * frame_rate / bpm).astype(int)
+    lags = lags[lags + 2 < len(ac)]
+    if not len(lags):
+        return 0.0
+    pulse = max(ac[lag - 2:lag + 3].max() for lag in lags)
+    confidence = np.clip(pulse / 0.5, 0, 1)
+    if not bpm_in_range:
+        confidence *= 0.6
+    return round(float(confidence), 2)
+
+
+def _pick_onsets(onset_env, frame_rate: float):
+    """Frames where the onset envelope peaks clearly above its local average"""
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    if not onset_env.any():
+        return np.array([], dtype=int)
+    env = onset_env / onset_env.max()
+    peak_radius = max(1, int(round(0.03 * frame_rate)))
+    mean_radius = max(1, int(round(0.1 * frame_rate)))
+    local_max = sliding_window_view(np.pad(env, peak_radius, mode="edge"),
+                                    2 * peak_radius + 1).max(axis=1)
+    local_mean = sliding_window_view(np.pad(env, mean_radius, mode="edge"),
+                                     2 * mean_radius + 1).mean(axis=1)
+    peaks = np.flatnonzero((env >= local_max) & (env >= local_mean + 0.07))
+    # One onset per plateau
+    return peaks[np.concatenate([[True], np.diff(peaks) > peak_radius])] if len(peaks) else peaks
+
+
+def _timbre_profile(spectrum, freqs, rms, onset_frames, frame_rate: float) -> Dict:
+    """
+    0-1 brightness/warmth/attack/sustain from the summed power spectrum,
+    frame RMS and onset frame indices. Silent input gets NEUTRAL_TIMBRE.
+    """
+    import numpy as np
+
+    if len(rms) == 0 or rms.max() < SILENCE_RMS:
+        return dict(NEUTRAL_TIMBRE)
+
+    total = spectrum.sum()
+    centroid = float((freqs * spectrum).sum() / total)
+    rolloff = float(freqs[min(np.searchsorted(np.cumsum(spectrum), 0.85 * total), len(freqs) - 1)])
+    brightness = np.clip(0.5 * centroid / 3000 + 0.5 * rolloff / 6000, 0, 1)
+
+    audible = (freqs >= 20) & (freqs <= 8000)
+    body = (freqs >= 100) & (freqs <= 800)
+    warmth = spectrum[body].sum() / (spectrum[audible].sum() or 1.0)
+
+    peak_rms = rms.max()
+    onsets = np.asarray(onset_frames, dtype=int)
+    if len(onsets):
+        last = len(rms) - 1
+        before = rms[np.clip(onsets - 2, 0, last)]
+        peaks = rms[np.clip(onsets[:, None] + np.arange(4), 0, last)].max(axis=1)
+        later = rms[np.clip(onsets + 3 + int(round(0.3 * frame_rate)), 0, last)]
+        valid = peaks > 0
+        attack = np.median((peaks[valid] - before[valid]) / peaks[valid]) if valid.any() else 0.0
+        sustain = np.median(later[valid] / peaks[valid]) if valid.any() else 0.0
+    else:
+        attack = 0.0
+        sustain = rms.mean() / peak_rms
+
+    return {
+        "brightness": round(float(brightness), 2),
+        "warmth": round(float(np.clip(warmth, 0, 1)), 2),
+        "attack": round(float(np.clip(attack, 0, 1)), 2),
+        "sustain": round(float(np.clip(sustain, 0, 1)), 2)
+    }
+
+
+def _recording_quality(y, rms, flatness, duration: float) -> Tuple[int, List[str]]:
+    """0-100 score from clipping, level and how noise-like the spectrum is, plus tips"""
+    import numpy as np
+
+    score = 100.0
+    tips = []
+    clipped = float(np.mean(np.abs(y) >= 0.999))
+    if clipped > 0.0005:
+        score -= min(40, clipped * 4000)
+        tips.append("Baja la ganancia de entrada: la grabación tiene recortes (clipping)")
+    if np.abs(y).max() < 0.05:
+        score -= 20
+        tips.append("Sube el nivel de grabación: la señal es muy baja")
+    # Spectral flatness: ~0 for tonal sound, approaching 1 for white noise
+    sounding = flatness[rms > 1e-4]
+    if len(sounding):
+        noisiness = float(np.median(sounding))
+        if noisiness > 0.1:
+            score -= min(40, (noisiness - 0.1) * 100)
+            tips.append("Reduce el ruido de fondo o acerca el micrófono al instrumento")
+    if duration < 5:
+        score -= 10
+        tips.append("Graba al menos 10 segundos para un análisis más preciso")
+    return int(np.clip(round(score), 0, 100)), tips
+
+
+def _describe_patterns(key: str, bpm: float, in_range: bool, onsets_per_beat: float,
+                       genre: Optional[str]) -> List[str]:
+    patterns = []
+    if genre and in_range:
+        patterns.append(f"Tempo típico de {genre} ({round(bpm)} BPM)")
+    if onsets_per_beat >= 2:
+        patterns.append("Subdivisión rápida: rasgueo o arpegio en corcheas/semicorcheas")
+    elif onsets_per_beat >= 0.9:
+        patterns.append("Ataques marcando cada tiempo")
+    elif onsets_per_beat > 0:
+        patterns.append("Notas largas o acompañamiento sostenido")
+    if key != "Unknown":
+        patterns.append("Progresión en tonalidad menor" if key.endswith("m") else "Progresión en tonalidad mayor")
+    return patterns
+
+
+def estimate_musical_features(audio, genre: Optional[str] = None) -> Dict:
+    """
+    Key, tempo and timbre of a recording, computed locally and
+    deterministically. `audio` is a file path or the file's bytes. Returns
+    the fields of the remote AI analysis (detected_key, detected_bpm,
+    timbre_profile, suggested_patterns, quality_score, recommendations)
+    plus "confidence" (0-1 for key, bpm and overall).
+    """
+    try:
+        y, sr = _load_mono(audio)
+        y, sr = _downsample(y, sr)
+        duration = len(y) / sr
+        if duration < 1:
+            return {"error": "Recording too short to analyze"}
+
+        features = _frame_features(y, sr)
+        frame_rate = features["frame_rate"]
+
+        key, key_confidence = _estimate_key(features["chroma"])
+        low, high = GENRE_BPM_RANGES.get((genre or "").lower(), DEFAULT_BPM_RANGE)
+        raw_bpm = _estimate_tempo(features["onset_env"], frame_rate, center_bpm=(low * high) ** 0.5)
+        bpm, in_range = _fold_tempo(raw_bpm, genre)
+        bpm_confidence = _tempo_confidence(features["onset_env"], bpm, frame_rate, in_range)
+        onset_frames = _pick_onsets(features["onset_env"], frame_rate)
+
+        timbre = _timbre_profile(features["spectrum"], features["freqs"], features["rms"],
+                                 onset_frames, frame_rate)
+        quality_score, recommendations = _recording_quality(y, features["rms"], features["flatness"],
+                                                            duration)
+
+        onsets_per_beat = len(onset_frames) / (duration * bpm / 60) if bpm else 0.0
+        return {
+            "detected_key": key,
+            "detected_bpm": int(round(bpm)),
+            "timbre_profile": timbre,
+            "suggested_patterns": _describe_patterns(
+                key if key_confidence >= 0.5 else "Unknown", bpm,
+                in_range and bpm_confidence >= 0.5, onsets_per_beat, genre
+            ),
+            "quality_score": quality_score,
+            "recommendations": recommendations,
+            "confidence": {
+                "key": key_confidence,
+                "bpm": bpm_confidence,
+                "overall": min(key_confidence, bpm_confidence)
+            },
+            "duration": round(duration, 3)
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+
 def audio_to_midi(file_path: str, output_path: Optional[str] = None) -> str:
     """
     Convert an audio file to MIDI based on pitch detection.
@@ -19,7 +19,7 @@ from database import (
     get_user_by_email, get_user_by_id, get_user_by_token as db_get_user_by_token,
     create_user as db_create_user, create_session, delete_session,
     save_api_key, get_api_key, track_api_usage as db_track_api_usage,
-    get_user_usage_stats, update_user, get_connection
+    get_user_usage_stats, update_user, list_users_page, count_users
 )
 
 # Configuration
@@ -68,11 +68,23 @@ def decrypt_api_key(encrypted: str) -> str:
 
 
 # Plan configuration
+# generation_weight: share of GPU time under contention (weighted fair queuing)
+# max_queued_generations: jobs a user may have queued or running at once
+#                         (a batch counts as one)
+# max_batch_variants: variations allowed in one batch generation
 PLAN_CONFIG = {
-    "starter": {"storage_gb": 1, "recording_seconds": 30, "max_projects": 2},
-    "creator": {"storage_gb": 10, "recording_seconds": 60, "max_projects": 20},
-    "pro": {"storage_gb": 50, "recording_seconds": -1, "max_projects": -1},
-    "studio": {"storage_gb": 200, "recording_seconds": -1, "max_projects": -1}
+    "starter": {"storage_gb": 1, "recording_seconds": 30, "max_projects": 2,
+                "generation_weight": 1, "max_queued_generations": 3,
+                "max_batch_variants": 4},
+    "creator": {"storage_gb": 10, "recording_seconds": 60, "max_projects": 20,
+                "generation_weight": 2, "max_queued_generations": 5,
+                "max_batch_variants": 10},
+    "pro": {"storage_gb": 50, "recording_seconds": -1, "max_projects": -1,
+            "generation_weight": 4, "max_queued_generations": 10,
+            "max_batch_variants": 20},
+    "studio": {"storage_gb": 200, "recording_seconds": -1, "max_projects": -1,
+               "generation_weight": 8, "max_queued_generations": 25,
+               "max_batch_variants": 40}
 }
 
 # Role permissions
@@ -158,27 +170,74 @@ def get_user_by_token(token: str) -> Optional[dict]:
 # ROLE MANAGEMENT (SuperAdmin only)
 # ============================================================================
 
-def get_all_users(requester_email: str) -> dict:
-    """Get all users (SuperAdmin only)"""
+def _encode_cursor(row: dict) -> str:
+    import base64
+    raw = f"{row['created_at']}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Optional[tuple]:
+    import base64
+    try:
+        created_at, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return (created_at, user_id)
+    except Exception:
+        return None
+
+
+def get_all_users(
+    requester_email: str,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    plan: Optional[str] = None,
+    role: Optional[str] = None,
+    email_prefix: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    include_total: bool = False
+) -> dict:
+    """Get a page of users, newest first (SuperAdmin only)"""
     requester = get_user_by_email(requester_email)
     
     if not requester or requester.get("role") != "superadmin":
         return {"error": "Unauthorized - SuperAdmin only"}
     
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users ORDER BY created_at DESC")
-        users = []
-        for row in cursor.fetchall():
-            user = dict(row)
-            # Remove password, parse JSON fields
-            user.pop("password_hash", None)
-            import json
-            user['permissions'] = json.loads(user.get('permissions', '[]'))
-            user['limits'] = json.loads(user.get('limits', '{}'))
-            users.append(user)
-    
-    return {"users": users, "total": len(users)}
+    limit = max(1, min(limit, 200))
+    after = None
+    if cursor:
+        after = _decode_cursor(cursor)
+        if after is None:
+            return {"error": "Invalid cursor"}
+    
+    rows = list_users_page(
+        limit=limit,
+        after=after,
+        plan=plan,
+        role=role,
+        email_prefix=email_prefix,
+        created_from=created_from,
+        created_to=created_to
+    )
+    
+    has_more = len(rows) > limit
+    users = rows[:limit]
+    
+    result = {
+        "users": users,
+        "count": len(users),
+        "has_more": has_more,
+        "next_cursor": _encode_cursor(users[-1]) if has_more else None
+    }
+    if include_total:
+        result["total"] = count_users(
+            plan=plan,
+            role=role,
+            email_prefix=email_prefix,
+            created_from=created_from,
+            created_to=created_to
+        )
+    
+    return result
 
 
 def update_user_role(requester_email: str, target_email: str, new_role: str) -> dict:
@@ -0,0 +1,269 @@
+"""
+DGB AUDIO - Support Chat Response Cache
+========================================
+Answers to common first-turn support questions (the quick responses, and
+anything close to them), so repeat questions skip gpt-4o-mini and never
+bill the user's key.
+
+Questions are normalized (case, accents, punctuation, filler words) and
+looked up per department:
+    1. exact match on the normalized text
+    2. otherwise the most similar cached question, by cosine similarity of
+       character trigrams, if it clears SUPPORT_CACHE_SIMILARITY. Only
+       questions with the same words in the same order, up to one word
+       swapped in place (a typo or synonym), are compared at all, and a
+       negation on only one side never matches.
+
+Entries expire after SUPPORT_CACHE_TTL_HOURS, are dropped when a
+department's system prompt changes, and can be invalidated per department.
+Only messages without conversation history are cached; follow-ups depend
+on context.
+"""
+
+import hashlib
+import math
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from database import get_connection
+
+CACHE_TTL_HOURS = float(os.getenv("SUPPORT_CACHE_TTL_HOURS", "24"))
+SIMILARITY_THRESHOLD = float(os.getenv("SUPPORT_CACHE_SIMILARITY", "0.85"))
+MAX_ENTRIES_PER_DEPARTMENT = int(os.getenv("SUPPORT_CACHE_MAX_ENTRIES", "500"))
+
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Words that do not change what is being asked
+STOPWORDS = {
+    "el", "la", "los", "las", "un", "una", "unos", "unas", "de", "del", "a", "al",
+    "en", "y", "o", "que", "me", "mi", "mis", "por", "favor", "para", "con", "es",
+    "hola", "gracias", "porfa", "the", "a", "an", "of", "to", "my", "please", "is",
+}
+
+# Words that invert a question ("¿puedo...?" / "¿no puedo...?")
+NEGATIONS = {"no", "nunca", "sin", "ni", "not", "never", "without", "dont", "cant"}
+
+_stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0}
+_stats_lock = threading.Lock()
+
+# department -> {"version": (prompt version, rows, max id), "entries": [(id, trigrams, norm, tokens)]}
+_index: Dict[str, Dict] = {}
+_index_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+# ============================================================================
+# NORMALIZATION / SIMILARITY
+# ============================================================================
+
+def normalize(message: str) -> str:
+    """Lowercase, strip accents and punctuation, drop filler words"""
+    text = unicodedata.normalize("NFKD", message.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = re.findall(r"[a-z0-9]+", text)
+    return " ".join(w for w in words if w not in STOPWORDS)
+
+
+def prompt_key(normalized: str) -> str:
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def prompt_version(system_prompt: str) -> str:
+    """Changes whenever a department's system prompt is edited"""
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _trigrams(normalized: str) -> Counter:
+    padded = f" {normalized} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _vector(normalized: str) -> tuple:
+    vec = _trigrams(normalized)
+    norm = math.sqrt(sum(v * v for v in vec.values()))
+    return vec, norm, tuple(normalized.split())
+
+
+def _comparable(tokens_a: tuple, tokens_b: tuple) -> bool:
+    """Same words in the same order, except at most one substituted in place"""
+    if len(tokens_a) != len(tokens_b):
+        return False
+    if NEGATIONS.intersection(tokens_a) != NEGATIONS.intersection(tokens_b):
+        return False
+    return sum(1 for x, y in zip(tokens_a, tokens_b) if x != y) <= 1
+
+
+def _similarity(a: tuple, b: tuple) -> float:
+    vec_a, norm_a, tokens_a = a
+    vec_b, norm_b, tokens_b = b
+    if not norm_a or not norm_b or not _comparable(tokens_a, tokens_b):
+        return 0.0
+    if len(vec_a) > len(vec_b):
+        vec_a, vec_b = vec_b, vec_a
+    dot = sum(count * vec_b.get(gram, 0) for gram, count in vec_a.items())
+    return dot / (norm_a * norm_b)
+
+
+def _department_index(conn, department: str, version: str) -> List[tuple]:
+    """Cached trigram vectors for a department, rebuilt when rows change"""
+    state = conn.execute(f"""
+    SELECT COUNT(*), COALESCE(MAX(id), 0) FROM support_response_cache
+    WHERE department = ? AND prompt_version = ?
+      AND created_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', '-{CACHE_TTL_HOURS} hours')
+    """, (department, version)).fetchone()
+    state = (version,) + tuple(state)
+    with _index_lock:
+        cached = _index.get(department)
+        if cached and cached["version"] == state:
+            return cached["entries"]
+
+    rows = conn.execute(f"""
+    SELECT id, normalized FROM support_response_cache
+    WHERE department = ? AND prompt_version = ?
+      AND created_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', '-{CACHE_TTL_HOURS} hours')
+    """, (department, version)).fetchall()
+    entries = [(row[0],) + _vector(row[1]) for row in rows]
+    with _index_lock:
+        _index[department] = {"version": state, "entries": entries}
+    return entries
+
+
+# ============================================================================
+# LOOKUP / STORE / INVALIDATE
+# ============================================================================
+
+def lookup(department: str, message: str, system_prompt: str) -> Optional[Dict]:
+    """Cached answer for a first-turn question, or None (records hit/miss)"""
+    normalized = normalize(message)
+    if not normalized:
+        return None
+    version = prompt_version(system_prompt)
+
+    with get_connection() as conn:
+        row = conn.execute(f"""
+        SELECT id, response, message FROM support_response_cache
+        WHERE department = ? AND prompt_key = ? AND prompt_version = ?
+          AND created_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', '-{CACHE_TTL_HOURS} hours')
+        """, (department, prompt_key(normalized), version)).fetchone()
+        match = "exact"
+        similarity = 1.0
+
+        if not row:
+            query = _vector(normalized)
+            best_id, similarity = None, 0.0
+            for entry_id, *vector in _department_index(conn, department, version):
+                score = _similarity(query, tuple(vector))
+                if score > similarity:
+                    best_id, similarity = entry_id, score
+            if best_id is not None and similarity >= SIMILARITY_THRESHOLD:
+                row = conn.execute(
+                    "SELECT id, response, message FROM support_response_cache WHERE id = ?",
+                    (best_id,)
+                ).fetchone()
+                match = "similar"
+
+        if not row:
+            _count("misses")
+            return None
+
+        conn.execute(f"""
+        UPDATE support_response_cache SET hits = hits + 1, last_used_at = {NOW_SQL}
+        WHERE id = ?
+        """, (row[0],))
+
+    _count("hits" if match == "exact" else "similar_hits")
+    return {
+        "message": row[1],
+        "match": match,
+        "matched_question": row[2],
+        "similarity": round(similarity, 3)
+    }
+
+
+def store(department: str, message: str, system_prompt: str, response: str,
+          tokens_used: int = 0):
+    """Remember the answer to a first-turn question"""
+    normalized = normalize(message)
+    if not normalized or not response:
+        return
+    with get_connection() as conn:
+        conn.execute(f"""
+        INSERT INTO support_response_cache (department, prompt_key, normalized, prompt_version,
+                                            message, response, tokens_used,
+                                            created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, {NOW_SQL}, {NOW_SQL})
+        ON CONFLICT(department, prompt_key) DO UPDATE SET
+            prompt_version = excluded.prompt_version,
+            message = excluded.message,
+            response = excluded.response,
+            tokens_used = excluded.tokens_used,
+            created_at = excluded.created_at,
+            last_used_at = excluded.last_used_at
+        """, (department, prompt_key(normalized), normalized, prompt_version(system_prompt),
+              message, response, tokens_used))
+        _prune(conn, department)
+    _count("stores")
+
+
+def _prune(conn, department: str):
+    """Drop expired entries and the least recently used beyond the cap"""
+    conn.execute(f"""
+    DELETE FROM support_response_cache
+    WHERE created_at < strftime('%Y-%m-%d %H:%M:%f', 'now', '-{CACHE_TTL_HOURS} hours')
+    """)
+    conn.execute("""
+    DELETE FROM support_response_cache
+    WHERE department = ? AND id NOT IN (
+        SELECT id FROM support_response_cache WHERE department = ?
+        ORDER BY last_used_at DESC LIMIT ?
+    )
+    """, (department, department, MAX_ENTRIES_PER_DEPARTMENT))
+
+
+def invalidate(department: Optional[str] = None) -> int:
+    """Drop cached answers for one department (or all). Returns rows removed."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if department:
+            cursor.execute("DELETE FROM support_response_cache WHERE department = ?", (department,))
+        else:
+            cursor.execute("DELETE FROM support_response_cache")
+        removed = cursor.rowcount
+    with _index_lock:
+        if department:
+            _index.pop(department, None)
+        else:
+            _index.clear()
+    return removed
+
+
+def get_cache_stats() -> Dict:
+    """Hit/miss counters since startup plus entries per department"""
+    with _stats_lock:
+        stats = dict(_stats)
+    hits = stats["hits"] + stats["similar_hits"]
+    lookups = hits + stats["misses"]
+    stats["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+
+    with get_connection() as conn:
+        rows = conn.execute("""
+        SELECT department, COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(hits * tokens_used), 0)
+        FROM support_response_cache GROUP BY department
+        """).fetchall()
+    stats["departments"] = {
+        row[0]: {"entries": row[1], "hits": row[2], "tokens_saved": row[3]} for row in rows
+    }
+    stats["ttl_hours"] = CACHE_TTL_HOURS
+    stats["similarity_threshold"] = SIMILARITY_THRESHOLD
+    return stats
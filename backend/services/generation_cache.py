@@ -0,0 +1,169 @@
+"""
+DGB AUDIO - Generation Result Cache
+====================================
+Content-addressed cache of ACE-Step renders.
+
+With a fixed seed, ACE-Step output is a pure function of its arguments, so
+the full positional argument tuple sent to the backend is hashed into a
+cache key. Renders live in generated_audio/cache/<key>.wav, are indexed in
+the generation_cache table, and are evicted least-recently-used once the
+total size passes GENERATION_CACHE_MAX_MB.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+from typing import Optional, Dict
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from database import get_connection
+
+CACHE_DIR = Path(__file__).parent.parent.parent / "generated_audio" / "cache"
+CACHE_MAX_BYTES = int(float(os.getenv("GENERATION_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str, n: int = 1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _canonical(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def cache_key(predict_args: tuple) -> str:
+    """sha256 of the canonicalized ACE-Step argument tuple"""
+    payload = json.dumps(_canonical(predict_args), separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src: str, dest: str):
+    """Hard-link src to dest (same filesystem), else copy"""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+# ============================================================================
+# LOOKUP / STORE
+# ============================================================================
+
+def lookup(key: str) -> Optional[str]:
+    """Path of the cached render for key, or None (records hit/miss)"""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT file_path FROM generation_cache WHERE cache_key = ?", (key,)
+        ).fetchone()
+        if row and os.path.exists(row[0]):
+            conn.execute(f"""
+            UPDATE generation_cache SET hits = hits + 1, last_used_at = {NOW_SQL}
+            WHERE cache_key = ?
+            """, (key,))
+            _count("hits")
+            return row[0]
+        if row:
+            # File removed behind our back
+            conn.execute("DELETE FROM generation_cache WHERE cache_key = ?", (key,))
+
+    _count("misses")
+    return None
+
+
+def store(key: str, audio_path: str, prompt: str = None,
+          duration: float = None, seed: int = None) -> Optional[str]:
+    """Add a finished render to the cache, then evict down to the size limit"""
+    if not audio_path or not os.path.exists(audio_path):
+        return None
+    size = os.path.getsize(audio_path)
+    if size > CACHE_MAX_BYTES:
+        return None
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cached_path = str(CACHE_DIR / f"{key}.wav")
+    link_or_copy(audio_path, cached_path)
+
+    with get_connection() as conn:
+        conn.execute(f"""
+        INSERT INTO generation_cache (cache_key, file_path, size_bytes, prompt, duration, seed,
+                                      created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, {NOW_SQL}, {NOW_SQL})
+        ON CONFLICT(cache_key) DO UPDATE SET
+            file_path = excluded.file_path,
+            size_bytes = excluded.size_bytes,
+            last_used_at = excluded.last_used_at
+        """, (key, cached_path, size, prompt, duration, seed))
+
+    _count("stores")
+    evict(CACHE_MAX_BYTES)
+    return cached_path
+
+
+def evict(max_bytes: int = CACHE_MAX_BYTES) -> int:
+    """Drop least-recently-used entries until the cache fits max_bytes"""
+    with get_connection() as conn:
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM generation_cache"
+        ).fetchone()[0]
+        if total <= max_bytes:
+            return 0
+
+        victims = []
+        for key, path, size in conn.execute("""
+        SELECT cache_key, file_path, size_bytes FROM generation_cache
+        ORDER BY last_used_at, created_at
+        """):
+            if total <= max_bytes:
+                break
+            victims.append((key, path))
+            total -= size
+
+        conn.executemany(
+            "DELETE FROM generation_cache WHERE cache_key = ?",
+            [(key,) for key, _ in victims]
+        )
+
+    # Outputs handed to users are separate links, so removing ours is safe
+    for _, path in victims:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    _count("evictions", len(victims))
+    return len(victims)
+
+
+def get_cache_stats() -> Dict:
+    """Hit/miss counters since startup plus current cache size"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+
+    with get_connection() as conn:
+        entries, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM generation_cache"
+        ).fetchone()
+
+    stats.update({
+        "entries": entries,
+        "size_bytes": size,
+        "max_bytes": CACHE_MAX_BYTES
+    })
+    return stats
@@ -0,0 +1,901 @@
+"""
+DGB AUDIO - Generation Job Queue
+=================================
+Durable, SQLite-backed queue in front of ACE-Step.
+
+/api/generate/music enqueues a row in generation_jobs and returns at once.
+Background workers claim queued jobs, run the diffusion in a thread, and
+record the outcome. A claimed job is leased to the claiming process
+(worker_id + lease_expires_at) and the lease is renewed while it renders;
+jobs whose lease lapsed (their process died) are put back in the queue,
+so several uvicorn processes can share the queue without rendering a job
+twice.
+
+Claim order is weighted fair queuing on GPU cost (infer_step × duration):
+each job gets a virtual finish tag start + cost / plan weight, where start
+is the later of the system virtual time and the user's previous tag. A
+user flooding the queue only pushes their own jobs back. The system
+virtual time is read from the database, so every process tags against
+the same clock.
+
+/api/generate/batch queues many variations (seeds / antigravity levels) of
+one prompt under a generation_batches row. Each variant is a normal job, so
+free workers render them concurrently across the backend pool.
+
+States: queued → running → completed | failed | cancelled
+"""
+
+import asyncio
+import json
+import os
+import secrets
+import shutil
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from database import get_connection, dict_from_row
+
+# Number of concurrent generations; defaults to the ACE-Step pool's total capacity
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "0"))
+MAX_ATTEMPTS = 3
+IDLE_POLL_SECONDS = 5.0
+# A running job whose lease is not renewed for this long is requeued
+LEASE_SECONDS = float(os.getenv("GENERATION_LEASE_SECONDS", "60"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+# Millisecond-precision UTC timestamp, comparable with julianday()
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+_worker_tasks: List[asyncio.Task] = []
+# Renders block a thread for minutes; they get their own pool so the default
+# executor stays free for analysis, streaming reads and claims
+_render_executor: Optional[ThreadPoolExecutor] = None
+_wakeup: Optional[asyncio.Event] = None
+_cancel_requested = set()
+_cancel_lock = threading.Lock()
+
+
+# ============================================================================
+# ETA ESTIMATION
+# ============================================================================
+
+class GenerationTimeEstimator:
+    """
+    Diffusion time grows with infer_step × audio duration. Starts from a
+    conservative rate and follows observed jobs with an EWMA.
+    """
+
+    OVERHEAD_SECONDS = 8.0
+    DEFAULT_RATE = 0.012  # seconds per (step × audio second)
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.rate = self.DEFAULT_RATE
+        self._lock = threading.Lock()
+
+    def estimate(self, infer_step: int, duration: float) -> float:
+        return round(self.OVERHEAD_SECONDS + self.rate * infer_step * duration, 1)
+
+    def observe(self, infer_step: int, duration: float, elapsed: float):
+        work = infer_step * duration
+        if work <= 0 or elapsed <= 0:
+            return
+        observed = max(0.0, elapsed - self.OVERHEAD_SECONDS) / work
+        with self._lock:
+            self.rate = (1 - self.alpha) * self.rate + self.alpha * observed
+
+
+_estimator = GenerationTimeEstimator()
+
+
+def estimate_generation_seconds(infer_step: int, duration: float) -> float:
+    """Estimated wall-clock time of one generation"""
+    return _estimator.estimate(infer_step, duration)
+
+
+def _calibrate_from_history(limit: int = 50):
+    """Seed the estimator from recently completed jobs"""
+    with get_connection() as conn:
+        rows = conn.execute("""
+        SELECT infer_step, duration,
+               (julianday(finished_at) - julianday(started_at)) * 86400 AS elapsed
+        FROM generation_jobs
+        WHERE status = 'completed' AND started_at IS NOT NULL AND finished_at IS NOT NULL
+          AND COALESCE(json_extract(result, '$.cached'), 0) = 0
+        ORDER BY finished_at DESC
+        LIMIT ?
+        """, (limit,)).fetchall()
+    for row in reversed(rows):
+        _estimator.observe(row["infer_step"], row["duration"], row["elapsed"])
+
+
+# ============================================================================
+# FAIR SCHEDULING
+# ============================================================================
+
+def job_cost(infer_step: int, duration: float) -> float:
+    """GPU cost of a render in step-seconds"""
+    return float(infer_step) * float(duration)
+
+
+def _plan_scheduling(plan: Optional[str]) -> tuple:
+    """(weight, max queued or running jobs) for a plan"""
+    from services.auth_service import PLAN_CONFIG
+    config = PLAN_CONFIG.get(plan, PLAN_CONFIG["starter"])
+    return float(config.get("generation_weight", 1)), config.get("max_queued_generations", -1)
+
+
+def _system_virtual_time(conn) -> float:
+    """
+    WFQ system virtual time: the earliest start tag still queued or running,
+    or with an idle queue the tag of the job that started last.
+    """
+    earliest = conn.execute("""
+    SELECT MIN(virtual_start) FROM generation_jobs WHERE status IN ('queued', 'running')
+    """).fetchone()[0]
+    if earliest is not None:
+        return earliest
+    row = conn.execute("""
+    SELECT virtual_start FROM generation_jobs
+    WHERE started_at IS NOT NULL AND virtual_start IS NOT NULL
+    ORDER BY started_at DESC LIMIT 1
+    """).fetchone()
+    return row[0] if row else 0.0
+
+
+# ============================================================================
+# ENQUEUE / INSPECT / CANCEL
+# ============================================================================
+
+def _admit(conn, user_id: str) -> tuple:
+    """
+    Check the user's in-flight limit and return (weight, last virtual finish,
+    error dict or None). A batch occupies a single slot. The last virtual
+    finish already accounts for the system virtual time.
+
+    Takes the database write lock first, so the check, the virtual tag and
+    the caller's INSERT happen as one step: concurrent enqueues (from any
+    worker process) can neither both slip under the limit nor share a tag.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    plan_row = conn.execute("SELECT plan FROM users WHERE id = ?", (user_id,)).fetchone()
+    weight, max_active = _plan_scheduling(plan_row["plan"] if plan_row else None)
+
+    active, last_finish = conn.execute("""
+    SELECT COUNT(DISTINCT COALESCE(batch_id, id)), MAX(virtual_finish) FROM generation_jobs
+    WHERE user_id = ? AND status IN ('queued', 'running')
+    """, (user_id,)).fetchone()
+    if max_active >= 0 and active >= max_active:
+        return weight, last_finish, {
+            "error": f"You already have {active} generations in progress (plan limit {max_active})",
+            "quota": "generation_queue",
+            "limit": max_active
+        }
+    return weight, max(_system_virtual_time(conn), last_finish or 0.0), None
+
+
+def _insert_job(conn, user_id: str, prompt: str, lyrics: str, duration: float,
+                antigravity: int, seed: int, weight: float, virtual_start: float,
+                genre: Optional[str] = None, bpm: Optional[int] = None,
+                key: Optional[str] = None, title: Optional[str] = None,
+                batch_id: Optional[str] = None) -> tuple:
+    """Insert one queued job; returns (job_id, virtual_finish)"""
+    from services.acestep_service import calculate_antigravity_params
+
+    params = calculate_antigravity_params(antigravity)
+    job_id = f"dgb_{secrets.token_hex(8)}"
+    estimated = estimate_generation_seconds(params["infer_step"], duration)
+    cost = job_cost(params["infer_step"], duration)
+    virtual_finish = virtual_start + cost / weight
+
+    conn.execute(f"""
+    INSERT INTO generation_jobs (id, user_id, batch_id, prompt, lyrics, genre, bpm, key, title,
+                                 duration, antigravity, seed, infer_step,
+                                 estimated_seconds, cost, weight, virtual_start,
+                                 virtual_finish, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {NOW_SQL})
+    """, (
+        job_id, user_id, batch_id, prompt, lyrics or "", genre, bpm, key, title,
+        float(duration), int(antigravity), int(seed), params["infer_step"], estimated,
+        cost, weight, virtual_start, virtual_finish
+    ))
+    return job_id, virtual_finish
+
+
+def enqueue_generation(
+    user_id: str,
+    prompt: str,
+    lyrics: str = "",
+    duration: float = 60.0,
+    antigravity: int = 50,
+    seed: int = -1,
+    genre: Optional[str] = None,
+    bpm: Optional[int] = None,
+    key: Optional[str] = None,
+    title: Optional[str] = None
+) -> Dict:
+    """
+    Persist a generation job and wake a worker. Returns the job view, or an
+    error dict when the user already has their plan's maximum in flight.
+    """
+    with get_connection() as conn:
+        weight, last_finish, error = _admit(conn, user_id)
+        if error:
+            return error
+
+        job_id, _ = _insert_job(
+            conn, user_id, prompt, lyrics, duration, antigravity, seed, weight,
+            last_finish, genre=genre, bpm=bpm, key=key, title=title
+        )
+
+    notify_workers()
+    return get_job(job_id)
+
+
+def _queue_position(conn, job: dict) -> tuple:
+    """(position, eta_seconds) for a queued job (later fair-share arrivals may overtake)"""
+    ahead = conn.execute("""
+    SELECT COUNT(*), COALESCE(SUM(estimated_seconds), 0)
+    FROM generation_jobs
+    WHERE status = 'queued' AND (virtual_finish, created_at, rowid) < (?, ?, ?)
+    """, (job["virtual_finish"], job["created_at"], job["rowid"])).fetchone()
+    running = conn.execute("""
+    SELECT COALESCE(SUM(MAX(0, estimated_seconds
+                  - (julianday('now') - julianday(started_at)) * 86400)), 0)
+    FROM generation_jobs WHERE status = 'running'
+    """).fetchone()[0]
+    workers = _worker_count()
+    eta = (ahead[1] + running) / workers + job["estimated_seconds"]
+    return ahead[0] + 1, round(eta, 1)
+
+
+def _job_view(job: dict, position: Optional[int] = None, eta: Optional[float] = None) -> Dict:
+    from services.acestep_service import calculate_antigravity_params
+
+    result = json.loads(job["result"]) if job.get("result") else {}
+    view = {
+        "success": job["status"] not in ("failed", "cancelled"),
+        "job_id": job["id"],
+        "status": job["status"],
+        "prompt_used": job["prompt"],
+        "duration": job["duration"],
+        "seed": result.get("seed", job["seed"]),
+        "antigravity_params": calculate_antigravity_params(job["antigravity"]),
+        "estimated_seconds": job["estimated_seconds"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "status_url": f"/api/generate/status/{job['id']}"
+    }
+    if position is not None:
+        view["position"] = position
+    if eta is not None:
+        view["eta_seconds"] = eta
+    if job["status"] == "completed":
+        view["audio_path"] = job["audio_path"]
+        view["audio_url"] = f"/api/audio/{job['id']}.wav"
+        view["preview_url"] = f"/api/audio/{job['id']}/preview"
+        view["peaks_url"] = f"/api/audio/{job['id']}/peaks"
+        view["composition_id"] = job["composition_id"]
+    if job.get("batch_id"):
+        view["batch_id"] = job["batch_id"]
+    if job.get("error"):
+        view["error"] = job["error"]
+    return view
+
+
+def get_job(job_id: str, user_id: Optional[str] = None) -> Optional[Dict]:
+    """Job status with queue position and ETA"""
+    with get_connection() as conn:
+        query = "SELECT rowid, * FROM generation_jobs WHERE id = ?"
+        params = [job_id]
+        if user_id:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        job = dict_from_row(conn.execute(query, params).fetchone())
+        if not job:
+            return None
+
+        if job["status"] == "queued":
+            position, eta = _queue_position(conn, job)
+            return _job_view(job, position, eta)
+        if job["status"] == "running":
+            elapsed = conn.execute(
+                "SELECT (julianday('now') - julianday(?)) * 86400", (job["started_at"],)
+            ).fetchone()[0]
+            return _job_view(job, 0, round(max(0.0, job["estimated_seconds"] - elapsed), 1))
+        return _job_view(job)
+
+
+def queued_count() -> int:
+    """Number of jobs waiting for a worker"""
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM generation_jobs WHERE status = 'queued'"
+        ).fetchone()[0]
+
+
+def get_queue_metrics() -> Dict:
+    """Backlog, fair-share and throughput figures for operators"""
+    with get_connection() as conn:
+        by_status = dict(conn.execute("""
+        SELECT status, COUNT(*) FROM generation_jobs
+        WHERE status IN ('queued', 'running') GROUP BY status
+        """).fetchall())
+        by_plan = [dict(row) for row in conn.execute("""
+        SELECT u.plan AS plan, COUNT(*) AS jobs, COUNT(DISTINCT j.user_id) AS users,
+               COALESCE(SUM(j.cost), 0) AS cost,
+               COALESCE(SUM(j.estimated_seconds), 0) AS estimated_seconds
+        FROM generation_jobs j JOIN users u ON u.id = j.user_id
+        WHERE j.status = 'queued'
+        GROUP BY u.plan
+        """).fetchall()]
+        top_users = [dict(row) for row in conn.execute("""
+        SELECT user_id, COUNT(*) AS jobs, COALESCE(SUM(cost), 0) AS cost,
+               MIN(virtual_finish) AS next_virtual_finish
+        FROM generation_jobs WHERE status IN ('queued', 'running')
+        GROUP BY user_id ORDER BY cost DESC LIMIT 10
+        """).fetchall()]
+        oldest_wait = conn.execute("""
+        SELECT COALESCE(MAX((julianday('now') - julianday(created_at)) * 86400), 0)
+        FROM generation_jobs WHERE status = 'queued'
+        """).fetchone()[0]
+        last_hour = dict(conn.execute("""
+        SELECT COUNT(*) AS completed,
+               COALESCE(SUM(cost), 0) AS cost,
+               AVG((julianday(started_at) - julianday(created_at)) * 86400) AS avg_wait_seconds,
+               AVG((julianday(finished_at) - julianday(started_at)) * 86400) AS avg_run_seconds
+        FROM generation_jobs
+        WHERE status = 'completed' AND finished_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', '-1 hour')
+        """).fetchone())
+        virtual_time = _system_virtual_time(conn)
+
+    return {
+        "queued": by_status.get("queued", 0),
+        "running": by_status.get("running", 0),
+        "workers": _worker_count(),
+        "virtual_time": round(virtual_time, 2),
+        "oldest_wait_seconds": round(oldest_wait, 1),
+        "queued_by_plan": by_plan,
+        "top_users": top_users,
+        "last_hour": last_hour
+    }
+
+
+def list_user_jobs(user_id: str, limit: int = 20) -> List[Dict]:
+    """Most recent jobs for a user"""
+    with get_connection() as conn:
+        rows = conn.execute("""
+        SELECT rowid, * FROM generation_jobs WHERE user_id = ?
+        ORDER BY created_at DESC LIMIT ?
+        """, (user_id, limit)).fetchall()
+    return [_job_view(dict_from_row(row)) for row in rows]
+
+
+def cancel_job(job_id: str, user_id: str) -> Dict:
+    """Cancel a queued job immediately, or ask a running one to stop"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        UPDATE generation_jobs SET status = 'cancelled', finished_at = {NOW_SQL}
+        WHERE id = ? AND user_id = ? AND status = 'queued'
+        """, (job_id, user_id))
+        if cursor.rowcount:
+            return {"success": True, "job_id": job_id, "status": "cancelled"}
+
+        cursor.execute("""
+        UPDATE generation_jobs SET cancel_requested = 1
+        WHERE id = ? AND user_id = ? AND status = 'running'
+        """, (job_id, user_id))
+        if cursor.rowcount:
+            with _cancel_lock:
+                _cancel_requested.add(job_id)
+            return {"success": True, "job_id": job_id, "status": "cancelling"}
+
+    return {"error": "Job not found or already finished"}
+
+
+def _is_cancel_requested(job_id: str) -> bool:
+    """True once the job was asked to stop, by this process or any other worker"""
+    with _cancel_lock:
+        if job_id in _cancel_requested:
+            return True
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT cancel_requested FROM generation_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    if not row or not row[0]:
+        return False
+    with _cancel_lock:
+        _cancel_requested.add(job_id)
+    return True
+
+
+# ============================================================================
+# BATCHES
+# ============================================================================
+
+def enqueue_batch(
+    user_id: str,
+    prompt: str,
+    variants: List[Dict],
+    lyrics: str = "",
+    duration: float = 60.0,
+    genre: Optional[str] = None,
+    bpm: Optional[int] = None,
+    key: Optional[str] = None,
+    title: Optional[str] = None
+) -> Dict:
+    """
+    Queue several variations of one prompt as a single batch.
+
+    Each variant is {"seed": int, "antigravity": int}. Variants become
+    ordinary jobs, so idle workers render them side by side on whatever
+    backends are free; their virtual tags are chained so a large batch
+    gets the user's fair share rather than jumping everyone else.
+    """
+    from services.auth_service import PLAN_CONFIG
+
+    if not variants:
+        return {"error": "A batch needs at least one variant"}
+
+    with get_connection() as conn:
+        plan_row = conn.execute("SELECT plan FROM users WHERE id = ?", (user_id,)).fetchone()
+        config = PLAN_CONFIG.get(plan_row["plan"] if plan_row else None, PLAN_CONFIG["starter"])
+        max_variants = config.get("max_batch_variants", -1)
+        if max_variants >= 0 and len(variants) > max_variants:
+            return {
+                "error": f"Your plan allows {max_variants} variants per batch",
+                "quota": "batch_variants",
+                "limit": max_variants
+            }
+
+        weight, last_finish, error = _admit(conn, user_id)
+        if error:
+            return error
+
+        batch_id = f"batch_{secrets.token_hex(8)}"
+        conn.execute("""
+        INSERT INTO generation_batches (id, user_id, prompt, lyrics, genre, bpm, key, title,
+                                        duration, variant_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (batch_id, user_id, prompt, lyrics or "", genre, bpm, key, title,
+              float(duration), len(variants)))
+
+        virtual_start = last_finish
+        for variant in variants:
+            _, virtual_start = _insert_job(
+                conn, user_id, prompt, lyrics, duration,
+                variant.get("antigravity", 50), variant.get("seed", -1), weight,
+                virtual_start, genre=genre, bpm=bpm, key=key, title=title,
+                batch_id=batch_id
+            )
+
+    notify_workers()
+    return get_batch(batch_id)
+
+
+def _batch_status(counts: Dict[str, int]) -> str:
+    if counts.get("running") or (counts.get("queued") and len(counts) > 1):
+        return "running"
+    if counts.get("queued"):
+        return "queued"
+    if set(counts) == {"completed"}:
+        return "completed"
+    if counts.get("completed"):
+        return "partial"
+    if set(counts) == {"cancelled"}:
+        return "cancelled"
+    return "failed"
+
+
+def get_batch(batch_id: str, user_id: Optional[str] = None) -> Optional[Dict]:
+    """Manifest of a batch: one job view per variant plus overall progress"""
+    with get_connection() as conn:
+        query = "SELECT * FROM generation_batches WHERE id = ?"
+        params = [batch_id]
+        if user_id:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        batch = dict_from_row(conn.execute(query, params).fetchone())
+        if not batch:
+            return None
+        job_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM generation_jobs WHERE batch_id = ? ORDER BY rowid", (batch_id,)
+        ).fetchall()]
+
+    variants = [get_job(job_id) for job_id in job_ids]
+    variants = [v for v in variants if v]
+    counts: Dict[str, int] = {}
+    for variant in variants:
+        counts[variant["status"]] = counts.get(variant["status"], 0) + 1
+    status = _batch_status(counts)
+
+    pending = [v.get("eta_seconds") or 0 for v in variants if v["status"] in ("queued", "running")]
+    return {
+        "success": status not in ("failed", "cancelled"),
+        "batch_id": batch["id"],
+        "status": status,
+        "prompt_used": batch["prompt"],
+        "duration": batch["duration"],
+        "variant_count": batch["variant_count"],
+        "counts": counts,
+        "eta_seconds": max(pending) if pending else None,
+        "created_at": batch["created_at"],
+        "status_url": f"/api/generate/batch/{batch['id']}",
+        "variants": variants
+    }
+
+
+def cancel_batch(batch_id: str, user_id: str) -> Dict:
+    """Cancel every unfinished variant of a batch"""
+    with get_connection() as conn:
+        job_ids = [row[0] for row in conn.execute("""
+        SELECT id FROM generation_jobs
+        WHERE batch_id = ? AND user_id = ? AND status IN ('queued', 'running')
+        """, (batch_id, user_id)).fetchall()]
+    if not job_ids:
+        return {"error": "Batch not found or already finished"}
+
+    results = [cancel_job(job_id, user_id) for job_id in job_ids]
+    return {
+        "success": True,
+        "batch_id": batch_id,
+        "cancelled": sum(1 for r in results if r.get("status") == "cancelled"),
+        "cancelling": sum(1 for r in results if r.get("status") == "cancelling")
+    }
+
+
+# ============================================================================
+# WORKER
+# ============================================================================
+
+def _lease_expiry_sql() -> str:
+    return f"strftime('%Y-%m-%d %H:%M:%f', 'now', '+{LEASE_SECONDS} seconds')"
+
+
+def claim_next_job() -> Optional[Dict]:
+    """
+    Atomically move the queued job with the earliest virtual finish to
+    'running', leased to this process
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        row = cursor.execute("""
+        SELECT id FROM generation_jobs WHERE status = 'queued'
+        ORDER BY virtual_finish, created_at, rowid LIMIT 1
+        """).fetchone()
+        if not row:
+            return None
+        cursor.execute(f"""
+        UPDATE generation_jobs
+        SET status = 'running', started_at = {NOW_SQL}, attempts = attempts + 1,
+            worker_id = ?, lease_expires_at = {_lease_expiry_sql()}
+        WHERE id = ? AND status = 'queued'
+        """, (WORKER_ID, row["id"]))
+        if cursor.rowcount == 0:
+            return None
+        job = dict_from_row(cursor.execute(
+            "SELECT rowid, * FROM generation_jobs WHERE id = ?", (row["id"],)
+        ).fetchone())
+    return job
+
+
+def _renew_lease(job_id: str) -> bool:
+    """Extend this process's lease on a running job; False if it was lost"""
+    with get_connection() as conn:
+        cursor = conn.execute(f"""
+        UPDATE generation_jobs SET lease_expires_at = {_lease_expiry_sql()}
+        WHERE id = ? AND worker_id = ? AND status = 'running'
+        """, (job_id, WORKER_ID))
+        return cursor.rowcount > 0
+
+
+class _LeaseHeartbeat:
+    """Renews a job's lease from a background thread while it renders"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(LEASE_SECONDS / 3):
+            try:
+                if not _renew_lease(self.job_id):
+                    return
+            except Exception as e:
+                print(f"Lease renewal failed for {self.job_id}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _finish_job(job_id: str, status: str, **fields):
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    if assignments:
+        assignments += ", "
+    with get_connection() as conn:
+        conn.execute(f"""
+        UPDATE generation_jobs SET {assignments}status = ?, finished_at = {NOW_SQL}
+        WHERE id = ?
+        """, (*fields.values(), status, job_id))
+
+
+def _record_completion(job: Dict, result: Dict):
+    """Save the composition, charge storage and mark the job completed"""
+    from services.quota_service import charge_storage
+    from database import create_composition
+
+    comp_id = f"comp_{secrets.token_hex(8)}"
+    create_composition(
+        comp_id=comp_id,
+        user_id=job["user_id"],
+        title=job["title"],
+        genre=job["genre"],
+        bpm=job["bpm"],
+        key=job["key"],
+        prompt=job["prompt"],
+        lyrics=job["lyrics"],
+        midi_path=None,
+        audio_path=result.get("audio_path"),
+        duration_seconds=job["duration"],
+        status="completed"
+    )
+    audio_path = result.get("audio_path")
+    if audio_path and os.path.exists(audio_path):
+        charge_storage(job["user_id"], os.path.getsize(audio_path))
+
+    _finish_job(
+        job["id"], "completed",
+        audio_path=audio_path,
+        composition_id=comp_id,
+        result=json.dumps({"seed": result.get("seed"), "cached": bool(result.get("cached"))})
+    )
+
+
+def complete_with_render(
+    user_id: str,
+    render_path: str,
+    prompt: str,
+    duration: float,
+    antigravity: int,
+    seed: int,
+    lyrics: str = "",
+    genre: Optional[str] = None,
+    bpm: Optional[int] = None,
+    key: Optional[str] = None,
+    title: Optional[str] = None
+) -> Dict:
+    """Record an already rendered file (e.g. a warm preset) as a completed job"""
+    from services.acestep_service import OUTPUT_DIR, calculate_antigravity_params
+
+    params = calculate_antigravity_params(antigravity)
+    job_id = f"dgb_{secrets.token_hex(8)}"
+    output_path = OUTPUT_DIR / f"{job_id}.wav"
+    os.replace(render_path, output_path)
+
+    with get_connection() as conn:
+        conn.execute(f"""
+        INSERT INTO generation_jobs (id, user_id, status, prompt, lyrics, genre, bpm, key, title,
+                                     duration, antigravity, seed, infer_step, estimated_seconds,
+                                     attempts, created_at, started_at)
+        VALUES (?, ?, 'running', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 1, {NOW_SQL}, {NOW_SQL})
+        """, (
+            job_id, user_id, prompt, lyrics or "", genre, bpm, key, title,
+            float(duration), int(antigravity), int(seed), params["infer_step"]
+        ))
+        job = dict_from_row(conn.execute(
+            "SELECT rowid, * FROM generation_jobs WHERE id = ?", (job_id,)
+        ).fetchone())
+
+    _record_completion(job, {"audio_path": str(output_path), "seed": seed, "cached": True})
+    return get_job(job_id)
+
+
+def _seconds_between(start: Optional[str], end: Optional[str]) -> float:
+    try:
+        return (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def run_job(job: Dict) -> Dict:
+    """Run one claimed job to completion (blocking); never leaves it running"""
+    job_id = job["id"]
+    try:
+        return _run_job(job)
+    except Exception as e:
+        print(f"Generation job {job_id} crashed: {e}")
+        with _cancel_lock:
+            _cancel_requested.discard(job_id)
+        with get_connection() as conn:
+            conn.execute(f"""
+            UPDATE generation_jobs SET status = 'failed', error = ?, finished_at = {NOW_SQL}
+            WHERE id = ? AND status = 'running'
+            """, (f"Internal error: {e}", job_id))
+        return {"error": f"Internal error: {e}"}
+
+
+def _run_job(job: Dict) -> Dict:
+    from services.acestep_service import generate_music
+    from services import metrics
+
+    job_id = job["id"]
+    labels = metrics.generation_labels(job["antigravity"], job["duration"])
+    metrics.observe_span("queue_wait", _seconds_between(job["created_at"], job["started_at"]), labels)
+    with _LeaseHeartbeat(job_id):
+        result = generate_music(
+            prompt=job["prompt"],
+            lyrics=job["lyrics"] or "",
+            duration=job["duration"],
+            antigravity=job["antigravity"],
+            seed=job["seed"],
+            job_id=job_id,
+            should_cancel=lambda: _is_cancel_requested(job_id)
+        )
+
+    with _cancel_lock:
+        _cancel_requested.discard(job_id)
+
+    # Live streams switch to the final file once the job is finished
+    from services.acestep_service import OUTPUT_DIR
+    from services.audio_delivery import segments_dir
+    shutil.rmtree(segments_dir(OUTPUT_DIR, job_id), ignore_errors=True)
+
+    if result.get("status") == "cancelled":
+        _finish_job(job_id, "cancelled")
+        return result
+
+    if not result.get("success"):
+        if result.get("retryable") and job["attempts"] < MAX_ATTEMPTS:
+            # Backend trouble: back in line (same position) for another backend
+            with get_connection() as conn:
+                conn.execute("""
+                UPDATE generation_jobs
+                SET status = 'queued', started_at = NULL, error = ?,
+                    worker_id = NULL, lease_expires_at = NULL
+                WHERE id = ?
+                """, (result.get("error"), job_id))
+            return result
+        _finish_job(job_id, "failed", error=result.get("error", "Generation failed"))
+        return result
+
+    with metrics.span("db_insert", labels):
+        _record_completion(job, result)
+    # Encodes run on the preview pool; this worker goes back to the queue
+    from services.preview_service import schedule_previews
+    schedule_previews(job_id)
+    if result.get("cached"):
+        return result
+
+    with get_connection() as conn:
+        elapsed = conn.execute("""
+        SELECT (julianday(finished_at) - julianday(started_at)) * 86400
+        FROM generation_jobs WHERE id = ?
+        """, (job_id,)).fetchone()[0]
+    _estimator.observe(job["infer_step"], job["duration"], elapsed)
+
+    return result
+
+
+def recover_jobs() -> int:
+    """
+    Requeue running jobs whose lease has expired (their process crashed or
+    was stopped). Jobs another live process is rendering keep renewing
+    their lease and are left alone. Returns how many were requeued.
+    """
+    expired = f"status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < {NOW_SQL})"
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        UPDATE generation_jobs SET status = 'cancelled', finished_at = {NOW_SQL}
+        WHERE {expired} AND cancel_requested = 1
+        """)
+        cursor.execute(f"""
+        UPDATE generation_jobs
+        SET status = 'failed', error = 'Interrupted too many times', finished_at = {NOW_SQL}
+        WHERE {expired} AND attempts >= ?
+        """, (MAX_ATTEMPTS,))
+        cursor.execute(f"""
+        UPDATE generation_jobs
+        SET status = 'queued', started_at = NULL, worker_id = NULL, lease_expires_at = NULL
+        WHERE {expired}
+        """)
+        return cursor.rowcount
+
+
+async def _recovery_loop():
+    """Requeue jobs orphaned by other processes as their leases expire"""
+    while True:
+        await asyncio.sleep(LEASE_SECONDS)
+        try:
+            requeued = await asyncio.to_thread(recover_jobs)
+            if requeued:
+                print(f"♻️ Requeued {requeued} generation job(s) with expired leases")
+                notify_workers()
+        except Exception as e:
+            print(f"Generation recovery error: {e}")
+
+
+def notify_workers():
+    """Wake idle workers after new work was queued"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def _worker_count() -> int:
+    from services.acestep_pool import get_pool
+    return max(1, GENERATION_WORKERS or get_pool().total_capacity())
+
+
+async def _worker_loop():
+    from services.acestep_pool import get_pool
+    pool = get_pool()
+    while True:
+        _wakeup.clear()
+        try:
+            # Only claim when a backend slot is free, so jobs stay queued
+            # (and cancellable) while every backend is busy or ejected
+            if not pool.has_capacity():
+                await asyncio.sleep(1.0)
+                continue
+            job = await asyncio.to_thread(claim_next_job)
+            if job is not None:
+                await asyncio.get_running_loop().run_in_executor(_render_executor, run_job, job)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Generation worker error: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_workers():
+    """Recover interrupted jobs and start workers (app startup hook)"""
+    global _wakeup, _render_executor
+    if _worker_tasks:
+        return
+    requeued = recover_jobs()
+    if requeued:
+        print(f"♻️ Requeued {requeued} interrupted generation job(s)")
+    _calibrate_from_history()
+    _wakeup = asyncio.Event()
+    workers = _worker_count()
+    _render_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+    loop = asyncio.get_running_loop()
+    for _ in range(workers):
+        _worker_tasks.append(loop.create_task(_worker_loop()))
+    _worker_tasks.append(loop.create_task(_recovery_loop()))
+
+
+async def stop_workers():
+    """Stop workers; their running jobs are requeued once the leases expire"""
+    global _render_executor
+    for task in _worker_tasks:
+        task.cancel()
+    for task in _worker_tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _worker_tasks.clear()
+    if _render_executor is not None:
+        # In-flight renders finish in the background; nothing new is started
+        _render_executor.shutdown(wait=False)
+        _render_executor = None
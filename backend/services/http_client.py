@@ -0,0 +1,120 @@
+"""
+DGB AUDIO - Shared HTTP Clients
+================================
+One long-lived httpx.AsyncClient per upstream, so calls reuse pooled
+keep-alive connections (HTTP/2 when the h2 package is installed) instead
+of paying TCP + TLS setup on every request.
+
+Credentials are never stored on the shared client: each request passes
+its user's API key through auth_headers().
+
+    async with openai_client() as client:
+        response = await client.post("/chat/completions",
+                                     headers=auth_headers(api_key), json=...)
+
+The OpenAI SDK path (get_async_openai) keeps one AsyncOpenAI per API key
+on top of the same connection pool, so concurrent chats never block the
+event loop or open their own connections.
+
+Clients are created on first use and closed by close_clients() on app
+shutdown.
+"""
+
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+DEFAULT_TIMEOUT = 60.0
+OPENAI_CLIENT_CACHE_SIZE = int(os.getenv("OPENAI_CLIENT_CACHE_SIZE", "256"))
+
+# name -> (client, event loop it belongs to)
+_clients: Dict[str, tuple] = {}
+
+
+def _build_client(base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    )
+
+
+def get_client(name: str = "openai", base_url: Optional[str] = None) -> httpx.AsyncClient:
+    """
+    Shared client for an upstream. A client is tied to the event loop it
+    was first used on, so a new loop gets a fresh one.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(name)
+    if entry is None or entry[1] is not loop or entry[0].is_closed:
+        entry = _clients[name] = (_build_client(base_url or OPENAI_BASE_URL), loop)
+    return entry[0]
+
+
+@asynccontextmanager
+async def openai_client():
+    """async with openai_client() as client: ... (the client stays open)"""
+    yield get_client("openai", OPENAI_BASE_URL)
+
+
+def auth_headers(api_key: str) -> Dict[str, str]:
+    """Per-request credentials for the shared client"""
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+# sha256(api key) -> (AsyncOpenAI, pooled httpx client it uses)
+_openai_clients: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def get_async_openai(api_key: str):
+    """
+    AsyncOpenAI client for a user's key, cached (LRU) and sharing the
+    pooled connections. Raises ImportError if the openai package is missing.
+    """
+    from openai import AsyncOpenAI
+
+    pooled = get_client("openai", OPENAI_BASE_URL)
+    cache_key = hashlib.sha256(api_key.encode()).hexdigest()
+    entry = _openai_clients.get(cache_key)
+    if entry is None or entry[1] is not pooled:
+        entry = (AsyncOpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, http_client=pooled), pooled)
+        _openai_clients[cache_key] = entry
+        while len(_openai_clients) > OPENAI_CLIENT_CACHE_SIZE:
+            # Dropping an SDK client leaves the shared pool open
+            _openai_clients.popitem(last=False)
+    else:
+        _openai_clients.move_to_end(cache_key)
+    return entry[0]
+
+
+async def close_clients():
+    """Close every shared client (app shutdown hook)"""
+    _openai_clients.clear()
+    clients = list(_clients.values())
+    _clients.clear()
+    for client, _ in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"HTTP client close error: {e}")
@@ -0,0 +1,268 @@
+"""
+DGB AUDIO - Metrics
+====================
+In-process counters and histograms, exposed in the Prometheus text format
+on /metrics.
+
+Generation spans (dgb_generation_span_seconds, label "span"):
+    queue_wait   job created → claimed by a worker
+    acquire      waiting for a free ACE-Step backend slot
+    connect      creating/reusing the backend's Gradio client
+    predict      submit → result on the GPU
+    transfer     moving/downloading the render into OUTPUT_DIR
+    db_insert    recording the composition and finishing the job
+
+Every generation metric is labelled with the antigravity mode and a
+duration bucket, so GPU time can be sized per kind of request.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Seconds; covers cache hits (ms) up to long high-step renders
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300, 600, 1200)
+DURATION_BUCKETS = (30, 60, 120, 240)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ============================================================================
+# METRIC TYPES
+# ============================================================================
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str,
+                 callback: Callable[[], Dict[Tuple[str, ...], float]],
+                 labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.callback = callback
+
+    def collect(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Metrics gauge {self.name} failed: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+# ============================================================================
+# REGISTRY
+# ============================================================================
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+    return registry.register(Counter(name, help_text, labels))
+
+
+def histogram(name: str, help_text: str, labels: Tuple[str, ...] = (),
+              buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help_text, labels, buckets))
+
+
+def gauge(name: str, help_text: str, callback: Callable[[], Dict[Tuple[str, ...], float]],
+          labels: Tuple[str, ...] = ()) -> Gauge:
+    return registry.register(Gauge(name, help_text, callback, labels))
+
+
+# ============================================================================
+# GENERATION METRICS
+# ============================================================================
+
+GENERATION_LABELS = ("mode", "duration_bucket")
+
+generation_spans = histogram(
+    "dgb_generation_span_seconds",
+    "Time spent in each stage of a generation",
+    ("span",) + GENERATION_LABELS
+)
+generation_seconds = histogram(
+    "dgb_generation_seconds",
+    "End-to-end generate_music time",
+    GENERATION_LABELS + ("outcome",)
+)
+generations_total = counter(
+    "dgb_generations_total",
+    "Generations by outcome (rendered, cached, coalesced, cancelled, error)",
+    GENERATION_LABELS + ("outcome",)
+)
+generated_audio_seconds = counter(
+    "dgb_generated_audio_seconds_total",
+    "Seconds of audio rendered on ACE-Step (cache hits excluded)",
+    GENERATION_LABELS
+)
+
+
+def duration_bucket(duration: float) -> str:
+    """Coarse label for a requested duration, e.g. "le_60" or "gt_240" """
+    for bound in DURATION_BUCKETS:
+        if duration <= bound:
+            return f"le_{bound}"
+    return f"gt_{DURATION_BUCKETS[-1]}"
+
+
+def generation_labels(antigravity: int, duration: float) -> Dict[str, str]:
+    from services.acestep_service import get_antigravity_mode_name
+    return {
+        "mode": get_antigravity_mode_name(antigravity).lower(),
+        "duration_bucket": duration_bucket(duration)
+    }
+
+
+def _queue_depth() -> Dict[Tuple[str, ...], float]:
+    from database import get_connection
+    with get_connection() as conn:
+        counts = dict(conn.execute("""
+        SELECT status, COUNT(*) FROM generation_jobs
+        WHERE status IN ('queued', 'running') GROUP BY status
+        """).fetchall())
+    return {(status,): counts.get(status, 0) for status in ("queued", "running")}
+
+
+def _backend_values(field: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    def collect():
+        from services.acestep_pool import get_pool
+        return {
+            (b["url"],): float(b["state"] == "closed") if field == "up" else b[field]
+            for b in get_pool().status()["backends"]
+        }
+    return collect
+
+
+gauge("dgb_generation_queue_jobs", "Generation jobs waiting or rendering",
+      _queue_depth, ("status",))
+gauge("dgb_acestep_backend_up", "1 while the backend's circuit is closed",
+      _backend_values("up"), ("backend",))
+gauge("dgb_acestep_backend_outstanding", "Renders in flight per backend",
+      _backend_values("outstanding"), ("backend",))
+gauge("dgb_acestep_backend_capacity", "Concurrent renders a backend accepts",
+      _backend_values("max_concurrency"), ("backend",))
+
+
+@contextmanager
+def span(name: str, labels: Optional[Dict[str, str]] = None):
+    """with span("predict", labels): ... records the block's wall time"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        generation_spans.observe(time.monotonic() - started, span=name, **(labels or {}))
+
+
+def observe_span(name: str, seconds: float, labels: Optional[Dict[str, str]] = None):
+    generation_spans.observe(max(0.0, seconds), span=name, **(labels or {}))
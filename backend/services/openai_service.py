@@ -4,6 +4,7 @@ DGB AUDIO - OpenAI Service
 Integration with OpenAI APIs for audio analysis and processing.
 """
 
+import json
 import os
 from typing import Optional, List, Dict
 
@@ -52,17 +53,7 @@ def transcribe_audio(api_key: str, audio_path: str) -> Dict:
         raise Exception(f"Transcription failed: {str(e)}")
 
 
-def analyze_music_description(api_key: str, description: str) -> Dict:
-    """
-    Analyze a music description and extract parameters using GPT.
-    Example: "bachata romántica con solo de requinto en Mi mayor a 120 BPM"
-    Returns structured data: genre, key, bpm, instruments, mood
-    """
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        
-        system_prompt = """You are a music analysis assistant for DGB AUDIO, specializing in Latin music.
+DESCRIPTION_SYSTEM_PROMPT = """You are a music analysis assistant for DGB AUDIO, specializing in Latin music.
         Analyze the user's music description and extract:
         - genre: bachata, salsa, merengue, bolero, or generic
         - key: musical key (e.g., "E major", "C minor")
@@ -72,17 +63,60 @@ def analyze_music_description(api_key: str, description: str) -> Dict:
         - special_instructions: any specific requests
         
         Return as JSON only, no additional text."""
+
+ARRANGEMENT_SYSTEM_PROMPT = """You are a professional Latin music arranger for DGB AUDIO.
+        Based on the given parameters, create a detailed bar-by-bar arrangement description
+        that can be used to generate MIDI tracks.
         
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": description}
-            ],
-            response_format={"type": "json_object"}
-        )
+        Include:
+        - Structure (intro, verse, chorus, etc.)
+        - Instrument entries and exits
+        - Dynamic changes
+        - Key moments and transitions
+        
+        Be specific about timing (bar numbers) and techniques (picado, mordentes, etc.)."""
+
+
+def _description_request(description: str) -> Dict:
+    return {
+        "model": "gpt-4",
+        "messages": [
+            {"role": "system", "content": DESCRIPTION_SYSTEM_PROMPT},
+            {"role": "user", "content": description}
+        ],
+        "response_format": {"type": "json_object"}
+    }
+
+
+def _arrangement_request(params: Dict) -> Dict:
+    user_prompt = f"""Create an arrangement for:
+        Genre: {params.get('genre', 'bachata')}
+        Key: {params.get('key', 'E major')}
+        BPM: {params.get('bpm', 120)}
+        Length: {params.get('bars', 16)} bars
+        Mood: {params.get('mood', 'romantic')}
+        Special: {params.get('special_instructions', 'none')}"""
+    return {
+        "model": "gpt-4",
+        "messages": [
+            {"role": "system", "content": ARRANGEMENT_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+    }
+
+
+def analyze_music_description(api_key: str, description: str) -> Dict:
+    """
+    Analyze a music description and extract parameters using GPT.
+    Example: "bachata romántica con solo de requinto en Mi mayor a 120 BPM"
+    Returns structured data: genre, key, bpm, instruments, mood
+    """
+    try:
+        from openai import OpenAI
+        client = OpenAI(api_key=api_key)
+        
+        response = client.chat.completions.create(**_description_request(description))
         
-        import json
         return json.loads(response.choices[0].message.content)
     except Exception as e:
         raise Exception(f"Analysis failed: {str(e)}")
@@ -97,33 +131,79 @@ def generate_arrangement_prompt(api_key: str, params: Dict) -> str:
         from openai import OpenAI
         client = OpenAI(api_key=api_key)
         
-        system_prompt = """You are a professional Latin music arranger for DGB AUDIO.
-        Based on the given parameters, create a detailed bar-by-bar arrangement description
-        that can be used to generate MIDI tracks.
+        response = client.chat.completions.create(**_arrangement_request(params))
         
-        Include:
-        - Structure (intro, verse, chorus, etc.)
-        - Instrument entries and exits
-        - Dynamic changes
-        - Key moments and transitions
+        return response.choices[0].message.content
+    except Exception as e:
+        raise Exception(f"Arrangement generation failed: {str(e)}")
+
+
+# ============================================================================
+# ASYNC VARIANTS
+# ============================================================================
+# Same calls through a cached AsyncOpenAI client (services.http_client), for
+# use from async endpoints without blocking the event loop.
+
+async def test_connection_async(api_key: str) -> List[str]:
+    """Async test_connection"""
+    try:
+        from services.http_client import get_async_openai
+        client = get_async_openai(api_key)
         
-        Be specific about timing (bar numbers) and techniques (picado, mordentes, etc.)."""
+        models = await client.models.list()
+        audio_models = [m.id for m in models.data if 'whisper' in m.id.lower() or 'audio' in m.id.lower()]
         
-        user_prompt = f"""Create an arrangement for:
-        Genre: {params.get('genre', 'bachata')}
-        Key: {params.get('key', 'E major')}
-        BPM: {params.get('bpm', 120)}
-        Length: {params.get('bars', 16)} bars
-        Mood: {params.get('mood', 'romantic')}
-        Special: {params.get('special_instructions', 'none')}"""
+        return audio_models if audio_models else ["gpt-4", "gpt-3.5-turbo"]
+    except ImportError:
+        raise Exception("OpenAI library not installed. Run: pip install openai")
+    except Exception as e:
+        raise Exception(f"Failed to connect to OpenAI: {str(e)}")
+
+
+async def transcribe_audio_async(api_key: str, audio_path: str) -> Dict:
+    """Async transcribe_audio"""
+    try:
+        from services.http_client import get_async_openai
+        client = get_async_openai(api_key)
+        
+        with open(audio_path, "rb") as audio_file:
+            transcript = await client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                response_format="verbose_json",
+                timestamp_granularities=["segment", "word"]
+            )
         
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        )
+        return {
+            "text": transcript.text,
+            "duration": transcript.duration,
+            "segments": transcript.segments if hasattr(transcript, 'segments') else [],
+            "words": transcript.words if hasattr(transcript, 'words') else []
+        }
+    except Exception as e:
+        raise Exception(f"Transcription failed: {str(e)}")
+
+
+async def analyze_music_description_async(api_key: str, description: str) -> Dict:
+    """Async analyze_music_description"""
+    try:
+        from services.http_client import get_async_openai
+        client = get_async_openai(api_key)
+        
+        response = await client.chat.completions.create(**_description_request(description))
+        
+        return json.loads(response.choices[0].message.content)
+    except Exception as e:
+        raise Exception(f"Analysis failed: {str(e)}")
+
+
+async def generate_arrangement_prompt_async(api_key: str, params: Dict) -> str:
+    """Async generate_arrangement_prompt"""
+    try:
+        from services.http_client import get_async_openai
+        client = get_async_openai(api_key)
+        
+        response = await client.chat.completions.create(**_arrangement_request(params))
         
         return response.choices[0].message.content
     except Exception as e:
@@ -144,6 +224,12 @@ class OpenAIService:
             self._client = OpenAI(api_key=self.api_key)
         return self._client
     
+    @property
+    def async_client(self):
+        """Cached AsyncOpenAI for this key (shared connection pool)"""
+        from services.http_client import get_async_openai
+        return get_async_openai(self.api_key)
+    
     def transcribe(self, audio_path: str) -> Dict:
         """Transcribe audio file"""
         return transcribe_audio(self.api_key, audio_path)
@@ -159,3 +245,15 @@ class OpenAIService:
     def test(self) -> List[str]:
         """Test API connection"""
         return test_connection(self.api_key)
+    
+    async def transcribe_async(self, audio_path: str) -> Dict:
+        return await transcribe_audio_async(self.api_key, audio_path)
+    
+    async def analyze_description_async(self, text: str) -> Dict:
+        return await analyze_music_description_async(self.api_key, text)
+    
+    async def generate_arrangement_async(self, params: Dict) -> str:
+        return await generate_arrangement_prompt_async(self.api_key, params)
+    
+    async def test_async(self) -> List[str]:
+        return await test_connection_async(self.api_key)
@@ -0,0 +1,192 @@
+"""
+DGB AUDIO - Preset Warm Pool
+=============================
+Keeps PRESET_WARM_COUNT pre-rendered variations (different seeds) of each
+DGB preset on disk so /api/generate/preset can answer instantly when the
+user did not customise the prompt or lyrics.
+
+Refills only run while no user job is queued, and are abandoned as soon as
+one arrives, so warming never delays real generations.
+"""
+
+import asyncio
+import os
+import secrets
+import sys
+from pathlib import Path
+from typing import Optional, Dict
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from database import get_connection, dict_from_row
+
+WARM_COUNT = int(os.getenv("PRESET_WARM_COUNT", "2"))
+WARM_DURATION = 60.0
+WARM_INTERVAL_SECONDS = 30.0
+
+_warmer_task: Optional[asyncio.Task] = None
+
+
+def _warm_dir() -> Path:
+    from services.acestep_service import OUTPUT_DIR
+    path = OUTPUT_DIR / "warm"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+# ============================================================================
+# HAND-OUT
+# ============================================================================
+
+def take_warm(preset_name: str) -> Optional[Dict]:
+    """Claim the oldest warm render of a preset (None if the pool is empty)"""
+    from services.acestep_service import get_preset
+
+    preset = get_preset(preset_name)
+    with get_connection() as conn:
+        while True:
+            row = dict_from_row(conn.execute("""
+            DELETE FROM preset_warm_pool
+            WHERE id = (
+                SELECT id FROM preset_warm_pool
+                WHERE preset = ? AND prompt = ? AND antigravity = ?
+                ORDER BY id LIMIT 1
+            )
+            RETURNING *
+            """, (preset_name, preset["prompt"], preset["antigravity"])).fetchone())
+            if not row:
+                return None
+            if os.path.exists(row["audio_path"]):
+                return row
+
+
+# ============================================================================
+# REFILL
+# ============================================================================
+
+def _prune_stale():
+    """Drop renders whose preset definition has since changed"""
+    from services.acestep_service import DGB_PRESETS
+
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, preset, prompt, antigravity, audio_path FROM preset_warm_pool"
+        ).fetchall()
+        stale = [
+            row for row in rows
+            if row["preset"] not in DGB_PRESETS
+            or DGB_PRESETS[row["preset"]]["prompt"] != row["prompt"]
+            or DGB_PRESETS[row["preset"]]["antigravity"] != row["antigravity"]
+        ]
+        conn.executemany("DELETE FROM preset_warm_pool WHERE id = ?", [(row["id"],) for row in stale])
+
+    for row in stale:
+        try:
+            os.remove(row["audio_path"])
+        except OSError:
+            pass
+
+
+def get_deficits() -> Dict[str, int]:
+    """Missing warm renders per preset"""
+    from services.acestep_service import DGB_PRESETS
+
+    with get_connection() as conn:
+        counts = dict(conn.execute(
+            "SELECT preset, COUNT(*) FROM preset_warm_pool GROUP BY preset"
+        ).fetchall())
+    return {
+        name: WARM_COUNT - counts.get(name, 0)
+        for name in DGB_PRESETS
+        if counts.get(name, 0) < WARM_COUNT
+    }
+
+
+def refill_one() -> Optional[Dict]:
+    """Render one variation for the emptiest preset (blocking)"""
+    from services.acestep_service import generate_music, get_preset
+    from services.generation_queue import queued_count
+
+    deficits = get_deficits()
+    if not deficits:
+        return None
+    preset_name = max(deficits, key=deficits.get)
+    preset = get_preset(preset_name)
+
+    result = generate_music(
+        prompt=preset["prompt"],
+        duration=WARM_DURATION,
+        antigravity=preset["antigravity"],
+        job_id=f"warm_{secrets.token_hex(8)}",
+        should_cancel=lambda: queued_count() > 0
+    )
+    if not result.get("success") or not result.get("audio_path"):
+        return result
+
+    warm_path = _warm_dir() / Path(result["audio_path"]).name
+    os.replace(result["audio_path"], warm_path)
+    with get_connection() as conn:
+        conn.execute("""
+        INSERT INTO preset_warm_pool (preset, prompt, antigravity, duration, seed, audio_path)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, (preset_name, preset["prompt"], preset["antigravity"],
+              WARM_DURATION, result["seed"], str(warm_path)))
+    return result
+
+
+def _gpu_idle() -> bool:
+    from services.acestep_pool import get_pool
+    from services.generation_queue import queued_count
+    return queued_count() == 0 and get_pool().has_capacity()
+
+
+def get_warm_status() -> Dict:
+    """Warm renders available per preset"""
+    from services.acestep_service import DGB_PRESETS
+
+    with get_connection() as conn:
+        counts = dict(conn.execute(
+            "SELECT preset, COUNT(*) FROM preset_warm_pool GROUP BY preset"
+        ).fetchall())
+    return {
+        "target_per_preset": WARM_COUNT,
+        "presets": {name: counts.get(name, 0) for name in DGB_PRESETS}
+    }
+
+
+# ============================================================================
+# BACKGROUND WARMER
+# ============================================================================
+
+async def _warmer_loop():
+    await asyncio.to_thread(_prune_stale)
+    while True:
+        try:
+            while await asyncio.to_thread(_gpu_idle):
+                result = await asyncio.to_thread(refill_one)
+                if result is None or not result.get("success"):
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Preset warmer error: {e}")
+        await asyncio.sleep(WARM_INTERVAL_SECONDS)
+
+
+def start_warmer():
+    """Start refilling the warm pool in idle time (app startup hook)"""
+    global _warmer_task
+    if WARM_COUNT <= 0:
+        return
+    if _warmer_task is None or _warmer_task.done():
+        _warmer_task = asyncio.get_running_loop().create_task(_warmer_loop())
+
+
+async def stop_warmer():
+    global _warmer_task
+    if _warmer_task is not None:
+        _warmer_task.cancel()
+        try:
+            await _warmer_task
+        except asyncio.CancelledError:
+            pass
+        _warmer_task = None
@@ -0,0 +1,171 @@
+"""
+DGB AUDIO - Preview Renditions
+===============================
+Lightweight versions of generated audio for in-browser playback.
+
+Next to each OUTPUT_DIR/{job_id}.wav we cache:
+    {job_id}.preview.opus / {job_id}.preview.mp3   low-bitrate encodes (pydub + ffmpeg)
+    {job_id}.peaks.json                            whole-track overview from the
+                                                   waveform pyramid (waveform_service)
+
+Renditions are built on a small dedicated thread pool once a generation
+completes (so generation workers go straight back to the GPU queue), or
+lazily on first request. Builds are serialized per job only; different
+jobs encode in parallel.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict
+
+# Try to import audio processing libraries
+try:
+    from pydub import AudioSegment
+    PYDUB_AVAILABLE = True
+except ImportError:
+    PYDUB_AVAILABLE = False
+
+PREVIEW_FORMATS = {
+    "opus": {"format": "opus", "codec": "libopus", "bitrate": "48k", "media_type": "audio/ogg"},
+    "mp3": {"format": "mp3", "codec": None, "bitrate": "96k", "media_type": "audio/mpeg"},
+}
+PEAK_POINTS = 2000
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+
+# A job's audio never changes once written
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# job_id -> [lock, holders]; entries are dropped once nobody holds or waits
+_job_locks: Dict[str, list] = {}
+_job_locks_guard = threading.Lock()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+@contextmanager
+def _job_lock(job_id: str):
+    """Serialize builds of one job's renditions"""
+    with _job_locks_guard:
+        entry = _job_locks.setdefault(job_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _job_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                _job_locks.pop(job_id, None)
+
+
+def _output_dir() -> Path:
+    from services.acestep_service import OUTPUT_DIR
+    return OUTPUT_DIR
+
+
+def preview_path(job_id: str, fmt: str) -> Path:
+    return _output_dir() / f"{job_id}.preview.{fmt}"
+
+
+def peaks_path(job_id: str) -> Path:
+    return _output_dir() / f"{job_id}.peaks.json"
+
+
+# ============================================================================
+# BUILD
+# ============================================================================
+
+def compute_peaks(wav_path: str, points: int = PEAK_POINTS) -> Dict:
+    """Whole-file overview from the waveform pyramid"""
+    from services.waveform_service import PeakPyramid, ensure_pyramid
+
+    pyramid = PeakPyramid(ensure_pyramid(wav_path))
+    return pyramid.slice(0.0, None, points)
+
+
+def build_previews(job_id: str, formats=("opus", "mp3")) -> Dict:
+    """Create any missing renditions for a generated file"""
+    wav_path = _output_dir() / f"{job_id}.wav"
+    if not wav_path.exists():
+        return {"error": "Audio not found"}
+
+    built = []
+    with _job_lock(job_id):
+        peaks_file = peaks_path(job_id)
+        if not peaks_file.exists():
+            tmp = peaks_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(compute_peaks(str(wav_path)), separators=(",", ":")))
+            os.replace(tmp, peaks_file)
+            built.append("peaks")
+
+        if PYDUB_AVAILABLE:
+            audio = None
+            for fmt in formats:
+                target = preview_path(job_id, fmt)
+                if target.exists():
+                    continue
+                if audio is None:
+                    audio = AudioSegment.from_wav(str(wav_path))
+                settings = PREVIEW_FORMATS[fmt]
+                tmp = target.with_name(target.name + ".tmp")
+                audio.export(
+                    str(tmp), format=settings["format"],
+                    codec=settings["codec"], bitrate=settings["bitrate"]
+                )
+                os.replace(tmp, target)
+                built.append(fmt)
+
+    return {"success": True, "job_id": job_id, "built": built}
+
+
+def _log_build(job_id: str, future):
+    error = future.exception()
+    if error is None:
+        error = future.result().get("error")
+    if error:
+        print(f"Preview rendition failed for {job_id}: {error}")
+
+
+def schedule_previews(job_id: str):
+    """Build a finished job's renditions in the background preview pool"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS,
+                                           thread_name_prefix="preview")
+    future = _executor.submit(build_previews, job_id)
+    future.add_done_callback(lambda f: _log_build(job_id, f))
+    return future
+
+
+def get_preview(job_id: str, fmt: str = "mp3") -> Optional[str]:
+    """Path to a preview rendition, building it if needed (None if unavailable)"""
+    if fmt not in PREVIEW_FORMATS:
+        return None
+    target = preview_path(job_id, fmt)
+    if not target.exists() and PYDUB_AVAILABLE:
+        build_previews(job_id, formats=(fmt,))
+    return str(target) if target.exists() else None
+
+
+def get_peaks(job_id: str) -> Optional[str]:
+    """Path to the peaks JSON, building it if needed"""
+    target = peaks_path(job_id)
+    if not target.exists():
+        build_previews(job_id, formats=())
+    return str(target) if target.exists() else None
+
+
+# ============================================================================
+# HTTP CACHING
+# ============================================================================
+
+def etag_for(path: str) -> str:
+    """Validator from size and mtime (renditions are replaced, never edited)"""
+    stat = os.stat(path)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
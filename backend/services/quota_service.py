@@ -0,0 +1,211 @@
+"""
+DGB AUDIO - Quota Service
+==========================
+Plan-limit enforcement (storage, projects, recording length).
+
+Usage counters live on the users row (storage_used_bytes, project_count,
+recording_seconds_used) and are updated incrementally on upload, delete and
+generation, so checks only compare numbers already loaded with the user.
+"""
+
+import io
+import os
+import sys
+import wave
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from database import get_connection
+
+GB = 1024 * 1024 * 1024
+
+# ACE-Step renders 48 kHz stereo 16-bit WAV
+GENERATION_BYTES_PER_SECOND = 48000 * 2 * 2
+
+# Largest single sample upload, enforced before the body is spooled
+MAX_SAMPLE_UPLOAD_BYTES = int(float(os.getenv("SAMPLE_UPLOAD_MAX_MB", "200")) * 1024 * 1024)
+
+
+def get_limits(user: dict) -> dict:
+    """Effective plan limits for a user (stored limits, else plan defaults)"""
+    from services.auth_service import PLAN_CONFIG
+    limits = user.get("limits") or {}
+    if not limits:
+        limits = PLAN_CONFIG.get(user.get("plan"), PLAN_CONFIG["starter"])
+    return limits
+
+
+def _storage_limit_bytes(user: dict) -> int:
+    storage_gb = get_limits(user).get("storage_gb", -1)
+    return -1 if storage_gb < 0 else int(storage_gb * GB)
+
+
+# ============================================================================
+# CHECKS (O(1), no I/O)
+# ============================================================================
+
+def check_storage(user: dict, incoming_bytes: int) -> Optional[dict]:
+    """Return an error dict if incoming_bytes would exceed the storage quota"""
+    limit = _storage_limit_bytes(user)
+    used = user.get("storage_used_bytes") or 0
+    if limit >= 0 and used + incoming_bytes > limit:
+        return {
+            "error": "Storage quota exceeded",
+            "quota": "storage",
+            "limit_bytes": limit,
+            "used_bytes": used,
+            "requested_bytes": incoming_bytes
+        }
+    return None
+
+
+def check_project_slot(user: dict) -> Optional[dict]:
+    """Return an error dict if the user cannot create another project"""
+    limit = get_limits(user).get("max_projects", -1)
+    count = user.get("project_count") or 0
+    if limit >= 0 and count >= limit:
+        return {
+            "error": "Project limit reached",
+            "quota": "projects",
+            "limit": limit,
+            "used": count
+        }
+    return None
+
+
+def check_recording_length(user: dict, seconds: float) -> Optional[dict]:
+    """Return an error dict if a recording is longer than the plan allows"""
+    limit = get_limits(user).get("recording_seconds", -1)
+    if limit >= 0 and seconds > limit:
+        return {
+            "error": f"Recording exceeds the {limit}s limit of your plan",
+            "quota": "recording_seconds",
+            "limit": limit,
+            "requested": round(seconds, 2)
+        }
+    return None
+
+
+def estimate_generation_bytes(duration: float) -> int:
+    """Expected size of a generated WAV of the given duration"""
+    return int(duration * GENERATION_BYTES_PER_SECOND)
+
+
+def wav_duration_from_header(data: bytes) -> Optional[float]:
+    """Read duration from a WAV header without decoding the audio"""
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except Exception:
+        return None
+
+
+# ============================================================================
+# COUNTER UPDATES
+# ============================================================================
+
+def reserve_storage(user: dict, nbytes: int) -> bool:
+    """
+    Atomically add nbytes to the user's storage counter if it fits the quota.
+    Returns False (and changes nothing) when it does not.
+    """
+    limit = _storage_limit_bytes(user)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if limit < 0:
+            cursor.execute("""
+            UPDATE users SET storage_used_bytes = storage_used_bytes + ? WHERE id = ?
+            """, (nbytes, user["id"]))
+        else:
+            cursor.execute("""
+            UPDATE users SET storage_used_bytes = storage_used_bytes + ?
+            WHERE id = ? AND storage_used_bytes + ? <= ?
+            """, (nbytes, user["id"], nbytes, limit))
+        return cursor.rowcount > 0
+
+
+def charge_storage(user_id: str, nbytes: int):
+    """Add bytes already written on the user's behalf (e.g. generated audio)"""
+    with get_connection() as conn:
+        conn.execute("""
+        UPDATE users SET storage_used_bytes = storage_used_bytes + ? WHERE id = ?
+        """, (nbytes, user_id))
+
+
+def release_storage(user_id: str, nbytes: int):
+    """Subtract bytes freed by a delete"""
+    with get_connection() as conn:
+        conn.execute("""
+        UPDATE users SET storage_used_bytes = MAX(0, storage_used_bytes - ?) WHERE id = ?
+        """, (nbytes, user_id))
+
+
+def add_recording_seconds(user_id: str, seconds: float):
+    """Track recorded seconds"""
+    with get_connection() as conn:
+        conn.execute("""
+        UPDATE users SET recording_seconds_used = recording_seconds_used + ? WHERE id = ?
+        """, (seconds, user_id))
+
+
+def rebuild_counters(user_id: str = None) -> int:
+    """
+    Recompute counters from the underlying tables (maintenance only).
+    Returns the number of users updated.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        query = "SELECT id FROM users"
+        params = []
+        if user_id:
+            query += " WHERE id = ?"
+            params.append(user_id)
+        user_ids = [row[0] for row in cursor.execute(query, params).fetchall()]
+
+        for uid in user_ids:
+            storage = cursor.execute("""
+            SELECT
+                (SELECT COALESCE(SUM(file_size_bytes), 0) FROM samples WHERE user_id = ?) +
+                (SELECT COALESCE(SUM(file_size_bytes), 0) FROM recordings WHERE user_id = ?)
+            """, (uid, uid)).fetchone()[0]
+            for (audio_path,) in cursor.execute(
+                "SELECT audio_path FROM compositions WHERE user_id = ? AND audio_path IS NOT NULL",
+                (uid,)
+            ).fetchall():
+                if os.path.exists(audio_path):
+                    storage += os.path.getsize(audio_path)
+            projects = cursor.execute(
+                "SELECT COUNT(*) FROM projects WHERE user_id = ?", (uid,)
+            ).fetchone()[0]
+            recorded = cursor.execute(
+                "SELECT COALESCE(SUM(duration_seconds), 0) FROM recordings WHERE user_id = ?",
+                (uid,)
+            ).fetchone()[0]
+            cursor.execute("""
+            UPDATE users SET storage_used_bytes = ?, project_count = ?, recording_seconds_used = ?
+            WHERE id = ?
+            """, (storage, projects, recorded, uid))
+
+        return len(user_ids)
+
+
+# ============================================================================
+# STATUS
+# ============================================================================
+
+def get_quota_status(user: dict) -> dict:
+    """Current usage against plan limits"""
+    limits = get_limits(user)
+    limit_bytes = _storage_limit_bytes(user)
+    used = user.get("storage_used_bytes") or 0
+
+    return {
+        "plan": user.get("plan"),
+        "limits": limits,
+        "storage_used_bytes": used,
+        "storage_limit_bytes": limit_bytes,
+        "storage_percent": round(used / limit_bytes * 100, 1) if limit_bytes > 0 else 0,
+        "project_count": user.get("project_count") or 0,
+        "recording_seconds_used": user.get("recording_seconds_used") or 0
+    }
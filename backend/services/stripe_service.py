@@ -150,9 +150,10 @@ async def create_billing_portal_session(customer_id: str) -> dict:
         return {"error": str(e)}
 
 
-async def handle_webhook(payload: bytes, signature: str) -> dict:
+def verify_webhook(payload: bytes, signature: str) -> dict:
     """
-    Handle Stripe webhook events.
+    Verify a Stripe webhook signature.
+    Returns {"event": ...} on success or {"error": ...}.
     """
     if not STRIPE_WEBHOOK_SECRET:
         return {"error": "Webhook secret not configured"}
@@ -166,110 +167,146 @@ async def handle_webhook(payload: bytes, signature: str) -> dict:
     except stripe.error.SignatureVerificationError:
         return {"error": "Invalid signature"}
     
-    # Handle the event
+    return {"event": event}
+
+
+async def handle_webhook(payload: bytes, signature: str) -> dict:
+    """
+    Handle Stripe webhook events inline (verify + apply).
+    The HTTP endpoint uses services.webhook_queue instead.
+    """
+    result = verify_webhook(payload, signature)
+    if "error" in result:
+        return result
+    
+    return apply_stripe_event(result["event"])
+
+
+def _timestamp_to_iso(value) -> Optional[str]:
+    """Convert a Stripe epoch timestamp to ISO format"""
+    if not value:
+        return None
+    return datetime.fromtimestamp(value).isoformat()
+
+
+def apply_stripe_event(event, force: bool = False) -> dict:
+    """
+    Apply a verified Stripe event to the subscriptions table.
+    
+    Lookups go through the indexed stripe_customer_id / stripe_subscription_id
+    columns, and the event id is claimed in the same transaction so redelivered
+    events are no-ops. Pass force=True to re-apply an event (replay).
+    """
+    from database import get_connection, claim_stripe_event
+    from services.auth_service import PLAN_CONFIG
+    
+    event_id = event["id"]
     event_type = event["type"]
     data = event["data"]["object"]
+    now = datetime.now().isoformat()
     
-    if event_type == "checkout.session.completed":
-        # Payment successful, activate subscription
-        user_id = data.get("metadata", {}).get("user_id")
-        plan = data.get("metadata", {}).get("plan")
-        customer_id = data.get("customer")
-        subscription_id = data.get("subscription")
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        if not claim_stripe_event(cursor, event_id, event_type, force=force):
+            return {"success": True, "action": "duplicate", "event_id": event_id}
         
-        if user_id and plan:
-            # Update user's plan in database
-            from services.auth_service import _load_users, _save_users
-            users = _load_users()
+        if event_type == "checkout.session.completed":
+            # Payment successful, activate subscription
+            metadata = data.get("metadata") or {}
+            user_id = metadata.get("user_id")
+            plan = metadata.get("plan")
             
-            for email, user in users.items():
-                if user.get("id") == user_id:
-                    users[email]["plan"] = plan
-                    users[email]["stripe_customer_id"] = customer_id
-                    users[email]["stripe_subscription_id"] = subscription_id
-                    users[email]["subscription_status"] = "active"
-                    users[email]["updated_at"] = datetime.now().isoformat()
-                    
-                    # Update limits based on plan
-                    plan_limits = {
-                        "starter": {"storage_gb": 1, "recording_seconds": 30, "max_projects": 2},
-                        "creator": {"storage_gb": 10, "recording_seconds": 60, "max_projects": 20},
-                        "pro": {"storage_gb": 50, "recording_seconds": -1, "max_projects": -1},
-                        "studio": {"storage_gb": 200, "recording_seconds": -1, "max_projects": -1}
-                    }
-                    users[email]["limits"] = plan_limits.get(plan, plan_limits["starter"])
-                    break
+            if not (user_id and plan):
+                return {"success": True, "action": "ignored", "event_type": event_type}
             
-            _save_users(users)
+            cursor.execute("""
+            INSERT INTO subscriptions (user_id, stripe_customer_id, stripe_subscription_id, plan, status)
+            VALUES (?, ?, ?, ?, 'active')
+            ON CONFLICT(user_id) DO UPDATE SET
+                stripe_customer_id = excluded.stripe_customer_id,
+                stripe_subscription_id = excluded.stripe_subscription_id,
+                plan = excluded.plan,
+                status = 'active',
+                canceled_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            """, (user_id, data.get("customer"), data.get("subscription"), plan))
+            
+            _set_user_plan(cursor, user_id, plan, PLAN_CONFIG)
             return {"success": True, "action": "subscription_activated", "plan": plan}
-    
-    elif event_type == "customer.subscription.updated":
-        # Subscription updated (plan change, renewal, etc.)
-        subscription_id = data.get("id")
-        status = data.get("status")
-        
-        from services.auth_service import _load_users, _save_users
-        users = _load_users()
-        
-        for email, user in users.items():
-            if user.get("stripe_subscription_id") == subscription_id:
-                users[email]["subscription_status"] = status
-                users[email]["updated_at"] = datetime.now().isoformat()
-                break
-        
-        _save_users(users)
-        return {"success": True, "action": "subscription_updated", "status": status}
-    
-    elif event_type == "customer.subscription.deleted":
-        # Subscription cancelled
-        subscription_id = data.get("id")
         
-        from services.auth_service import _load_users, _save_users
-        users = _load_users()
+        elif event_type == "customer.subscription.updated":
+            # Subscription updated (plan change, renewal, etc.)
+            status = data.get("status")
+            cursor.execute("""
+            UPDATE subscriptions SET
+                status = ?,
+                current_period_start = COALESCE(?, current_period_start),
+                current_period_end = COALESCE(?, current_period_end),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE stripe_subscription_id = ?
+            """, (
+                status,
+                _timestamp_to_iso(data.get("current_period_start")),
+                _timestamp_to_iso(data.get("current_period_end")),
+                data.get("id")
+            ))
+            return {"success": True, "action": "subscription_updated", "status": status}
         
-        for email, user in users.items():
-            if user.get("stripe_subscription_id") == subscription_id:
-                users[email]["plan"] = "starter"
-                users[email]["subscription_status"] = "cancelled"
-                users[email]["limits"] = {"storage_gb": 1, "recording_seconds": 30, "max_projects": 2}
-                users[email]["updated_at"] = datetime.now().isoformat()
-                break
+        elif event_type == "customer.subscription.deleted":
+            # Subscription cancelled
+            cursor.execute(
+                "SELECT user_id FROM subscriptions WHERE stripe_subscription_id = ?",
+                (data.get("id"),)
+            )
+            row = cursor.fetchone()
+            if row:
+                cursor.execute("""
+                UPDATE subscriptions SET
+                    plan = 'starter',
+                    status = 'cancelled',
+                    canceled_at = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE stripe_subscription_id = ?
+                """, (now, data.get("id")))
+                _set_user_plan(cursor, row["user_id"], "starter", PLAN_CONFIG)
+            return {"success": True, "action": "subscription_cancelled"}
         
-        _save_users(users)
-        return {"success": True, "action": "subscription_cancelled"}
-    
-    elif event_type == "invoice.payment_failed":
-        # Payment failed
-        customer_id = data.get("customer")
-        
-        from services.auth_service import _load_users, _save_users
-        users = _load_users()
-        
-        for email, user in users.items():
-            if user.get("stripe_customer_id") == customer_id:
-                users[email]["subscription_status"] = "past_due"
-                users[email]["updated_at"] = datetime.now().isoformat()
-                break
-        
-        _save_users(users)
-        return {"success": True, "action": "payment_failed"}
+        elif event_type == "invoice.payment_failed":
+            # Payment failed
+            cursor.execute("""
+            UPDATE subscriptions SET status = 'past_due', updated_at = CURRENT_TIMESTAMP
+            WHERE stripe_customer_id = ?
+            """, (data.get("customer"),))
+            return {"success": True, "action": "payment_failed"}
     
     return {"success": True, "action": "ignored", "event_type": event_type}
 
 
+def _set_user_plan(cursor, user_id: str, plan: str, plan_config: dict):
+    """Update a user's plan and limits within an open transaction"""
+    limits = plan_config.get(plan, plan_config["starter"])
+    cursor.execute("""
+    UPDATE users SET plan = ?, limits = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    """, (plan, json.dumps(limits), user_id))
+
+
 def get_subscription_status(user_email: str) -> dict:
     """Get user's subscription status"""
-    from services.auth_service import _load_users
-    users = _load_users()
+    from database import get_user_by_email, get_subscription_by_user
     
-    if user_email not in users:
+    user = get_user_by_email(user_email)
+    if not user:
         return {"error": "User not found"}
     
-    user = users[user_email]
+    subscription = get_subscription_by_user(user["id"]) or {}
+    status = subscription.get("status", "free")
     
     return {
         "plan": user.get("plan", "starter"),
-        "subscription_status": user.get("subscription_status", "free"),
-        "stripe_customer_id": user.get("stripe_customer_id"),
-        "has_active_subscription": user.get("subscription_status") == "active"
+        "subscription_status": status,
+        "stripe_customer_id": subscription.get("stripe_customer_id"),
+        "current_period_end": subscription.get("current_period_end"),
+        "has_active_subscription": status == "active"
     }
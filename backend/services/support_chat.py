@@ -6,7 +6,7 @@ Uses user's own OpenAI API key (BYOK) for requests.
 """
 
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator
 import json
 
 # Department configurations with specialized knowledge
@@ -99,6 +99,50 @@ def get_departments() -> List[dict]:
     ]
 
 
+CHAT_MODEL = "gpt-4o-mini"
+
+
+def estimate_cost(tokens_used: int) -> float:
+    """Estimate cost (GPT-4o-mini pricing, ~$0.15 per 1M tokens)"""
+    return tokens_used * 0.00015 / 1000
+
+
+def _build_messages(message: str, dept_config: dict, conversation_history: List[dict] = None) -> List[dict]:
+    messages = [
+        {"role": "system", "content": dept_config["system_prompt"]}
+    ]
+    
+    # Add conversation history
+    if conversation_history:
+        messages.extend(conversation_history[-10:])  # Last 10 messages
+    
+    # Add current message
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+def _cached_answer(message: str, department: str, conversation_history: List[dict] = None) -> Optional[dict]:
+    """Cached reply for a first-turn question (see services.chat_cache)"""
+    if conversation_history:
+        return None
+    from services import chat_cache
+    dept_id = department if department in DEPARTMENTS else "general"
+    try:
+        return chat_cache.lookup(dept_id, message, DEPARTMENTS[dept_id]["system_prompt"])
+    except Exception as e:
+        print(f"Support cache lookup failed: {e}")
+        return None
+
+
+def _remember_answer(message: str, department: str, answer: str, tokens_used: int):
+    from services import chat_cache
+    dept_id = department if department in DEPARTMENTS else "general"
+    try:
+        chat_cache.store(dept_id, message, DEPARTMENTS[dept_id]["system_prompt"], answer, tokens_used)
+    except Exception as e:
+        print(f"Support cache store failed: {e}")
+
+
 async def chat_with_support(
     message: str,
     department: str,
@@ -117,35 +161,38 @@ async def chat_with_support(
     
     dept_config = DEPARTMENTS.get(department, DEPARTMENTS["general"])
     
+    cached = _cached_answer(message, department, conversation_history)
+    if cached:
+        return {
+            "success": True,
+            "department": department,
+            "department_name": dept_config["name"],
+            "message": cached["message"],
+            "tokens_used": 0,
+            "cost_estimate": 0.0,
+            "cached": True,
+            "cache_match": cached["match"],
+            "timestamp": datetime.now().isoformat()
+        }
+    
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        
-        # Build messages
-        messages = [
-            {"role": "system", "content": dept_config["system_prompt"]}
-        ]
+        from services.http_client import get_async_openai
+        client = get_async_openai(api_key)
         
-        # Add conversation history
-        if conversation_history:
-            messages.extend(conversation_history[-10:])  # Last 10 messages
-        
-        # Add current message
-        messages.append({"role": "user", "content": message})
-        
-        # Call OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
+        # Call OpenAI (async, so other requests keep being served)
+        response = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=_build_messages(message, dept_config, conversation_history),
             temperature=0.7,
             max_tokens=500
         )
         
         assistant_message = response.choices[0].message.content
         tokens_used = response.usage.total_tokens
+        cost_estimate = estimate_cost(tokens_used)
         
-        # Estimate cost (GPT-4o-mini pricing)
-        cost_estimate = tokens_used * 0.00015 / 1000  # ~$0.15 per 1M tokens
+        if not conversation_history:
+            _remember_answer(message, department, assistant_message, tokens_used)
         
         return {
             "success": True,
@@ -164,6 +211,89 @@ async def chat_with_support(
         }
 
 
+async def stream_support_chat(
+    message: str,
+    department: str,
+    api_key: str,
+    conversation_history: List[dict] = None
+) -> AsyncIterator[dict]:
+    """
+    Streaming chat_with_support. Yields {"type": "token", "content": ...}
+    per delta, then {"type": "done", ...} with the full message and token
+    usage, or {"type": "error", ...}. Closing the generator closes the
+    upstream stream.
+    """
+    if not api_key:
+        yield {
+            "type": "error",
+            "error": "API key not configured",
+            "message": "Por favor configura tu API Key de OpenAI en el Dashboard."
+        }
+        return
+    
+    dept_config = DEPARTMENTS.get(department, DEPARTMENTS["general"])
+    
+    cached = _cached_answer(message, department, conversation_history)
+    if cached:
+        yield {"type": "token", "content": cached["message"]}
+        yield {
+            "type": "done",
+            "success": True,
+            "department": department,
+            "department_name": dept_config["name"],
+            "message": cached["message"],
+            "tokens_used": 0,
+            "cost_estimate": 0.0,
+            "cached": True,
+            "cache_match": cached["match"],
+            "timestamp": datetime.now().isoformat()
+        }
+        return
+    
+    parts = []
+    tokens_used = 0
+    stream = None
+    try:
+        from services.http_client import get_async_openai
+        client = get_async_openai(api_key)
+        
+        stream = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=_build_messages(message, dept_config, conversation_history),
+            temperature=0.7,
+            max_tokens=500,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                tokens_used = chunk.usage.total_tokens
+            for choice in chunk.choices:
+                if choice.delta and choice.delta.content:
+                    parts.append(choice.delta.content)
+                    yield {"type": "token", "content": choice.delta.content}
+    except Exception as e:
+        yield {"type": "error", "error": "Chat failed", "message": str(e)}
+        return
+    finally:
+        if stream is not None:
+            await stream.close()
+    
+    if not conversation_history:
+        _remember_answer(message, department, "".join(parts), tokens_used)
+    
+    yield {
+        "type": "done",
+        "success": True,
+        "department": department,
+        "department_name": dept_config["name"],
+        "message": "".join(parts),
+        "tokens_used": tokens_used,
+        "cost_estimate": estimate_cost(tokens_used),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 def get_quick_responses(department: str) -> List[str]:
     """Get quick response suggestions for a department"""
     quick_responses = {
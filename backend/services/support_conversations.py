@@ -0,0 +1,217 @@
+"""
+DGB AUDIO - Support Conversations
+==================================
+Server-side history for the support chat, so clients send only the new
+message instead of replaying the whole conversation.
+
+Turns are stored in support_messages under a support_conversations row.
+The prompt context for the next turn is:
+
+    [summary of older turns]  +  every message not yet in the summary
+
+so no turn is ever in neither. Once more than CONTEXT_MESSAGES messages sit
+outside the summary, all but the newest KEEP_RECENT are folded into the
+running summary (one small gpt-4o-mini call with the previous summary and
+those messages, run after the reply), so prompt size stays flat however
+long the conversation gets. Until that background fold lands the
+unsummarized messages are simply sent as they are; only if summaries keep
+failing are they capped at MAX_UNSUMMARIZED_MESSAGES.
+"""
+
+import secrets
+import sys
+from pathlib import Path
+from typing import Optional, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from database import get_connection, dict_from_row, track_api_usage
+
+CONTEXT_MESSAGES = 8
+KEEP_RECENT = 4
+MAX_UNSUMMARIZED_MESSAGES = 40
+SUMMARY_MAX_TOKENS = 300
+
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+SUMMARY_PROMPT = """Resume la conversación de soporte para que otro agente pueda continuarla.
+Conserva: el problema del usuario, datos concretos que dio (plan, género, archivos,
+errores), lo que ya se intentó o respondió, y lo que sigue pendiente.
+Máximo 120 palabras, en español, sin saludos."""
+
+
+# ============================================================================
+# CONVERSATIONS
+# ============================================================================
+
+def create_conversation(user_id: str, department: str = "general", title: str = None) -> Dict:
+    conversation_id = f"conv_{secrets.token_hex(8)}"
+    with get_connection() as conn:
+        conn.execute(f"""
+        INSERT INTO support_conversations (id, user_id, department, title, created_at, updated_at)
+        VALUES (?, ?, ?, ?, {NOW_SQL}, {NOW_SQL})
+        """, (conversation_id, user_id, department, title))
+    return get_conversation(conversation_id, user_id, include_messages=False)
+
+
+def get_conversation(conversation_id: str, user_id: str, include_messages: bool = True) -> Optional[Dict]:
+    """Conversation metadata, summary and (optionally) every stored message"""
+    with get_connection() as conn:
+        conversation = dict_from_row(conn.execute(
+            "SELECT * FROM support_conversations WHERE id = ? AND user_id = ?",
+            (conversation_id, user_id)
+        ).fetchone())
+        if not conversation:
+            return None
+        if include_messages:
+            conversation["messages"] = [dict(row) for row in conn.execute("""
+            SELECT id, role, content, created_at FROM support_messages
+            WHERE conversation_id = ? ORDER BY id
+            """, (conversation_id,)).fetchall()]
+    return conversation
+
+
+def list_conversations(user_id: str, limit: int = 20) -> List[Dict]:
+    with get_connection() as conn:
+        rows = conn.execute("""
+        SELECT id, department, title, message_count, created_at, updated_at
+        FROM support_conversations WHERE user_id = ?
+        ORDER BY updated_at DESC LIMIT ?
+        """, (user_id, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def delete_conversation(conversation_id: str, user_id: str) -> bool:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM support_conversations WHERE id = ? AND user_id = ?",
+            (conversation_id, user_id)
+        )
+        if not cursor.rowcount:
+            return False
+        cursor.execute("DELETE FROM support_messages WHERE conversation_id = ?", (conversation_id,))
+    return True
+
+
+# ============================================================================
+# TURNS / CONTEXT
+# ============================================================================
+
+def build_context(conversation_id: str) -> List[dict]:
+    """Messages to send before the new user message: summary plus everything after it"""
+    with get_connection() as conn:
+        conversation = conn.execute(
+            "SELECT summary, summarized_through FROM support_conversations WHERE id = ?",
+            (conversation_id,)
+        ).fetchone()
+        if not conversation:
+            return []
+        rows = conn.execute("""
+        SELECT role, content FROM support_messages
+        WHERE conversation_id = ? AND id > ?
+        ORDER BY id DESC LIMIT ?
+        """, (conversation_id, conversation["summarized_through"] or 0,
+              MAX_UNSUMMARIZED_MESSAGES)).fetchall()
+
+    context = []
+    if conversation["summary"]:
+        context.append({
+            "role": "system",
+            "content": f"Resumen de la conversación hasta ahora: {conversation['summary']}"
+        })
+    context.extend({"role": row["role"], "content": row["content"]} for row in reversed(rows))
+    return context
+
+
+def save_turn(conversation_id: str, user_id: str, department: str,
+              user_message: str, assistant_message: str, tokens_used: int = 0):
+    """Store a user message and its reply"""
+    with get_connection() as conn:
+        conn.executemany(f"""
+        INSERT INTO support_messages (user_id, conversation_id, department, role, content, created_at)
+        VALUES (?, ?, ?, ?, ?, {NOW_SQL})
+        """, [
+            (user_id, conversation_id, department, "user", user_message),
+            (user_id, conversation_id, department, "assistant", assistant_message),
+        ])
+        conn.execute(f"""
+        UPDATE support_conversations
+        SET message_count = message_count + 2,
+            tokens_used = tokens_used + ?,
+            title = COALESCE(title, ?),
+            updated_at = {NOW_SQL}
+        WHERE id = ?
+        """, (tokens_used, user_message[:60], conversation_id))
+
+
+def needs_summary(conversation_id: str) -> bool:
+    with get_connection() as conn:
+        pending = conn.execute("""
+        SELECT COUNT(*) FROM support_messages m
+        JOIN support_conversations c ON c.id = m.conversation_id
+        WHERE m.conversation_id = ? AND m.id > COALESCE(c.summarized_through, 0)
+        """, (conversation_id,)).fetchone()[0]
+    return pending > CONTEXT_MESSAGES
+
+
+async def summarize_conversation(conversation_id: str, api_key: str) -> Dict:
+    """Fold all but the newest KEEP_RECENT unsummarized messages into the summary"""
+    from services.http_client import get_async_openai
+
+    with get_connection() as conn:
+        conversation = dict_from_row(conn.execute(
+            "SELECT * FROM support_conversations WHERE id = ?", (conversation_id,)
+        ).fetchone())
+        if not conversation:
+            return {"error": "Conversation not found"}
+        rows = conn.execute("""
+        SELECT id, role, content FROM support_messages
+        WHERE conversation_id = ? AND id > ?
+        ORDER BY id
+        """, (conversation_id, conversation["summarized_through"] or 0)).fetchall()
+
+    fold = rows[:-KEEP_RECENT] if len(rows) > KEEP_RECENT else []
+    if not fold:
+        return {"success": True, "summarized": 0}
+
+    transcript = "\n".join(
+        f"{'Usuario' if row['role'] == 'user' else 'Agente'}: {row['content']}" for row in fold
+    )
+    previous = conversation["summary"] or "(sin resumen previo)"
+    try:
+        client = get_async_openai(api_key)
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Resumen previo:\n{previous}\n\nNuevos mensajes:\n{transcript}"}
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+    except Exception as e:
+        return {"error": f"Summary failed: {e}"}
+
+    summary = response.choices[0].message.content.strip()
+    tokens_used = response.usage.total_tokens if response.usage else 0
+    with get_connection() as conn:
+        # Only advance if no other summarizer got there first
+        conn.execute(f"""
+        UPDATE support_conversations
+        SET summary = ?, summarized_through = ?, tokens_used = tokens_used + ?, updated_at = {NOW_SQL}
+        WHERE id = ? AND COALESCE(summarized_through, 0) = ?
+        """, (summary, fold[-1]["id"], tokens_used, conversation_id,
+              conversation["summarized_through"] or 0))
+
+    from services.support_chat import estimate_cost
+    track_api_usage(conversation["user_id"], tokens_used, estimate_cost(tokens_used),
+                    endpoint="support_summary")
+    return {"success": True, "summarized": len(fold), "tokens_used": tokens_used}
+
+
+async def summarize_if_needed(conversation_id: str, api_key: str):
+    """Background hook run after each reply"""
+    if needs_summary(conversation_id):
+        result = await summarize_conversation(conversation_id, api_key)
+        if "error" in result:
+            print(f"Support summary for {conversation_id}: {result['error']}")
@@ -0,0 +1,253 @@
+"""
+DGB AUDIO - Waveform Peak Pyramid
+==================================
+Multi-resolution min/max peaks so the webapp can draw any zoom level of a
+sample or generated track without downloading the audio.
+
+Level 0 holds one (min, max) pair per BASE_BLOCK frames (all channels
+merged); each further level halves the resolution. The pyramid is stored
+next to the audio as "<file>.peaks":
+
+    header   <8sHHIQIH  magic, version, channels, sample_rate, frames,
+                        base_block, levels
+    table    <QQ        bucket count and byte offset, per level
+    data     int16      min, max interleaved, per bucket
+
+Building streams the PCM in blocks and reduces each block with numpy, so
+hour-long files never need to be decoded into memory at once (non-WAV
+formats go through pydub when it is installed).
+"""
+
+import os
+import struct
+import wave
+from typing import Optional, Dict, Iterator
+
+# Try to import audio processing libraries
+try:
+    from pydub import AudioSegment
+    PYDUB_AVAILABLE = True
+except ImportError:
+    PYDUB_AVAILABLE = False
+
+MAGIC = b"DGBPEAKS"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIQIH")
+LEVEL_ENTRY = struct.Struct("<QQ")
+
+BASE_BLOCK = 256          # frames per bucket at level 0
+MIN_TOP_BUCKETS = 256     # stop adding levels once a level is this small
+READ_BLOCKS = 1024        # level-0 buckets decoded per read
+
+
+def pyramid_path(audio_path: str) -> str:
+    return f"{audio_path}.peaks"
+
+
+# ============================================================================
+# DECODING
+# ============================================================================
+
+def _pcm_to_int16(raw: bytes, width: int):
+    """Interleaved PCM of any common WAV width as int16"""
+    import numpy as np
+
+    if width == 2:
+        return np.frombuffer(raw, dtype="<i2")
+    if width == 1:
+        return ((np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8)
+    if width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        # Top two bytes of a little-endian 24-bit sample
+        return (b[:, 1].astype(np.uint16) | (b[:, 2].astype(np.uint16) << 8)).view(np.int16)
+    if width == 4:
+        return (np.frombuffer(raw, dtype="<i4") >> 16).astype(np.int16)
+    raise ValueError(f"Unsupported sample width: {width}")
+
+
+def _read_blocks(audio_path: str, block_frames: int) -> Iterator[tuple]:
+    """Yield (info, int16 frames array of shape (n, channels)) in blocks"""
+    try:
+        wav = wave.open(audio_path, "rb")
+    except (wave.Error, EOFError):
+        wav = None
+
+    if wav is not None:
+        with wav:
+            channels = wav.getnchannels()
+            info = (channels, wav.getframerate(), wav.getnframes())
+            width = wav.getsampwidth()
+            while True:
+                raw = wav.readframes(block_frames)
+                if not raw:
+                    break
+                samples = _pcm_to_int16(raw, width)
+                n = len(samples) // channels
+                yield info, samples[:n * channels].reshape(n, channels)
+        return
+
+    if not PYDUB_AVAILABLE:
+        raise ValueError("Only WAV files are supported without pydub")
+
+    import numpy as np
+    audio = AudioSegment.from_file(audio_path).set_sample_width(2)
+    channels = audio.channels
+    samples = np.array(audio.get_array_of_samples(), dtype=np.int16).reshape(-1, channels)
+    info = (channels, audio.frame_rate, len(samples))
+    for start in range(0, len(samples), block_frames):
+        yield info, samples[start:start + block_frames]
+
+
+# ============================================================================
+# BUILD
+# ============================================================================
+
+def _reduce(frames, block: int):
+    """Per-bucket min/max of an (n, channels) int16 array"""
+    import numpy as np
+
+    n = len(frames)
+    full = n // block
+    mins, maxs = [], []
+    if full:
+        body = frames[:full * block].reshape(full, block * frames.shape[1])
+        mins.append(body.min(axis=1))
+        maxs.append(body.max(axis=1))
+    if n % block:
+        tail = frames[full * block:]
+        mins.append(np.array([tail.min()], dtype=np.int16))
+        maxs.append(np.array([tail.max()], dtype=np.int16))
+    return mins, maxs
+
+
+def _halve(mins, maxs):
+    import numpy as np
+
+    if len(mins) % 2:
+        mins = np.append(mins, mins[-1])
+        maxs = np.append(maxs, maxs[-1])
+    return mins.reshape(-1, 2).min(axis=1), maxs.reshape(-1, 2).max(axis=1)
+
+
+def build_pyramid(audio_path: str, base_block: int = BASE_BLOCK) -> str:
+    """Compute and store the peak pyramid for an audio file"""
+    import numpy as np
+
+    info = (1, 0, 0)
+    mins, maxs = [], []
+    for info, frames in _read_blocks(audio_path, base_block * READ_BLOCKS):
+        block_mins, block_maxs = _reduce(frames, base_block)
+        mins.extend(block_mins)
+        maxs.extend(block_maxs)
+    channels, sample_rate, frames_total = info
+
+    level_min = np.concatenate(mins) if mins else np.zeros(0, dtype=np.int16)
+    level_max = np.concatenate(maxs) if maxs else np.zeros(0, dtype=np.int16)
+    levels = [(level_min, level_max)]
+    while len(levels[-1][0]) > MIN_TOP_BUCKETS:
+        levels.append(_halve(*levels[-1]))
+
+    offset = HEADER.size + LEVEL_ENTRY.size * len(levels)
+    table = []
+    for level_min, level_max in levels:
+        table.append((len(level_min), offset))
+        offset += len(level_min) * 4
+
+    target = pyramid_path(audio_path)
+    tmp = f"{target}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, channels, sample_rate, frames_total,
+                            base_block, len(levels)))
+        for count, level_offset in table:
+            f.write(LEVEL_ENTRY.pack(count, level_offset))
+        for level_min, level_max in levels:
+            pairs = np.empty(len(level_min) * 2, dtype="<i2")
+            pairs[0::2] = level_min
+            pairs[1::2] = level_max
+            f.write(pairs.tobytes())
+    os.replace(tmp, target)
+    return target
+
+
+def ensure_pyramid(audio_path: str) -> str:
+    """Path to an up-to-date pyramid for audio_path, building it if needed"""
+    target = pyramid_path(audio_path)
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(audio_path):
+        build_pyramid(audio_path)
+    return target
+
+
+# ============================================================================
+# READ
+# ============================================================================
+
+class PeakPyramid:
+    """Reader for a stored .peaks file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+            magic, version, self.channels, self.sample_rate, self.frames, \
+                self.base_block, level_count = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a DGB peaks file")
+            self.levels = [
+                LEVEL_ENTRY.unpack(f.read(LEVEL_ENTRY.size)) for _ in range(level_count)
+            ]
+
+    @property
+    def duration(self) -> float:
+        return self.frames / float(self.sample_rate) if self.sample_rate else 0.0
+
+    def _pick_level(self, span_frames: int, width: int) -> int:
+        """Coarsest level that still has at least `width` buckets in the span"""
+        level = 0
+        while (level + 1 < len(self.levels)
+               and self.base_block << (level + 1) <= span_frames / max(1, width)):
+            level += 1
+        return level
+
+    def slice(self, start: float = 0.0, end: Optional[float] = None, width: int = 1000) -> Dict:
+        """Peaks between start and end seconds at roughly `width` points"""
+        import numpy as np
+
+        end = self.duration if end is None else min(end, self.duration)
+        start = max(0.0, min(start, end))
+        start_frame = int(start * self.sample_rate)
+        end_frame = max(start_frame + 1, int(end * self.sample_rate))
+
+        level = self._pick_level(end_frame - start_frame, width)
+        per_bucket = self.base_block << level
+        count, offset = self.levels[level]
+        first = min(start_frame // per_bucket, count)
+        last = min(-(-end_frame // per_bucket), count)
+
+        with open(self.path, "rb") as f:
+            f.seek(offset + first * 4)
+            pairs = np.fromfile(f, dtype="<i2", count=(last - first) * 2)
+
+        scale = 1 / 32768.0
+        return {
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "duration": round(self.duration, 3),
+            "start": round(first * per_bucket / self.sample_rate, 4) if self.sample_rate else 0,
+            "level": level,
+            "samples_per_bucket": per_bucket,
+            "points": int(last - first),
+            "min": np.round(pairs[0::2] * scale, 4).tolist(),
+            "max": np.round(pairs[1::2] * scale, 4).tolist(),
+        }
+
+
+def get_waveform(audio_path: str, start: float = 0.0, end: Optional[float] = None,
+                 width: int = 1000) -> Dict:
+    """Slice of an audio file's pyramid (built on first use)"""
+    if not audio_path or not os.path.exists(audio_path):
+        return {"error": "Audio not found"}
+    try:
+        pyramid = PeakPyramid(ensure_pyramid(audio_path))
+    except Exception as e:
+        return {"error": f"Waveform unavailable: {e}"}
+    return pyramid.slice(start, end, max(1, min(width, 20000)))
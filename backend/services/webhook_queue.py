@@ -0,0 +1,320 @@
+"""
+DGB AUDIO - Stripe Webhook Queue
+=================================
+Verified webhook payloads are appended to the stripe_webhook_events table
+and acknowledged immediately; a background worker applies them in arrival
+order. Duplicate deliveries are dropped by event id at ingestion time and
+again by the stripe_events ledger when applied.
+
+Local tooling:
+    python -m services.webhook_queue fake checkout.session.completed --user usr_x --plan pro
+    python -m services.webhook_queue replay --from-seq 10 --to-seq 20
+    python -m services.webhook_queue status
+"""
+
+import asyncio
+import json
+import secrets
+import sys
+import time
+from pathlib import Path
+from typing import Optional, List, Dict
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from database import get_connection, dict_from_row
+
+# Worker configuration
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_DELAY_SECONDS = 2.0
+IDLE_POLL_SECONDS = 30.0
+
+_worker_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+
+
+# ============================================================================
+# INGESTION
+# ============================================================================
+
+def ingest_event(event_id: str, event_type: str, payload: str) -> dict:
+    """
+    Persist a verified event. Returns quickly; processing happens in the worker.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+        INSERT OR IGNORE INTO stripe_webhook_events (event_id, event_type, payload)
+        VALUES (?, ?, ?)
+        """, (event_id, event_type, payload))
+        duplicate = cursor.rowcount == 0
+
+    if not duplicate:
+        notify_worker()
+
+    return {"received": True, "event_id": event_id, "duplicate": duplicate}
+
+
+def notify_worker():
+    """Wake the worker if it is waiting for new events"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+# ============================================================================
+# PROCESSING
+# ============================================================================
+
+def _fetch_pending(limit: int = BATCH_SIZE) -> List[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT seq, event_id, event_type, payload, attempts
+        FROM stripe_webhook_events
+        WHERE status = 'pending'
+        ORDER BY seq
+        LIMIT ?
+        """, (limit,))
+        return [dict_from_row(row) for row in cursor.fetchall()]
+
+
+def _mark_processed(seq: int):
+    with get_connection() as conn:
+        conn.execute("""
+        UPDATE stripe_webhook_events
+        SET status = 'processed', processed_at = CURRENT_TIMESTAMP, last_error = NULL
+        WHERE seq = ?
+        """, (seq,))
+
+
+def _mark_failed(seq: int, attempts: int, error: str):
+    # Events that keep failing are parked as 'failed' so they stop blocking
+    # the queue; use replay_events once the cause is fixed.
+    status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+    with get_connection() as conn:
+        conn.execute("""
+        UPDATE stripe_webhook_events
+        SET status = ?, attempts = ?, last_error = ?
+        WHERE seq = ?
+        """, (status, attempts, error, seq))
+
+
+def process_pending(force: bool = False) -> dict:
+    """
+    Apply pending events in order. Stops at the first failure so later
+    events are never applied ahead of an earlier one.
+    """
+    from services.stripe_service import apply_stripe_event
+
+    processed = 0
+    for row in _fetch_pending():
+        try:
+            apply_stripe_event(json.loads(row["payload"]), force=force)
+        except Exception as e:
+            _mark_failed(row["seq"], row["attempts"] + 1, str(e))
+            return {"processed": processed, "blocked_on": row["seq"], "error": str(e)}
+        _mark_processed(row["seq"])
+        processed += 1
+
+    return {"processed": processed}
+
+
+async def _worker_loop():
+    while True:
+        _wakeup.clear()
+        try:
+            result = await asyncio.to_thread(process_pending)
+        except Exception as e:
+            print(f"Webhook worker error: {e}")
+            result = {"processed": 0, "error": str(e)}
+
+        if result.get("error"):
+            await asyncio.sleep(RETRY_DELAY_SECONDS)
+            continue
+        if result["processed"] >= BATCH_SIZE:
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_worker():
+    """Start the background worker (call from the app startup hook)"""
+    global _worker_task, _wakeup
+    if _worker_task is not None and not _worker_task.done():
+        return
+    _wakeup = asyncio.Event()
+    _worker_task = asyncio.get_running_loop().create_task(_worker_loop())
+
+
+async def stop_worker():
+    """Stop the background worker"""
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+# ============================================================================
+# REPLAY & INSPECTION
+# ============================================================================
+
+def replay_events(
+    from_seq: Optional[int] = None,
+    to_seq: Optional[int] = None,
+    event_type: Optional[str] = None
+) -> dict:
+    """
+    Re-apply a range of stored events in order, bypassing the dedup ledger.
+    """
+    from services.stripe_service import apply_stripe_event
+
+    query = "SELECT seq, payload FROM stripe_webhook_events WHERE 1=1"
+    params = []
+    if from_seq is not None:
+        query += " AND seq >= ?"
+        params.append(from_seq)
+    if to_seq is not None:
+        query += " AND seq <= ?"
+        params.append(to_seq)
+    if event_type:
+        query += " AND event_type = ?"
+        params.append(event_type)
+    query += " ORDER BY seq"
+
+    with get_connection() as conn:
+        rows = [dict_from_row(row) for row in conn.execute(query, params).fetchall()]
+
+    results = []
+    for row in rows:
+        try:
+            result = apply_stripe_event(json.loads(row["payload"]), force=True)
+            _mark_processed(row["seq"])
+        except Exception as e:
+            result = {"error": str(e)}
+        results.append({"seq": row["seq"], **result})
+
+    return {"replayed": len(results), "results": results}
+
+
+def get_queue_status() -> dict:
+    """Counts per status plus the oldest pending event"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT status, COUNT(*) FROM stripe_webhook_events GROUP BY status
+        """)
+        counts = {row[0]: row[1] for row in cursor.fetchall()}
+        cursor.execute("""
+        SELECT seq, event_id, received_at, attempts, last_error
+        FROM stripe_webhook_events WHERE status = 'pending'
+        ORDER BY seq LIMIT 1
+        """)
+        oldest = dict_from_row(cursor.fetchone())
+
+    return {"counts": counts, "oldest_pending": oldest}
+
+
+# ============================================================================
+# FAKE EVENTS (local development)
+# ============================================================================
+
+def make_fake_event(
+    event_type: str,
+    user_id: Optional[str] = None,
+    plan: str = "pro",
+    customer_id: Optional[str] = None,
+    subscription_id: Optional[str] = None,
+    status: str = "active"
+) -> Dict:
+    """Build a minimal Stripe-shaped event for the supported event types"""
+    customer_id = customer_id or f"cus_fake_{secrets.token_hex(4)}"
+    subscription_id = subscription_id or f"sub_fake_{secrets.token_hex(4)}"
+    now = int(time.time())
+
+    if event_type == "checkout.session.completed":
+        obj = {
+            "object": "checkout.session",
+            "customer": customer_id,
+            "subscription": subscription_id,
+            "metadata": {"user_id": user_id, "plan": plan}
+        }
+    elif event_type in ("customer.subscription.updated", "customer.subscription.deleted"):
+        obj = {
+            "object": "subscription",
+            "id": subscription_id,
+            "customer": customer_id,
+            "status": "canceled" if event_type.endswith("deleted") else status,
+            "current_period_start": now,
+            "current_period_end": now + 30 * 86400,
+            "metadata": {"user_id": user_id, "plan": plan}
+        }
+    elif event_type == "invoice.payment_failed":
+        obj = {"object": "invoice", "customer": customer_id, "subscription": subscription_id}
+    else:
+        obj = {"object": "unknown"}
+
+    return {
+        "id": f"evt_fake_{secrets.token_hex(8)}",
+        "object": "event",
+        "type": event_type,
+        "created": now,
+        "data": {"object": obj}
+    }
+
+
+def ingest_fake_event(event_type: str, **kwargs) -> dict:
+    """Generate a fake event and push it through the ingestion path"""
+    event = make_fake_event(event_type, **kwargs)
+    result = ingest_event(event["id"], event["type"], json.dumps(event))
+    return {**result, "event": event}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stripe webhook queue tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fake = sub.add_parser("fake", help="Ingest a fake event")
+    fake.add_argument("event_type")
+    fake.add_argument("--user")
+    fake.add_argument("--plan", default="pro")
+    fake.add_argument("--customer")
+    fake.add_argument("--subscription")
+    fake.add_argument("--process", action="store_true", help="Apply pending events now")
+
+    replay = sub.add_parser("replay", help="Re-apply stored events")
+    replay.add_argument("--from-seq", type=int)
+    replay.add_argument("--to-seq", type=int)
+    replay.add_argument("--type")
+
+    sub.add_parser("process", help="Apply pending events now")
+    sub.add_parser("status", help="Show queue status")
+
+    args = parser.parse_args()
+
+    if args.command == "fake":
+        output = ingest_fake_event(
+            args.event_type,
+            user_id=args.user,
+            plan=args.plan,
+            customer_id=args.customer,
+            subscription_id=args.subscription
+        )
+        if args.process:
+            output["processing"] = process_pending()
+    elif args.command == "replay":
+        output = replay_events(args.from_seq, args.to_seq, args.type)
+    elif args.command == "process":
+        output = process_pending()
+    else:
+        output = get_queue_status()
+
+    print(json.dumps(output, indent=2, default=str))
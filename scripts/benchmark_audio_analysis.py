@@ -0,0 +1,150 @@
+"""
+DGB AUDIO - Audio Analysis Benchmark
+=====================================
+Latency (and accuracy) of the local key/BPM/timbre analyzer against the
+remote OpenAI analysis it replaces.
+
+Test recordings are synthesized plucked-chord progressions with a known
+key and tempo. The remote path runs the real request code against a mock
+OpenAI server that answers after --remote-latency seconds, so the numbers
+show client/pool overhead plus whatever model latency you assume.
+
+    pip install numpy httpx
+    python scripts/benchmark_audio_analysis.py --runs 20 --remote-latency 2.5
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import wave
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+
+# (name, genre, bpm, key, chords as MIDI notes)
+CASES = [
+    ("bachata_am", "bachata", 130, "Am", [[57, 60, 64, 69], [62, 65, 69, 74], [52, 56, 59, 64], [57, 60, 64, 69]]),
+    ("merengue_c", "merengue", 160, "C", [[48, 52, 55, 60], [53, 57, 60, 65], [55, 59, 62, 67], [48, 52, 55, 60]]),
+    ("bolero_dm", "bolero", 80, "Dm", [[50, 53, 57, 62], [55, 58, 62, 67], [45, 49, 52, 57], [50, 53, 57, 62]]),
+    ("cumbia_d", "cumbia", 95, "D", [[50, 54, 57, 62], [55, 59, 62, 67], [57, 61, 64, 69], [50, 54, 57, 62]]),
+]
+
+
+def synthesize(bpm: float, chords, seconds: float) -> bytes:
+    """16-bit mono WAV of arpeggiated plucked chords, one note per eighth"""
+    y = np.zeros(int(seconds * SAMPLE_RATE))
+    step = 60 / bpm / 2
+    length = int(step * 4 * SAMPLE_RATE)
+    t = np.arange(length) / SAMPLE_RATE
+    for i, start in enumerate(np.arange(0, seconds - step, step)):
+        chord = chords[(i // 4) % len(chords)]
+        freq = 440 * 2 ** ((chord[i % len(chord)] - 69) / 12)
+        note = sum(0.6 ** k * np.sin(2 * np.pi * freq * (k + 1) * t) for k in range(5)) * np.exp(-4 * t)
+        s = int(start * SAMPLE_RATE)
+        segment = note[:len(y) - s] * (1.0 if i % 2 == 0 else 0.7)
+        y[s:s + len(segment)] += segment
+    y = 0.8 * y / np.abs(y).max()
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((y * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def start_mock_openai(latency: float) -> ThreadingHTTPServer:
+    """Chat-completions stand-in that answers a fixed analysis after `latency` seconds"""
+    answer = json.dumps({
+        "detected_key": "Am", "detected_bpm": 120,
+        "timbre_profile": {"brightness": 0.5, "warmth": 0.5, "attack": 0.5, "sustain": 0.5},
+        "suggested_patterns": ["pattern"], "quality_score": 80, "recommendations": ["tip"]
+    })
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            body = json.dumps({
+                "choices": [{"message": {"role": "assistant", "content": answer}}],
+                "usage": {"total_tokens": 450}
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summarize(samples) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return f"p50 {statistics.median(ordered) * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local vs remote audio analysis latency")
+    parser.add_argument("--runs", type=int, default=10, help="Timed runs per case")
+    parser.add_argument("--seconds", type=float, default=20.0, help="Length of each recording")
+    parser.add_argument("--remote-latency", type=float, default=2.0,
+                        help="Seconds the mock OpenAI server takes to answer")
+    args = parser.parse_args()
+
+    server = start_mock_openai(args.remote_latency)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+    from services.audio_processor import estimate_musical_features
+    from services.ai_generation import _remote_analysis
+
+    local_times, remote_times = [], []
+    print(f"{'case':<12} {'expected':>12} {'local':>12} {'confidence':>10}   local latency")
+    for name, genre, bpm, key, chords in CASES:
+        audio = synthesize(bpm, chords, args.seconds)
+        estimate_musical_features(audio, genre)  # warm-up
+        times = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            result = estimate_musical_features(audio, genre)
+            times.append(time.perf_counter() - started)
+        local_times += times
+        print(f"{name:<12} {key + ' ' + str(bpm):>12} "
+              f"{result['detected_key'] + ' ' + str(result['detected_bpm']):>12} "
+              f"{result['confidence']['overall']:>10}   {summarize(times)}")
+
+    async def remote_runs():
+        await _remote_analysis("sk-benchmark", "guitar", "bachata")  # warm-up (connection)
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            await _remote_analysis("sk-benchmark", "guitar", "bachata")
+            remote_times.append(time.perf_counter() - started)
+
+    asyncio.run(remote_runs())
+    server.shutdown()
+
+    print()
+    print(f"local  ({args.seconds:.0f} s recordings): {summarize(local_times)}")
+    print(f"remote (mock, {args.remote_latency:.1f} s model): {summarize(remote_times)}")
+    print(f"speedup (p50): {statistics.median(remote_times) / statistics.median(local_times):.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+DGB AUDIO - Support Cache Matching Checks
+==========================================
+Question pairs the support response cache must (or must not) treat as the
+same question. A wrong "similar" hit serves another question's answer
+without billing anyone, so every false match here is a bug.
+
+    python scripts/check_chat_cache.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+from services.chat_cache import normalize, _vector, _similarity, SIMILARITY_THRESHOLD
+
+# (cached question, incoming question, should share the answer)
+CASES = [
+    # Same question, different wording / spelling
+    ("¿Cuánto cuesta el plan Pro?", "cuanto cuesta el plan pro por favor", True),
+    ("¿Cómo cancelo mi suscripción?", "¿Cómo cancelo mi subscripción?", True),
+    ("¿Cómo cambio mi contraseña?", "¿Como cambio mi contrasena?", True),
+    # Reordered words change the meaning
+    ("¿Cómo convierto audio a MIDI?", "¿Cómo convierto MIDI a audio?", False),
+    # Negation on one side only
+    ("¿Puedo obtener un reembolso?", "¿No puedo obtener un reembolso?", False),
+    ("¿Cuál plan me recomiendas?", "¿Cuál plan no me recomiendas?", False),
+    ("¿Puedo exportar con voz?", "¿Puedo exportar sin voz?", False),
+    # One decisive word swapped
+    ("¿Cuánto cuesta el plan Pro?", "¿Cuánto cuesta el plan Studio?", False),
+    # Extra words
+    ("¿Cómo exporto stems?", "¿Cómo exporto stems en MP3?", False),
+]
+
+
+def main() -> int:
+    failures = 0
+    for cached, incoming, expected in CASES:
+        score = _similarity(_vector(normalize(cached)), _vector(normalize(incoming)))
+        matched = normalize(cached) == normalize(incoming) or score >= SIMILARITY_THRESHOLD
+        ok = matched == expected
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {score:5.3f}  {cached!r} ~ {incoming!r}"
+              f"  (expected {'match' if expected else 'no match'})")
+    print(f"\n{len(CASES) - failures}/{len(CASES)} passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
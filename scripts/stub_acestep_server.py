@@ -0,0 +1,101 @@
+"""
+DGB AUDIO - Stub ACE-Step Server
+=================================
+Local stand-in for the ACE-Step Gradio app, for exercising the generation
+queue without a GPU. Exposes the same api_name='/__call__' signature, sleeps
+for a time proportional to infer_step × duration, and returns a sine-wave WAV.
+
+With --segment-seconds N the render is produced in N-second chunks: each
+one is yielded as (chunk_wav, '{"segment": i, ...}') as soon as it is
+"rendered", which the backend publishes for live streaming (?stream=true),
+and the full file is yielded last.
+
+    pip install gradio numpy soundfile
+    python scripts/stub_acestep_server.py --port 7870 --speed 0.002
+    ACESTEP_URL=http://localhost:7870 uvicorn main:app   # from backend/
+"""
+
+import argparse
+import json
+import tempfile
+import time
+
+import gradio as gr
+import numpy as np
+import soundfile as sf
+
+SAMPLE_RATE = 48000
+
+
+def write_wav(audio: np.ndarray) -> str:
+    out = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+    sf.write(out.name, audio, SAMPLE_RATE, subtype="PCM_16")
+    return out.name
+
+
+def make_handler(speed: float, fail_every: int, segment_seconds: float):
+    calls = {"count": 0}
+
+    def generate(audio_format, audio_duration, prompt, lyrics, infer_step,
+                 guidance_scale, scheduler_type, cfg_type, omega_scale, manual_seeds,
+                 guidance_interval, guidance_interval_decay, min_guidance_scale,
+                 use_erg_tag, use_erg_lyric, use_erg_diffusion, oss_steps,
+                 guidance_scale_text, guidance_scale_lyric, audio2audio_enable,
+                 ref_audio_strength, ref_audio_input, lora_name_or_path, lora_weight):
+        calls["count"] += 1
+        if fail_every and calls["count"] % fail_every == 0:
+            raise gr.Error("Stub failure")
+
+        duration = float(audio_duration)
+
+        # Deterministic per seed, like the real model
+        seed = int(str(manual_seeds).split(",")[0] or 0)
+        rng = np.random.default_rng(seed)
+        freq = 110.0 * (1 + rng.integers(0, 12) / 12)
+        t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+        tone = (0.2 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+        audio = np.stack([tone, tone], axis=1)
+        params = {"prompt": prompt, "infer_step": infer_step, "seed": seed}
+
+        step = int(segment_seconds * SAMPLE_RATE) if segment_seconds > 0 else len(audio)
+        for index, start in enumerate(range(0, len(audio), max(1, step))):
+            chunk = audio[start:start + step]
+            time.sleep(speed * float(infer_step) * len(chunk) / SAMPLE_RATE)
+            if segment_seconds > 0:
+                yield write_wav(chunk), json.dumps({**params, "segment": index})
+
+        yield write_wav(audio), json.dumps(params)
+
+    return generate
+
+
+def build_app(speed: float, fail_every: int, segment_seconds: float = 0.0) -> gr.Blocks:
+    with gr.Blocks() as app:
+        inputs = [
+            gr.Textbox(value="wav"), gr.Number(value=60), gr.Textbox(), gr.Textbox(),
+            gr.Number(value=27), gr.Number(value=7.0), gr.Textbox(value="euler"),
+            gr.Textbox(value="apg"), gr.Number(value=5.0), gr.Textbox(),
+            gr.Number(value=0.5), gr.Number(value=0.0), gr.Number(value=3.0),
+            gr.Checkbox(value=True), gr.Checkbox(value=False), gr.Checkbox(value=True),
+            gr.Textbox(), gr.Number(value=0.0), gr.Number(value=0.0),
+            gr.Checkbox(value=False), gr.Number(value=0.5), gr.Audio(type="filepath"),
+            gr.Textbox(value="none"), gr.Number(value=1.0),
+        ]
+        outputs = [gr.Audio(type="filepath"), gr.Textbox()]
+        button = gr.Button("Generate")
+        button.click(make_handler(speed, fail_every, segment_seconds), inputs, outputs, api_name="__call__")
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub ACE-Step Gradio server")
+    parser.add_argument("--port", type=int, default=7870)
+    parser.add_argument("--speed", type=float, default=0.002,
+                        help="Seconds slept per (infer_step × audio second)")
+    parser.add_argument("--fail-every", type=int, default=0,
+                        help="Fail every Nth request (0 = never)")
+    parser.add_argument("--segment-seconds", type=float, default=0.0,
+                        help="Yield the render in chunks of this many seconds (0 = whole file)")
+    args = parser.parse_args()
+
+    build_app(args.speed, args.fail_every, args.segment_seconds).queue().launch(server_port=args.port)
@@ -366,6 +366,14 @@ function SampleLibraryPanel({ samples, onRefresh }) {
         const files = Array.from(e.target.files);
         if (!files.length) return;
 
+        // Uploads count against the signed-in user's storage quota
+        const token = localStorage.getItem('dgb_token');
+        if (!token) {
+            alert('Please log in to upload samples.');
+            e.target.value = '';
+            return;
+        }
+
         setUploading(true);
         setUploadProgress({ current: 0, total: files.length });
 
@@ -382,10 +390,14 @@ function SampleLibraryPanel({ samples, onRefresh }) {
             formData.append('tags', uploadForm.tags);
 
             try {
-                await fetch(`${API_BASE}/samples/upload`, {
+                const res = await fetch(`${API_BASE}/samples/upload?token=${token}`, {
                     method: 'POST',
                     body: formData
                 });
+                if (!res.ok) {
+                    const data = await res.json().catch(() => ({}));
+                    alert(`Upload failed for ${file.name}: ${data.detail || res.statusText}`);
+                }
             } catch (err) {
                 console.error(`Upload failed for ${file.name}:`, err);
             }
@@ -6,6 +6,10 @@ import '../globals.css';
 
 const API_BASE = 'http://localhost:8000/api';
 
+// Give up polling a queued generation after this long; back off between polls
+const GENERATION_POLL_TIMEOUT_MS = 15 * 60 * 1000;
+const GENERATION_POLL_MAX_DELAY_MS = 15000;
+
 /**
  * DGB AUDIO STUDIO - Suno-Style Interface
  * ========================================
@@ -126,7 +130,24 @@ export default function StudioPage() {
                 })
             });
 
-            const data = await res.json();
+            let data = await res.json();
+
+            // Generation runs in a background queue; poll until it finishes
+            const pollDeadline = Date.now() + GENERATION_POLL_TIMEOUT_MS;
+            let pollDelay = 2000;
+            while (data.success && (data.status === 'queued' || data.status === 'running')) {
+                if (data.status === 'queued' && data.position) {
+                    setGenerationStage(`En cola (#${data.position}) • ~${Math.round(data.eta_seconds || 0)}s`);
+                }
+                if (Date.now() + pollDelay > pollDeadline) {
+                    data = { error: 'La generación está tardando demasiado. Revisa tu historial más tarde.' };
+                    break;
+                }
+                await new Promise(resolve => setTimeout(resolve, pollDelay));
+                pollDelay = Math.min(pollDelay * 1.5, GENERATION_POLL_MAX_DELAY_MS);
+                const statusRes = await fetch(`${API_BASE}/generate/status/${data.job_id}?token=${token}`);
+                data = await statusRes.json();
+            }
             clearInterval(progressInterval);
 
             if (data.success) {
@@ -500,7 +521,7 @@ export default function StudioPage() {
                                         </div>
                                         <audio
                                             ref={audioRef}
-                                            src={`${API_BASE}/audio/${currentGeneration.job_id}.wav`}
+                                            src={`${API_BASE}/audio/${currentGeneration.job_id}/preview`}
                                             onTimeUpdate={handleTimeUpdate}
                                             onEnded={() => setIsPlaying(false)}
                                             onLoadedMetadata={handleTimeUpdate}
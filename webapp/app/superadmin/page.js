@@ -36,32 +36,50 @@ export default function SuperAdminPage() {
 
     const fetchUsers = async (token) => {
         try {
-            const res = await fetch(`${API_BASE}/admin/users?token=${token}`);
-            if (res.ok) {
+            // The listing is keyset-paginated: follow next_cursor to the last page
+            const allUsers = [];
+            let total = null;
+            let cursor = null;
+            do {
+                const params = new URLSearchParams({ token, limit: '200' });
+                if (cursor) {
+                    params.set('cursor', cursor);
+                } else {
+                    params.set('include_total', 'true');
+                }
+                const res = await fetch(`${API_BASE}/admin/users?${params}`);
+                if (!res.ok) {
+                    alert('Error al cargar usuarios');
+                    router.push('/dashboard');
+                    return;
+                }
                 const data = await res.json();
-                setUsers(data.users || []);
+                allUsers.push(...(data.users || []));
+                if (data.total !== undefined) {
+                    total = data.total;
+                }
+                cursor = data.next_cursor;
+            } while (cursor);
 
-                // Calculate stats
-                const plans = {};
-                let totalTokens = 0;
-                let totalCost = 0;
+            setUsers(allUsers);
 
-                data.users?.forEach(u => {
-                    plans[u.plan] = (plans[u.plan] || 0) + 1;
-                    totalTokens += u.usage?.tokens_used || 0;
-                    totalCost += u.usage?.estimated_cost_usd || 0;
-                });
+            // Calculate stats
+            const plans = {};
+            let totalTokens = 0;
+            let totalCost = 0;
 
-                setStats({
-                    totalUsers: data.users?.length || 0,
-                    planDistribution: plans,
-                    totalTokens,
-                    totalCost
-                });
-            } else {
-                alert('Error al cargar usuarios');
-                router.push('/dashboard');
-            }
+            allUsers.forEach(u => {
+                plans[u.plan] = (plans[u.plan] || 0) + 1;
+                totalTokens += u.usage?.tokens_used || 0;
+                totalCost += u.usage?.estimated_cost_usd || 0;
+            });
+
+            setStats({
+                totalUsers: total ?? allUsers.length,
+                planDistribution: plans,
+                totalTokens,
+                totalCost
+            });
         } catch (err) {
             console.error(err);
         } finally {
@@ -4,6 +4,10 @@ import { useState, useEffect } from 'react';
 
 const API_BASE = 'http://localhost:8000/api';
 
+// Give up polling a queued generation after this long; back off between polls
+const GENERATION_POLL_TIMEOUT_MS = 15 * 60 * 1000;
+const GENERATION_POLL_MAX_DELAY_MS = 15000;
+
 /**
  * AntigravitySlider - Creative control for DGB music generation
  * 
@@ -370,7 +374,21 @@ export function GenerateMusicPanel({ token, onGenerated }) {
                 })
             });
 
-            const data = await res.json();
+            let data = await res.json();
+
+            // Generation runs in a background queue; poll until it finishes
+            const pollDeadline = Date.now() + GENERATION_POLL_TIMEOUT_MS;
+            let pollDelay = 2000;
+            while (data.success && (data.status === 'queued' || data.status === 'running')) {
+                if (Date.now() + pollDelay > pollDeadline) {
+                    data = { error: 'La generación está tardando demasiado. Revisa tu historial más tarde.' };
+                    break;
+                }
+                await new Promise(resolve => setTimeout(resolve, pollDelay));
+                pollDelay = Math.min(pollDelay * 1.5, GENERATION_POLL_MAX_DELAY_MS);
+                const statusRes = await fetch(`${API_BASE}/generate/status/${data.job_id}?token=${token}`);
+                data = await statusRes.json();
+            }
 
             if (data.success) {
                 setResult(data);